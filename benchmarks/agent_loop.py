@@ -0,0 +1,155 @@
+"""
+Benchmark: end-to-end throughput and decision latency of run_agent(), offline.
+
+Runs the real agent loop (agent.py, image_handling.py, models.py and the OpenAI client)
+against a ReplaySandbox and a StubModelServer on localhost, so no E2B sandbox and no
+OpenRouter calls are needed. Frames come from a recorded session, a directory or a
+synthetic scene; model answers and latencies are replayed from the session or drawn
+from the given distributions, with a fixed seed.
+
+Reports iterations per second, p50 / p99 decision latency (capture to action in the
+pipelined loop, the whole iteration in the serial one) and the per-stage times the
+loop recorded.
+
+    python -m benchmarks.agent_loop
+    python -m benchmarks.agent_loop --pipeline-depth 2 --aiming-latency lognormal:1.2:0.4
+    python -m benchmarks.agent_loop --session images/20250101_120000
+    python -m benchmarks.agent_loop --async --iterations 50 --aiming-latency 0.3 --gameplay-latency 0.5
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.replay_sandbox import ReplaySandbox
+from benchmarks.replay_server import LatencyDistribution, ResponseScript, StubModelServer, session_latencies
+from benchmarks.thumbnail_encodes import frames_from_dir, synthetic_frames
+from counter_strike.agent import run_agent
+from counter_strike.async_agent import arun_agent
+from counter_strike.session_recording import SessionReader
+from tracing import Tracer, set_tracer
+from llms.models import AimingModel, OpenRouterGameplayModel
+from llms.tools import MoveTool
+
+
+API_KEY_NAME = "OPENROUTER_API_KEY"
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def summarize(directory: str, wall_time: float) -> Dict:
+    """Throughput, decision latency and stage times of the recorded session in `directory`."""
+    decision = []
+    stages: Dict[str, List[float]] = {}
+    with SessionReader(directory) as session:
+        for iteration in session.iterations():
+            data = session.iteration_data(iteration)
+            if not data:
+                continue
+            latency = data.get("capture_to_action_time") or data.get("iteration_time")
+            if latency:
+                decision.append(latency)
+            for name in ("aiming_time", "gameplay_time"):
+                if data.get(name) is not None:
+                    stages.setdefault(name[:-len("_time")], []).append(data[name])
+            for name, seconds in (data.get("stage_times") or {}).items():
+                stages.setdefault(f"stage:{name}", []).append(seconds)
+
+    return {
+        "iterations": len(decision),
+        "iterations_per_s": len(decision) / wall_time if wall_time else 0.0,
+        "decision_p50_s": percentile(decision, 50),
+        "decision_p99_s": percentile(decision, 99),
+        "stages": {name: (percentile(values, 50), percentile(values, 99)) for name, values in stages.items()},
+    }
+
+
+def print_summary(summary: Dict):
+    print(f"\n{summary['iterations']} iterations, {summary['iterations_per_s']:.2f} iterations/s")
+    print(f"decision latency: p50 {1000 * summary['decision_p50_s']:.0f}ms, "
+          f"p99 {1000 * summary['decision_p99_s']:.0f}ms")
+    print(f"{'stage':>16} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, (p50, p99) in sorted(summary["stages"].items()):
+        print(f"{name:>16} {1000 * p50:>8.0f} {1000 * p99:>8.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--pipeline-depth", type=int, default=0, help="as run_agent's pipeline_depth")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="run arun_agent() instead")
+    parser.add_argument("--session", help="replay the frames, answers and model latencies of this recorded session")
+    parser.add_argument("--frames-dir", help="serve the screenshots in this directory")
+    parser.add_argument("--frames", type=int, default=30, help="number of synthetic frames")
+    parser.add_argument("--aiming-latency", default="lognormal:1.0:0.3",
+                        help="'0.8', 'constant:0.8' or 'lognormal:<median>:<sigma>' seconds")
+    parser.add_argument("--gameplay-latency", default="lognormal:1.5:0.3")
+    parser.add_argument("--screenshot-latency", type=float, default=0.15, help="seconds per screenshot")
+    parser.add_argument("--input-latency", type=float, default=0.05, help="seconds per input command")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of model calls answered with a 429")
+    parser.add_argument("--hit-rate", type=float, default=0.3, help="share of synthetic aiming answers with a target")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace-dir", help="also write the spans (trace.jsonl) and Prometheus metrics (agent.prom) here")
+    parser.add_argument("--verbose", action="store_true", help="print the progress of every iteration")
+    args = parser.parse_args()
+
+    tracer = Tracer(jsonl_path=os.path.join(args.trace_dir, "trace.jsonl") if args.trace_dir else None,
+                    prometheus_path=os.path.join(args.trace_dir, "agent.prom") if args.trace_dir else None,
+                    verbose=args.verbose)
+    set_tracer(tracer)
+
+    aiming_latency = LatencyDistribution.parse(args.aiming_latency)
+    gameplay_latency = LatencyDistribution.parse(args.gameplay_latency)
+    sandbox_latencies = dict(screenshot_latency=args.screenshot_latency, input_latency=args.input_latency)
+    if args.session:
+        desktop = ReplaySandbox.from_session(args.session, **sandbox_latencies)
+        with SessionReader(args.session) as session:
+            responses = ResponseScript.from_session(session)
+            recorded = session_latencies(session)
+        aiming_latency = recorded.get("aiming", aiming_latency)
+        gameplay_latency = recorded.get("gameplay", gameplay_latency)
+    else:
+        images = frames_from_dir(args.frames_dir) if args.frames_dir else synthetic_frames(args.frames, seed=args.seed)
+        desktop = ReplaySandbox.from_images(images, **sandbox_latencies)
+        responses = ResponseScript.synthetic(hit_rate=args.hit_rate, seed=args.seed)
+
+    print(f"Replaying {len(desktop.frames)} frames, aiming latency {aiming_latency}, "
+          f"gameplay latency {gameplay_latency}")
+    # the OpenAI client wants a key, the stub server ignores it
+    os.environ.setdefault(API_KEY_NAME, "replay")
+
+    with StubModelServer(aiming_latency=aiming_latency, gameplay_latency=gameplay_latency, responses=responses,
+                         error_rate=args.error_rate, seed=args.seed) as server, \
+            tempfile.TemporaryDirectory() as logging_path:
+        aiming_model = AimingModel(model="qwen/qwen2.5-vl-72b-instruct", api_key_name=API_KEY_NAME,
+                                   base_url=server.url)
+        move_tool = MoveTool(desktop=desktop)
+        gameplay_model = OpenRouterGameplayModel(tools={move_tool.name: move_tool}, api_key_name=API_KEY_NAME,
+                                                 base_url=server.url)
+
+        start = time.perf_counter()
+        if args.use_async:
+            asyncio.run(arun_agent(aiming_model=aiming_model, gameplay_model=gameplay_model, desktop=desktop,
+                                   iterations=args.iterations, image_logging_path=logging_path))
+        else:
+            run_agent(aiming_model=aiming_model, gameplay_model=gameplay_model, desktop=desktop,
+                      iterations=args.iterations, image_logging_path=logging_path,
+                      pipeline_depth=args.pipeline_depth)
+        wall_time = time.perf_counter() - start
+
+        session_dir = os.path.join(logging_path, os.listdir(logging_path)[0])
+        print_summary(summarize(session_dir, wall_time))
+        print(f"Model server: {server.report()}")
+        print(f"Sandbox: {desktop.report()}")
+    tracer.close()
+
+
+if __name__ == "__main__":
+    main()
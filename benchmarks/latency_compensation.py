@@ -0,0 +1,157 @@
+"""
+Benchmark: hit rate against model latency, with and without latency compensation.
+
+Simulates the agent loop against moving targets. A frame is captured, the aiming model
+answers `latency` seconds later with the target's position in that frame (plus some
+detection noise), and the agent aims at it. Meanwhile the gameplay turns and the shots
+of the other pipeline slots move the view. A shot hits when the aim point is within
+`--hit-radius` pixels of where the target is at the time of the shot.
+
+    none       aims at the point of the old frame, as run_agent() without compensator
+    reproject  LatencyCompensator(lead=False): only our own camera motion is undone
+    lead       LatencyCompensator(): camera motion and target velocity
+
+The latencies are fixed values, or with --session the capture-to-action times of a
+recorded session (see session_recording), as a distribution.
+
+    python -m benchmarks.latency_compensation
+    python -m benchmarks.latency_compensation --session images/20250101_120000
+"""
+
+import argparse
+import heapq
+import math
+
+import numpy as np
+
+from counter_strike.compensation import CameraMotion, LatencyCompensator
+from counter_strike.image_handling import get_mouse_movements
+from counter_strike.session_recording import SessionReader
+
+
+CENTER = (960, 540)
+TURN_PX = 420  # MoveTool turns move the mouse 420 pixels from the centre
+
+
+class Target:
+    """A target moving at a constant velocity in view-independent coordinates, re-drawn now and then."""
+
+    def __init__(self, rng: np.random.Generator, max_speed: float):
+        self.rng = rng
+        self.max_speed = max_speed
+        self.respawn(0.0, camera=(0.0, 0.0))
+
+    def respawn(self, now: float, camera):
+        angle = self.rng.uniform(0, 2 * math.pi)
+        speed = self.rng.uniform(0, self.max_speed)
+        # appears on screen, near the horizon band
+        self.x = self.rng.uniform(CENTER[0] - 500, CENTER[0] + 500) - camera[0]
+        self.y = self.rng.uniform(CENTER[1] - 120, CENTER[1] + 120) - camera[1]
+        self.vx, self.vy = speed * math.cos(angle), 0.3 * speed * math.sin(angle)
+        self.since = now
+
+    def screen(self, now: float, camera):
+        dt = now - self.since
+        return self.x + self.vx * dt + camera[0], self.y + self.vy * dt + camera[1]
+
+
+def simulate(latencies: np.ndarray, mode: str, shots: int, depth: int, turn_rate: float,
+             max_speed: float, noise: float, hit_radius: float, motion_error: float, seed: int):
+    rng = np.random.default_rng(seed)
+    motion = CameraMotion(screen_center=CENTER)
+    compensator = None if mode == "none" else LatencyCompensator(motion, lead=mode == "lead", actuation_delay=0.0)
+    # how the view really turns; `motion_error` is the relative error of the aim multiplier
+    truth = CameraMotion(screen_center=CENTER, aim_multiplier=motion.aim_multiplier / (1 + motion_error))
+    target = Target(rng, max_speed)
+
+    def turn(now: float, moves):
+        motion.record_mouse_moves(moves, at=now)
+        truth.record_mouse_moves(moves, at=now)
+
+    events = []  # (time, order, kind, payload)
+    order = 0
+    now = 0.0
+    for _ in range(shots):
+        latency = float(rng.choice(latencies))
+        heapq.heappush(events, (now + latency, order, "act", now))
+        order += 1
+        now += latency / depth  # the next capture starts while this frame is still with the models
+    t = 0.0
+    while t < now + latencies.max():
+        t += rng.exponential(1 / turn_rate) if turn_rate > 0 else math.inf
+        heapq.heappush(events, (t, order, "turn", None))
+        order += 1
+
+    captures = {}
+    hits = fired = 0
+    while events:
+        at, _, kind, payload = heapq.heappop(events)
+        if kind == "turn":
+            turn(at, [(CENTER[0] + rng.choice([-TURN_PX, TURN_PX]), CENTER[1])])
+            continue
+
+        captured_at = payload
+        if captured_at not in captures:
+            x, y = target.screen(captured_at, truth.offset_at(captured_at))
+            captures[captured_at] = (x + rng.normal(0, noise), y + rng.normal(0, noise))
+        seen_x, seen_y = captures.pop(captured_at)
+        if not (0 <= seen_x < 2 * CENTER[0] and 0 <= seen_y < 2 * CENTER[1]):
+            target.respawn(at, truth.offset_at(at))
+            continue
+
+        point = {"x": int(seen_x), "y": int(seen_y)}
+        if compensator is not None:
+            point = compensator.compensate(point, captured_at, now=at)
+        true_x, true_y = target.screen(at, truth.offset_at(at))
+        fired += 1
+        if math.hypot(point["x"] - true_x, point["y"] - true_y) <= hit_radius:
+            hits += 1
+        turn(at, [(move["x"], move["y"]) for move in get_mouse_movements(point)])
+        if rng.random() < 0.3:  # the target dies or leaves
+            target.respawn(at, truth.offset_at(at))
+
+    return hits / fired if fired else 0.0
+
+
+def session_latencies(directory: str) -> np.ndarray:
+    latencies = []
+    with SessionReader(directory) as session:
+        for iteration in session.iterations():
+            data = session.iteration_data(iteration) or {}
+            latency = data.get("capture_to_action_time") or data.get("iteration_time")
+            if latency:
+                latencies.append(latency)
+    if not latencies:
+        raise ValueError(f"No iteration timings in the session {directory}.")
+    return np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, nargs="+", default=[0.25, 0.5, 1.0, 2.0, 3.0],
+                        help="model latencies in seconds")
+    parser.add_argument("--session", help="use the latency distribution of this recorded session instead")
+    parser.add_argument("--shots", type=int, default=2000)
+    parser.add_argument("--depth", type=int, default=2, help="frames in flight, as run_agent's pipeline_depth")
+    parser.add_argument("--turn-rate", type=float, default=0.3, help="gameplay turns per second")
+    parser.add_argument("--max-speed", type=float, default=60.0, help="target speed in screen pixels / s")
+    parser.add_argument("--noise", type=float, default=4.0, help="detection noise in pixels")
+    parser.add_argument("--hit-radius", type=float, default=20.0)
+    parser.add_argument("--motion-error", type=float, default=0.1,
+                        help="relative error of the aim multiplier the compensation assumes")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    settings = [(args.session, session_latencies(args.session))] if args.session else \
+        [(f"{latency:.2f}s", np.array([latency])) for latency in args.latency]
+
+    modes = ("none", "reproject", "lead")
+    print(f"{'latency':>10} " + " ".join(f"{mode:>9}" for mode in modes))
+    for name, latencies in settings:
+        rates = [simulate(latencies, mode, args.shots, args.depth, args.turn_rate, args.max_speed,
+                          args.noise, args.hit_radius, args.motion_error, args.seed) for mode in modes]
+        print(f"{name:>10} " + " ".join(f"{rate:>9.1%}" for rate in rates))
+
+
+if __name__ == "__main__":
+    main()
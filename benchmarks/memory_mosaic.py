@@ -0,0 +1,64 @@
+"""
+Benchmark: size of the gameplay request's screenshot history, one image per iteration vs. a mosaic.
+
+Prints the data URL bytes, the number of image parts and the estimated image tokens of the
+history for growing memory sizes. Providers add a fixed overhead per image part on top of the
+tokens (e.g. OpenAI bills 85 base tokens per image), which the mosaic pays only once.
+
+    python -m benchmarks.memory_mosaic
+    python -m benchmarks.memory_mosaic --frames-dir images/run_01 --per-image-overhead 85
+"""
+
+import argparse
+import io
+import time
+
+from PIL import Image
+
+from counter_strike.agent import AgentMemory, update_memory
+from counter_strike.frame import Frame
+
+from .thumbnail_encodes import frames_from_dir, synthetic_frames
+
+
+def to_frame(image: Image.Image) -> Frame:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return Frame(buffer.getvalue())
+
+
+def measure(frames, memory: int, mosaic: bool):
+    agent_memory = AgentMemory(max_iterations=memory, max_bytes=None, mosaic=mosaic)
+    update_time = 0.0
+    for i, frame in enumerate(frames):
+        start = time.perf_counter()
+        update_memory(agent_memory, f"Action {i}", frame)
+        update_time += time.perf_counter() - start
+
+    parts = [c for c in agent_memory.get_image_memory() if c.get("type") == "image_url"]
+    report = agent_memory.report()
+    return len(parts), report["bytes"], report["image_tokens"], 1000 * update_time / len(frames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=12, help="number of synthetic frames")
+    parser.add_argument("--frames-dir", help="use the screenshots in this directory instead")
+    parser.add_argument("--memory", type=int, nargs="+", default=[2, 4, 6, 8])
+    parser.add_argument("--per-image-overhead", type=int, default=85, help="provider tokens per image part")
+    args = parser.parse_args()
+
+    images = frames_from_dir(args.frames_dir) if args.frames_dir else synthetic_frames(args.frames)
+    frames = [to_frame(image) for image in images]
+
+    print(f"{'memory':>6} {'mode':>9} {'parts':>5} {'KB':>8} {'tokens':>7} {'+overhead':>9} {'ms/update':>9}")
+    for memory in args.memory:
+        for mosaic in (False, True):
+            # fresh frames, so no mode reuses a thumbnail cached on the frames by the other
+            parts, size, tokens, update_ms = measure([Frame(f.data) for f in frames], memory, mosaic)
+            print(f"{memory:>6} {'mosaic' if mosaic else 'separate':>9} {parts:>5} {size / 1024:>8.1f} "
+                  f"{tokens:>7} {tokens + parts * args.per_image_overhead:>9} {update_ms:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
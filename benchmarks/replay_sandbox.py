@@ -0,0 +1,122 @@
+"""
+A fake e2b Sandbox for offline benchmarks.
+
+It serves recorded, directory or synthetic frames as desktop.screenshot() PNGs, one
+after the other in a fixed order, and logs the input commands instead of running them.
+Both take a configurable latency, standing in for the round trip to the sandbox.
+
+    desktop = ReplaySandbox.from_session("images/20250101_120000", screenshot_latency=0.15)
+    run_agent(..., desktop=desktop)
+    print(desktop.report())
+"""
+
+import io
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image
+
+from counter_strike.session_recording import SessionReader
+
+
+def encode_png(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+class ReplayCommands:
+    """desktop.commands: records the command and returns an empty, successful result."""
+
+    def __init__(self, sandbox: "ReplaySandbox"):
+        self._sandbox = sandbox
+
+    def run(self, cmd: str, envs: Optional[Dict] = None, timeout: Optional[float] = None, **kwargs):
+        self._sandbox._input(cmd)
+        return SimpleNamespace(stdout="", stderr="", exit_code=0)
+
+
+class ReplaySandbox:
+    def __init__(self,
+                 frames: Iterable[bytes],
+                 screenshot_latency: float = 0.0,
+                 input_latency: float = 0.0,
+                 loop: bool = True):
+        """
+        :param frames: encoded screenshots, served in this order.
+        :param screenshot_latency: seconds every screenshot() takes.
+        :param input_latency: seconds every input command takes.
+        :param loop: start over after the last frame, otherwise keep serving the last one.
+        """
+        self.frames: List[bytes] = list(frames)
+        if not self.frames:
+            raise ValueError("The replay sandbox needs at least one frame.")
+        self.screenshot_latency = screenshot_latency
+        self.input_latency = input_latency
+        self.loop = loop
+        self.commands = ReplayCommands(self)
+        self._display = ":0"
+
+        self._next = 0
+        self._lock = threading.Lock()
+        self.screenshots = 0
+        # (perf_counter time, command or call)
+        self.input_log: List[Tuple[float, str]] = []
+
+    @classmethod
+    def from_session(cls, directory: str, **kwargs) -> "ReplaySandbox":
+        with SessionReader(directory) as session:
+            frames = [bytes(session.frame(iteration).data) for iteration in session.iterations()
+                      if session.entry(iteration, "frame") is not None]
+        return cls(frames, **kwargs)
+
+    @classmethod
+    def from_images(cls, images: Iterable[Image.Image], **kwargs) -> "ReplaySandbox":
+        """From PIL images, e.g. thumbnail_encodes.frames_from_dir() or synthetic_frames()."""
+        return cls([encode_png(image) for image in images], **kwargs)
+
+    def screenshot(self, format: str = "bytes"):
+        if self.screenshot_latency:
+            time.sleep(self.screenshot_latency)
+        with self._lock:
+            data = self.frames[self._next]
+            self.screenshots += 1
+            if self._next + 1 < len(self.frames):
+                self._next += 1
+            elif self.loop:
+                self._next = 0
+        if format == "bytes":
+            return data
+        if format == "bytearray":
+            return bytearray(data)
+        raise ValueError(f"Unsupported screenshot format '{format}'.")
+
+    def _input(self, call: str):
+        if self.input_latency:
+            time.sleep(self.input_latency)
+        with self._lock:
+            self.input_log.append((time.perf_counter(), call))
+
+    def move_mouse(self, x: int, y: int):
+        self._input(f"move_mouse {x} {y}")
+
+    def left_click(self, *args, **kwargs):
+        self._input("left_click")
+
+    def press(self, key):
+        self._input(f"press {key}")
+
+    def write(self, text: str, **kwargs):
+        self._input(f"write {text}")
+
+    def wait(self, ms: int):
+        time.sleep(ms / 1000)
+
+    def kill(self):
+        pass
+
+    def report(self) -> Dict:
+        with self._lock:
+            return {"frames": len(self.frames), "screenshots": self.screenshots, "inputs": len(self.input_log)}
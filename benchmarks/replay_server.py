@@ -0,0 +1,302 @@
+"""
+A stub OpenAI-compatible chat completions server for offline benchmarks.
+
+It answers POST /v1/chat/completions on localhost, streaming (server-sent events) or not,
+after a latency drawn from a LatencyDistribution. Requests with `tools` are gameplay
+requests and get a MoveTool call, the others are aiming requests and get a point or "None".
+The answers are replayed from a recorded session or drawn from a seeded generator.
+
+    with StubModelServer(aiming_latency=LatencyDistribution.parse("lognormal:1.2:0.4")) as server:
+        aiming_model = AimingModel(base_url=server.url, ...)
+"""
+
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence
+
+from counter_strike.session_recording import SessionReader
+
+
+class LatencyDistribution:
+    """Seconds per response: constant, lognormal or the empirical distribution of recorded samples."""
+    KINDS = ("constant", "lognormal", "empirical")
+
+    def __init__(self, kind: str = "constant", median: float = 1.0, sigma: float = 0.0,
+                 samples: Optional[Sequence[float]] = None):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown latency distribution '{kind}'. Choose from {list(self.KINDS)}.")
+        if kind == "empirical" and not samples:
+            raise ValueError("An empirical latency distribution needs samples.")
+        self.kind = kind
+        self.median = median
+        self.sigma = sigma
+        self.samples = list(samples or [])
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyDistribution":
+        """'0.8' or 'constant:0.8', 'lognormal:<median>:<sigma>'."""
+        parts = spec.split(":")
+        if len(parts) == 1:
+            return cls("constant", float(parts[0]))
+        if parts[0] == "constant" and len(parts) == 2:
+            return cls("constant", float(parts[1]))
+        if parts[0] == "lognormal" and len(parts) == 3:
+            return cls("lognormal", float(parts[1]), float(parts[2]))
+        raise ValueError(f"Can't parse the latency '{spec}'. Use '0.8', 'constant:0.8' or 'lognormal:1.2:0.4'.")
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "constant":
+            return self.median
+        if self.kind == "lognormal":
+            return rng.lognormvariate(0, self.sigma) * self.median
+        return rng.choice(self.samples)
+
+    def __repr__(self):
+        if self.kind == "empirical":
+            return f"empirical({len(self.samples)} samples)"
+        return f"{self.kind}({self.median}s" + (f", sigma {self.sigma})" if self.kind == "lognormal" else ")")
+
+
+class ResponseScript:
+    """
+    What the stub answers, in order: aiming contents and gameplay tool calls, each a list of
+    {"name", "arguments"} as agent.raw_tool_calls() records them. A call without a name is
+    made to the first tool of the request.
+    """
+
+    def __init__(self, aiming: Sequence[str], gameplay: Sequence[List[Dict]]):
+        self._aiming = itertools.cycle(aiming)
+        self._gameplay = itertools.cycle(gameplay)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def synthetic(cls, hit_rate: float = 0.3, count: int = 100, seed: int = 0) -> "ResponseScript":
+        """Points near the crosshair for `hit_rate` of the aiming answers, "None" otherwise."""
+        rng = random.Random(seed)
+        aiming = [json.dumps({"point": {"x": rng.randint(660, 1260), "y": rng.randint(440, 640)}})
+                  if rng.random() < hit_rate else "None" for _ in range(count)]
+        gameplay = [[{"name": None, "arguments": json.dumps(
+            {"key_sequence": "".join(rng.choice("wwwasdrl") for _ in range(rng.randint(2, 6)))})}]
+            for _ in range(count)]
+        return cls(aiming, gameplay)
+
+    @classmethod
+    def from_session(cls, session: SessionReader) -> "ResponseScript":
+        """The raw answers the models gave in a recorded session."""
+        aiming, gameplay = [], []
+        for iteration in session.iterations():
+            data = session.iteration_data(iteration) or {}
+            aiming += [content if content is not None else "" for content in data.get("aiming_responses") or []]
+            if data.get("gameplay_tool_calls"):
+                gameplay.append(data["gameplay_tool_calls"])
+        if not aiming and not gameplay:
+            raise ValueError("The session has no recorded model answers. Sessions recorded before the raw "
+                             "answers were logged can't be replayed.")
+        return cls(aiming or ["None"], gameplay or [[{"name": None, "arguments": json.dumps({"key_sequence": "w"})}]])
+
+    def next_aiming(self) -> str:
+        with self._lock:
+            return next(self._aiming)
+
+    def next_gameplay(self) -> List[Dict]:
+        with self._lock:
+            return next(self._gameplay)
+
+
+def session_latencies(session: SessionReader) -> Dict[str, LatencyDistribution]:
+    """
+    Empirical aiming and gameplay latency distributions of a recorded session. The gameplay
+    call runs next to the aiming call and its recorded time is only the wait after the aiming
+    answer, so its latency is taken as the sum of both where it was waited for.
+    """
+    samples = {"aiming": [], "gameplay": []}
+    for iteration in session.iterations():
+        data = session.iteration_data(iteration) or {}
+        aiming_time, gameplay_time = data.get("aiming_time") or 0, data.get("gameplay_time") or 0
+        if aiming_time:
+            samples["aiming"].append(aiming_time)
+        if gameplay_time:
+            samples["gameplay"].append(aiming_time + gameplay_time)
+    return {name: LatencyDistribution("empirical", samples=values) for name, values in samples.items() if values}
+
+
+class StubModelServer:
+    def __init__(self,
+                 aiming_latency: LatencyDistribution = LatencyDistribution("constant", 1.0),
+                 gameplay_latency: LatencyDistribution = LatencyDistribution("constant", 1.5),
+                 responses: Optional[ResponseScript] = None,
+                 error_rate: float = 0.0,
+                 chunks: int = 4,
+                 seed: int = 0,
+                 port: int = 0):
+        """
+        :param responses: the answers, ResponseScript.synthetic() by default.
+        :param error_rate: share of requests answered with a 429 and Retry-After, to exercise the
+            rate limiter.
+        :param chunks: number of content chunks of a streamed answer. The latency is spent before
+            the first one, the rest follow right away.
+        :param port: 0 picks a free port.
+        """
+        self.aiming_latency = aiming_latency
+        self.gameplay_latency = gameplay_latency
+        self.responses = responses or ResponseScript.synthetic(seed=seed)
+        self.error_rate = error_rate
+        self.chunks = chunks
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = {"aiming": 0, "gameplay": 0, "throttled": 0}
+        self.latencies: Dict[str, List[float]] = {"aiming": [], "gameplay": []}
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-model-server", daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def _draw(self, kind: str):
+        with self._lock:
+            self.requests[kind] += 1
+            if self.error_rate and self._rng.random() < self.error_rate:
+                self.requests["throttled"] += 1
+                return None
+            latency = (self.aiming_latency if kind == "aiming" else self.gameplay_latency).sample(self._rng)
+            self.latencies[kind].append(latency)
+            return latency
+
+    def _completion(self, request: Dict, kind: str) -> Dict:
+        if kind == "aiming":
+            message = {"role": "assistant", "content": self.responses.next_aiming()}
+            finish_reason = "stop"
+        else:
+            # unnamed calls go to the first tool of the request, the agent's MoveTool
+            default_name = request["tools"][0]["function"]["name"]
+            message = {"role": "assistant", "content": None, "tool_calls": [{
+                "id": f"call_{uuid.uuid4().hex[:12]}", "type": "function",
+                "function": {"name": call.get("name") or default_name, "arguments": call["arguments"]}}
+                for call in self.responses.next_gameplay()]}
+            finish_reason = "tool_calls"
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": self._usage(request, message),
+        }
+
+    @staticmethod
+    def _usage(request: Dict, message: Dict) -> Dict:
+        """A rough count of 4 characters a token, images included as their base64 text."""
+        prompt_tokens = len(json.dumps(request.get("messages", []))) // 4
+        completion_tokens = max(1, len(json.dumps(message)) // 4)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+    def _stream_chunks(self, completion: Dict, include_usage: bool = False) -> List[Dict]:
+        message = completion["choices"][0]["message"]
+        deltas = [{"role": "assistant", "content": ""}]
+        if message.get("tool_calls"):
+            for index, call in enumerate(message["tool_calls"]):
+                arguments = call["function"]["arguments"]
+                size = max(1, -(-len(arguments) // self.chunks))
+                deltas.append({"tool_calls": [{"index": index, "id": call["id"], "type": "function",
+                                               "function": {"name": call["function"]["name"], "arguments": ""}}]})
+                deltas += [{"tool_calls": [{"index": index, "function": {"arguments": arguments[i:i + size]}}]}
+                           for i in range(0, len(arguments), size)]
+        else:
+            content = message["content"]
+            size = max(1, -(-len(content) // self.chunks))
+            deltas += [{"content": content[i:i + size]} for i in range(0, len(content), size)]
+
+        base = {key: completion[key] for key in ("id", "created", "model")}
+        chunks = [dict(base, object="chat.completion.chunk",
+                       choices=[{"index": 0, "delta": delta, "finish_reason": None}]) for delta in deltas]
+        chunks.append(dict(base, object="chat.completion.chunk",
+                           choices=[{"index": 0, "delta": {}, "finish_reason": completion["choices"][0]["finish_reason"]}]))
+        if include_usage:
+            # as OpenAI: a last chunk without choices
+            chunks.append(dict(base, object="chat.completion.chunk", choices=[], usage=completion["usage"]))
+        return chunks
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass  # no access log on stderr
+
+            def _send_json(self, status: int, body: Dict, headers: Optional[Dict] = None):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                    return
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                kind = "gameplay" if request.get("tools") else "aiming"
+
+                latency = server._draw(kind)
+                if latency is None:
+                    self._send_json(429, {"error": {"message": "Rate limited by the stub server"}},
+                                    headers={"Retry-After": "0.2"})
+                    return
+                completion = server._completion(request, kind)
+
+                try:
+                    time.sleep(latency)
+                    if not request.get("stream"):
+                        self._send_json(200, completion)
+                        return
+
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.send_header("Cache-Control", "no-cache")
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    include_usage = (request.get("stream_options") or {}).get("include_usage", False)
+                    for chunk in server._stream_chunks(completion, include_usage):
+                        self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self._write_chunk(b"data: [DONE]\n\n")
+                    self._write_chunk(b"")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client cancelled the request, e.g. after an early answer
+
+            def _write_chunk(self, data: bytes):
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+    def report(self) -> Dict:
+        with self._lock:
+            report = dict(self.requests)
+            for kind, values in self.latencies.items():
+                report[f"avg_{kind}_latency_s"] = round(sum(values) / len(values), 3) if values else 0.0
+            return report
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
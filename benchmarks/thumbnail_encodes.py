@@ -0,0 +1,102 @@
+"""
+Micro-benchmark: JPEG encodes per memory thumbnail.
+
+Compares the stateless quality search of compress_and_scale_image() with the
+JpegQualityController on a sequence of similar frames, as the agent produces them.
+
+    python -m benchmarks.thumbnail_encodes
+    python -m benchmarks.thumbnail_encodes --frames-dir images/run_01 --target-kb 12
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from counter_strike import image_handling
+from counter_strike.image_handling import JpegQualityController, compress_and_scale_image
+
+
+def synthetic_frames(count: int, size=(1920, 1080), seed: int = 0):
+    """A textured scene panned a few pixels per frame, with a moving block, like a bot turning around."""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    scene = rng.integers(0, 255, size=(height // 8, width // 4, 3), dtype=np.uint8)
+    scene = np.asarray(Image.fromarray(scene).resize((width * 2, height), Image.Resampling.BICUBIC))
+    for i in range(count):
+        offset = (i * 12) % width
+        pixels = scene[:, offset:offset + width].copy()
+        x = 200 + (i * 37) % (width - 400)
+        pixels[400:600, x:x + 120] = (180, 40, 40)
+        yield Image.fromarray(pixels)
+
+
+def frames_from_dir(path: str):
+    for name in sorted(os.listdir(path)):
+        if name.lower().endswith((".png", ".jpg", ".jpeg", ".webp")):
+            with Image.open(os.path.join(path, name)) as image:
+                yield image.convert("RGB")
+
+
+class CountingEncoder:
+    """Counts the calls of image_handling.encode_jpeg while active."""
+    def __init__(self):
+        self.calls = 0
+        self._original = image_handling.encode_jpeg
+
+    def __call__(self, img, quality):
+        self.calls += 1
+        return self._original(img, quality)
+
+    def __enter__(self):
+        image_handling.encode_jpeg = self
+        return self
+
+    def __exit__(self, *exc):
+        image_handling.encode_jpeg = self._original
+
+
+def run(frames, target_size_bytes: float, scale_percentage: int):
+    # scale once up front, so the timings only measure the encoding
+    frames = [frame.resize((max(1, frame.width * scale_percentage // 100),
+                            max(1, frame.height * scale_percentage // 100)), image_handling.RESAMPLE_METHOD)
+              for frame in frames]
+
+    with CountingEncoder() as counter:
+        start = time.perf_counter()
+        for frame in frames:
+            compress_and_scale_image(frame, target_size_bytes, scale_percentage=100)
+        search_time = time.perf_counter() - start
+    search_encodes = counter.calls
+
+    controller = JpegQualityController()
+    start = time.perf_counter()
+    for frame in frames:
+        compress_and_scale_image(frame, target_size_bytes, scale_percentage=100,
+                                 quality_controller=controller)
+    controller_time = time.perf_counter() - start
+
+    n = len(frames)
+    print(f"{n} frames, target {target_size_bytes / 1024:.1f} KB, scale {scale_percentage}%")
+    print(f"  search per frame:   {search_encodes / n:5.2f} encodes/frame, {1000 * search_time / n:6.2f} ms/frame")
+    print(f"  quality controller: {controller.encodes / n:5.2f} encodes/frame, "
+          f"{1000 * controller_time / n:6.2f} ms/frame, {controller.searches} searches, "
+          f"final quality {controller.quality}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=100, help="number of synthetic frames")
+    parser.add_argument("--frames-dir", help="use the screenshots in this directory instead")
+    parser.add_argument("--target-kb", type=float, default=10.0, help="thumbnail size target")
+    parser.add_argument("--scale", type=int, default=20, help="thumbnail scale percentage")
+    args = parser.parse_args()
+
+    frames = frames_from_dir(args.frames_dir) if args.frames_dir else synthetic_frames(args.frames)
+    run(frames, args.target_kb * 1024, args.scale)
+
+
+if __name__ == "__main__":
+    main()
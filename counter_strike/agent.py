@@ -2,19 +2,33 @@
 run_agent() is the main function which is getting imported from here
 """
 
+import base64
 import concurrent.futures
 import time 
 from e2b_desktop import Sandbox
 import collections
+import math
 import copy
-from typing import List, Dict
+import threading
+from typing import List, Dict, Optional
 
 from llms.models import OpenRouterGameplayModel, AimingModel
+from llms.hedging import HedgedAimingModel
+from llms.rate_limit import RetryBudget, is_retryable, rate_limiter_report
+from tracing import get_tracer, log
 
-from .controls import aim, shoot
-from .image_handling import draw_point, get_screenshot_message, get_screenshot_message_from_base64, \
-    get_mouse_movements, compress_and_scale_base64_image
-from .image_logging import ImageLoggingSettings
+from .controls import aim_and_shoot
+from .image_handling import get_mouse_movements, get_screenshot_message_from_base64, JpegQualityController, \
+    compress_and_scale_image, encode_jpeg, tile_images, RESAMPLE_METHOD
+from .frame import Frame, capture_frame
+from .image_logging import ImageLoggingSettings, IterationPaths
+from .pipeline import StagedPipeline, Stage, PipelineItem
+from .scheduler import InferenceScheduler, InferenceJob
+from .detection import AimingGate
+from .aim_transform import AimInputTransform, AimingView
+from .frame_change import FrameChangePolicy
+from .tracking import TargetTracker
+from .compensation import LatencyCompensator
 from .prompts import T_AIMING_PROMPT, CT_AIMING_PROMPT
 
 
@@ -31,6 +45,7 @@ class AgentSettings:
         
         self.open_router_key_name = open_router_api_key_name
         self.memory = memory
+        self.side = side
         if side == "CT":
             self.aiming_system_prompt = CT_AIMING_PROMPT
             self.team_choice = "2"
@@ -43,10 +58,177 @@ class AgentSettings:
             raise ValueError("Please choose a valid side from ['CT', 'T'].")
         
         
+# (up to age, scale percentage, target size percentage) of the memory thumbnails, newest first.
+# Age 0 is the latest iteration, None means "all older iterations".
+DEFAULT_MEMORY_TIERS = (
+    (1, 20, 50),
+    (3, 10, 50),
+    (None, 5, 50),
+)
+
+
+def estimate_image_tokens(width: int, height: int, patch_size: int = 28) -> int:
+    """Rough image token count of a vision model that splits images into patch_size patches (e.g. Qwen2.5-VL)."""
+    return -(-width // patch_size) * -(-height // patch_size)
+
+
+class MemoryEntry:
+    def __init__(self, action_message: List[Dict], contents: List[Dict], image=None, source_size: int = 0):
+        """
+        :param contents: the image_url dicts of this iteration
+        :param image: the newest-tier thumbnail, kept to re-encode the entry at lower tiers
+        :param source_size: size in bytes of the captured frame, the reference of the size targets
+        """
+        self.action_message = action_message
+        self.contents = contents
+        self.image = image
+        self.source_size = source_size
+        self.tier = 0
+        self.size = sum(len(c.get("image_url", {}).get("url", "")) for c in contents)
+        self.tokens = estimate_image_tokens(*image.size) if image is not None else 0
+
+
 class AgentMemory:
-    def __init__(self, max_iterations: int = 3):
-        # retain up to `max_iterations` of (actions, screenshots) pairs
+    def __init__(self,
+                 max_iterations: int = 3,
+                 thumbnail_quality: Optional[JpegQualityController] = None,
+                 max_bytes: Optional[int] = 256 * 1024,
+                 max_image_tokens: Optional[int] = None,
+                 tiers=DEFAULT_MEMORY_TIERS,
+                 mosaic: bool = False,
+                 mosaic_tile_scale: int = 10,
+                 mosaic_columns: Optional[int] = None,
+                 mosaic_quality: int = 80):
+        """
+        :param max_iterations: retain up to `max_iterations` of (actions, screenshots) pairs
+        :param max_bytes: budget for the data URLs of all remembered screenshots, oldest are dropped first
+        :param max_image_tokens: budget for the estimated image tokens of all remembered screenshots
+        :param tiers: resolution of the screenshots by age, see DEFAULT_MEMORY_TIERS.
+            Recent frames stay sharp, older frames are re-encoded smaller as they age.
+        :param mosaic: send the remembered screenshots as one labelled mosaic image instead of one
+            image per iteration, which saves the per-image overhead of the providers. The tiles are
+            `mosaic_tile_scale` percent of the screen, oldest top left, in `mosaic_columns` columns
+            (about square by default). The tiers do not apply in this mode.
+        """
         self.iterations = collections.deque(maxlen=max_iterations)
+        self.max_bytes = max_bytes
+        self.max_image_tokens = max_image_tokens
+        self.tiers = tiers
+        self.mosaic = mosaic
+        self.mosaic_tile_scale = mosaic_tile_scale
+        self.mosaic_columns = mosaic_columns
+        self.mosaic_quality = mosaic_quality
+        self.mosaic_builds = 0
+        self._mosaic_content: Optional[Dict] = None
+        self._mosaic_size = 0
+        self._mosaic_tokens = 0
+        # the JPEG quality of the screenshot thumbnails is tracked across iterations, per tier
+        self.thumbnail_quality = thumbnail_quality or JpegQualityController()
+        self._tier_quality = [self.thumbnail_quality] + [JpegQualityController() for _ in tiers[1:]]
+        # the gameplay context is rebuilt when the memory changes, not every time it is read
+        self._action_memory: List[Dict] = []
+        self._image_memory: List[Dict] = []
+        self.evicted = 0
+        self.retiered = 0
+        self.added = 0  # one per iteration acted on, skipped and stale frames never get here
+        # the pipelined loop reads the memory while the memory stage appends to it
+        self._lock = threading.Lock()
+
+    def _tier_for_age(self, age: int) -> int:
+        for i, (max_age, _, _) in enumerate(self.tiers):
+            if max_age is None or age < max_age:
+                return i
+        return len(self.tiers) - 1
+
+    def _encode(self, image, tier: int, source_size: int) -> Dict:
+        _, scale_percentage, target_size_percentage = self.tiers[tier]
+        data = compress_and_scale_image(image, source_size * target_size_percentage / 100, scale_percentage=100,
+                                        quality_controller=self._tier_quality[tier])
+        return get_screenshot_message_from_base64(base64.b64encode(data).decode("utf-8"))[0]["content"][0]
+
+    def _scaled(self, image, from_tier: int, to_tier: int):
+        ratio = self.tiers[to_tier][1] / self.tiers[from_tier][1]
+        return image.resize((max(1, int(image.width * ratio)), max(1, int(image.height * ratio))),
+                            RESAMPLE_METHOD)
+
+    def _over_budget(self, size: int, tokens: int) -> bool:
+        return (self.max_bytes is not None and size > self.max_bytes) \
+            or (self.max_image_tokens is not None and tokens > self.max_image_tokens)
+
+    def _mosaic_geometry(self, count: int):
+        columns = self.mosaic_columns or math.ceil(math.sqrt(count))
+        rows = math.ceil(count / columns)
+        ratio = self.mosaic_tile_scale / self.tiers[0][1]
+        reference = next(e.image for e in self.iterations if e.image is not None)
+        tile_size = (max(1, int(reference.width * ratio)), max(1, int(reference.height * ratio)))
+        return columns, rows, tile_size
+
+    def _build_mosaic(self):
+        """Tiles the remembered thumbnails into one image. Drops the oldest until it fits the budgets."""
+        while True:
+            entries = [e for e in self.iterations if e.image is not None]
+            if not entries:
+                self._mosaic_content, self._mosaic_size, self._mosaic_tokens = None, 0, 0
+                return
+            columns, rows, tile_size = self._mosaic_geometry(len(entries))
+            tokens = estimate_image_tokens(columns * tile_size[0], rows * tile_size[1])
+            if len(self.iterations) > 1 and self._over_budget(0, tokens):
+                self.iterations.popleft()
+                self.evicted += 1
+                continue
+
+            labels = [f"t-{len(entries) - i}" for i in range(len(entries))]
+            image = tile_images([e.image for e in entries], labels, tile_size, columns)
+            data = encode_jpeg(image, quality=self.mosaic_quality)
+            content = get_screenshot_message_from_base64(base64.b64encode(data).decode("utf-8"))[0]["content"][0]
+            size = len(content["image_url"]["url"])
+            if len(self.iterations) > 1 and self._over_budget(size, tokens):
+                self.iterations.popleft()
+                self.evicted += 1
+                continue
+
+            self._mosaic_content, self._mosaic_size, self._mosaic_tokens = content, size, tokens
+            self.mosaic_builds += 1
+            return
+
+    def _update(self):
+        """Re-tiers aged entries, enforces the budgets and rebuilds the gameplay context."""
+        if self.mosaic:
+            self._build_mosaic()
+            mosaic_count = sum(1 for e in self.iterations if e.image is not None)
+            history = []
+            if self._mosaic_content is not None:
+                history = [{"type": "text",
+                            "text": f"The next image is a mosaic of your last {mosaic_count} screenshots, "
+                                    f"labelled t-{mosaic_count} (oldest, top left) to t-1 (newest). "
+                                    f"The image after it is the current frame."},
+                           self._mosaic_content]
+            self._action_memory = [message for entry in self.iterations for message in entry.action_message]
+            self._image_memory = history + [c for entry in self.iterations if entry.image is None
+                                            for c in entry.contents]
+            return
+
+        newest = len(self.iterations) - 1
+        for index, entry in enumerate(self.iterations):
+            if entry.image is None:
+                continue
+            tier = self._tier_for_age(newest - index)
+            if tier > entry.tier:
+                image = self._scaled(entry.image, 0, tier)
+                entry.contents = [self._encode(image, tier, entry.source_size)]
+                entry.tier = tier
+                entry.size = len(entry.contents[0]["image_url"]["url"])
+                entry.tokens = estimate_image_tokens(*image.size)
+                self.retiered += 1
+
+        while len(self.iterations) > 1 and self._over_budget(sum(e.size for e in self.iterations),
+                                                             sum(e.tokens for e in self.iterations)):
+            self.iterations.popleft()
+            self.evicted += 1
+
+        # new lists instead of in-place changes: readers keep a consistent snapshot without copying
+        self._action_memory = [message for entry in self.iterations for message in entry.action_message]
+        self._image_memory = [content for entry in self.iterations for content in entry.contents]
 
     def add_iteration(
         self,
@@ -54,6 +236,8 @@ class AgentMemory:
         screenshot_message: List[Dict]
     ):
         """
+        Adds an already encoded screenshot. It is kept as it is, without re-tiering.
+
         action_message: e.g. [{'role': 'assistant', 'content': 'No Action'}]
         screenshot_message: e.g. [{
             'role': 'user',
@@ -62,72 +246,184 @@ class AgentMemory:
             ]
         }]
         """
-        self.iterations.append((action_message, screenshot_message))
+        contents = []
+        for msg in screenshot_message:
+            content = msg.get('content', [])
+            if isinstance(content, list):
+                contents.extend(content)
+        with self._lock:
+            self.added += 1
+            if len(self.iterations) == self.iterations.maxlen:
+                self.evicted += 1
+            self.iterations.append(MemoryEntry(action_message, contents))
+            self._update()
+
+    def add_frame(self, action_message: List[Dict], frame: Frame):
+        """Adds a captured Frame at the resolution of the newest tier."""
+        _, scale_percentage, _ = self.tiers[0]
+        image = frame.variant(("memory_thumbnail", scale_percentage), lambda f: f.image.resize(
+            (max(1, f.image.width * scale_percentage // 100), max(1, f.image.height * scale_percentage // 100)),
+            RESAMPLE_METHOD))
+        with self._lock:
+            # in mosaic mode the thumbnail is only encoded as part of the mosaic
+            contents = [] if self.mosaic else [self._encode(image, 0, len(frame.data))]
+            self.added += 1
+            if len(self.iterations) == self.iterations.maxlen:
+                self.evicted += 1
+            self.iterations.append(MemoryEntry(action_message, contents, image=image, source_size=len(frame.data)))
+            self._update()
 
     def get_action_memory(self) -> List[Dict]:
         """
         Returns a flat list of all action messages in memory,
-        in the same shape they were added.
+        in the same shape they were added. The list is shared, do not modify it.
         """
-        actions: List[Dict] = []
-        for action_msgs, _ in self.iterations:
-            actions.extend(action_msgs)
-        return actions
+        with self._lock:
+            return self._action_memory
 
     def get_image_memory(self) -> List[Dict]:
         """
-        Returns a flat list of image-url dicts only, 
+        Returns a flat list of image-url dicts only, oldest first,
         e.g. [
             {'type': 'image_url', 'image_url': {'url': 'data:image/...'}},
             ...
         ]
+        The list is shared, do not modify it.
         """
-        images: List[Dict] = []
-        for _, screenshot_msgs in self.iterations:
-            for msg in screenshot_msgs:
-                # msg['content'] is a list of image dicts
-                content = msg.get('content', [])
-                if isinstance(content, list):
-                    for img in content:
-                        # optionally validate img['type'] == 'image_url'
-                        images.append(img)
-        return images
+        with self._lock:
+            return self._image_memory
 
+    def report(self) -> Dict:
+        with self._lock:
+            if self.mosaic:
+                return {
+                    "iterations": len(self.iterations),
+                    "added": self.added,
+                    "bytes": self._mosaic_size,
+                    "image_tokens": self._mosaic_tokens,
+                    "evicted": self.evicted,
+                    "mosaic_builds": self.mosaic_builds,
+                }
+            return {
+                "iterations": len(self.iterations),
+                "added": self.added,
+                "bytes": sum(e.size for e in self.iterations),
+                "image_tokens": sum(e.tokens for e in self.iterations),
+                "evicted": self.evicted,
+                "retiered": self.retiered,
+            }
 
-def run_model_async(executor, model, message):
-    return executor.submit(model.complete, user_messages=message)
 
+def run_model_async(scheduler: InferenceScheduler, model, message,
+                    retry_budget: Optional[RetryBudget] = None) -> InferenceJob:
+    if retry_budget is None:
+        return scheduler.submit(model.complete, user_messages=message)
+    return scheduler.submit(model.complete, user_messages=message, retry_budget=retry_budget)
+
+
+def get_aiming_views(frame: Frame,
+                     aiming_model,
+                     aiming_gate: Optional[AimingGate] = None,
+                     aim_transform: Optional[AimInputTransform] = None):
+    """
+    Prepares the aiming request(s) of one frame.
 
-def get_aiming_result(future_aiming, aiming_model):
+    Returns (model, views): the aiming model to call - None when the gate skips the call -
+    and the views to send it, each with the transform back to screen space.
+    """
+    model, candidates = aiming_model, []
+    if aiming_gate is not None:
+        model, candidates = aiming_gate.select_model(frame, aiming_model)
+        if model is None:
+            return None, []
+
+    screenshot_message = frame.screenshot_message()
+    views = [AimingView(message=screenshot_message)]
+    if aim_transform is not None:
+        views = aim_transform.apply(frame)
+
+    if candidates:
+        # only query the views which contain a candidate, fall back to the full frame
+        views = [view for view in views if any(view.contains(c.box) for c in candidates)] \
+            or [AimingView(message=screenshot_message)]
+        if aiming_gate.send_hints:
+            # new views: the transform's views are cached with the frame and must keep their message
+            views = [AimingView(message=aiming_gate.get_hint_message(
+                         view.message, [c for c in candidates if view.contains(c.box)],
+                         transform=view.transform if view.bounds is not None else None),
+                     transform=view.transform, bounds=view.bounds)
+                     for view in views]
+
+    return model, views
+
+
+def locate_target(scheduler: InferenceScheduler, model, aiming_model, views: List[AimingView],
+                  retry_budget: Optional[RetryBudget] = None, responses: Optional[List] = None):
+    """
+    Runs the aiming model on every view at once. The first point found wins, the other
+    calls are cancelled. Returns (coords in screen space or None, elapsed seconds).
+    A view whose call is still throttled once the retry budget is spent counts as "no target".
+    The raw answers are appended to `responses` in the order they arrived.
+    """
     time_start = time.perf_counter()
-    point_json, _ = future_aiming.result()
-    time_end = time.perf_counter()
-    coords = aiming_model.parse_point_json(point_json)
-    elapsed = time_end - time_start
-    return coords, elapsed
+    jobs = {}
+    for view in views:
+        job = run_model_async(scheduler, model, view.message, retry_budget=retry_budget)
+        jobs[job.future] = (job, view)
+
+    coords = None
+    try:
+        for future in concurrent.futures.as_completed(jobs):
+            try:
+                point_json, _ = future.result()
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                log(f"  [Throttled] Aiming model gave up: {type(e).__name__}")
+                continue
+            if responses is not None:
+                responses.append(point_json)
+            point = aiming_model.parse_point_json(point_json)
+            if point is not None:
+                coords = jobs[future][1].transform.to_screen(point)
+                break
+    finally:
+        for job, _ in jobs.values():
+            if not job.done():
+                job.cancel()
+
+    return coords, time.perf_counter() - time_start
 
 
-def handle_gameplay_model_response(future_gameplay, coords_found):
+def handle_gameplay_model_response(gameplay_job: InferenceJob, coords_found):
     tool_calls_output = None
     gameplay_model_time = 0
 
     if coords_found:
-        if not future_gameplay.done():
-            future_gameplay.cancel()
-        else:
-            try:
-                future_gameplay.result(timeout=0.01)
-            except (concurrent.futures.TimeoutError, concurrent.futures.CancelledError):
-                pass
+        # The aiming path won. Abort the gameplay request instead of waiting for it.
+        gameplay_job.cancel()
     else:
         time_start = time.perf_counter()
-        _, _, tool_calls_output = future_gameplay.result()
+        try:
+            _, _, tool_calls_output = gameplay_job.result()
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            # out of retries: this iteration has no movement, the next one tries again
+            log(f"  [Throttled] Gameplay model gave up: {type(e).__name__}")
         time_end = time.perf_counter()
         gameplay_model_time = time_end - time_start
 
     return tool_calls_output, gameplay_model_time
 
 
+def raw_tool_calls(tool_calls) -> Optional[List[Dict]]:
+    """The name and arguments of tool calls, as recorded in the session."""
+    if not tool_calls:
+        return None
+    return [{"name": call.function.name, "arguments": call.function.arguments} for call in tool_calls]
+
+
 def combine_screenshot_message_with_image_history(
     image_history_messages: List[Dict],
     screenshot_message: List[Dict]
@@ -174,38 +470,78 @@ def combine_screenshot_message_with_image_history(
 
 def process_models_concurrently(action_messages: List[Dict],
                                 image_history_messages,
-                                screenshot_message: List[Dict],
+                                frame: Frame,
                                 aiming_model,
-                                gameplay_model):
+                                gameplay_model,
+                                scheduler: InferenceScheduler,
+                                aiming_gate: Optional[AimingGate] = None,
+                                aim_transform: Optional[AimInputTransform] = None,
+                                retry_budget: Optional[RetryBudget] = None,
+                                responses: Optional[Dict] = None):
     """
     Runs aiming and gameplay models concurrently, prioritizing aiming results.
     Returns coordinates if found, otherwise tool_calls from gameplay.
+    When the aiming model finds coordinates, the gameplay call is aborted and not waited for.
+    With an aiming_gate, the local pre-detector decides whether the aiming model is called
+    at all. With an aim_transform, the aiming model gets cropped / downscaled / tiled views
+    and its coordinates are mapped back to the frame and from there to the screen.
+    Both work on the frame's cached decode.
+    Both models pay their retries from the same retry_budget.
+    `responses` is filled with the raw answers for the session recording: "aiming" the
+    contents in the order they arrived, "gameplay" the tool calls (see raw_tool_calls()).
     """
-    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-        future_aiming = run_model_async(executor, aiming_model, screenshot_message)
-
-        screenshot_message_with_image_history = combine_screenshot_message_with_image_history(image_history_messages,
-                                                                                              screenshot_message=screenshot_message)
-        messages_with_context = action_messages + screenshot_message_with_image_history
-        future_gameplay = run_model_async(executor, gameplay_model, messages_with_context)
+    screenshot_message_with_image_history = combine_screenshot_message_with_image_history(
+        image_history_messages, screenshot_message=frame.screenshot_message())
+    messages_with_context = action_messages + screenshot_message_with_image_history
+    gameplay_job = run_model_async(scheduler, gameplay_model, messages_with_context, retry_budget=retry_budget)
 
-        coords, aiming_model_time = get_aiming_result(future_aiming, aiming_model)
-        tool_calls_output, gameplay_model_time = handle_gameplay_model_response(future_gameplay, coords)
+    try:
+        aiming_model_to_call, views = get_aiming_views(frame, aiming_model,
+                                                       aiming_gate=aiming_gate, aim_transform=aim_transform)
+        if aiming_model_to_call is None:
+            coords, aiming_model_time = None, 0
+        else:
+            coords, aiming_model_time = locate_target(
+                scheduler, aiming_model_to_call, aiming_model, views, retry_budget=retry_budget,
+                responses=responses.setdefault("aiming", []) if responses is not None else None)
+            if coords is not None:
+                coords = frame.to_screen(coords)
+    except BaseException:
+        gameplay_job.cancel()
+        raise
+    tool_calls_output, gameplay_model_time = handle_gameplay_model_response(gameplay_job, coords)
+    if responses is not None:
+        responses["gameplay"] = raw_tool_calls(tool_calls_output)
 
     return coords, tool_calls_output, aiming_model_time, gameplay_model_time
 
 
-def perform_aiming_sequence(coords, desktop, image_log_settings: ImageLoggingSettings):
+def perform_aiming_sequence(coords, desktop, frame: Frame, image_paths: IterationPaths,
+                            image_logger: Optional[ImageLoggingSettings] = None,
+                            compensator: Optional[LatencyCompensator] = None):
     """
     Executes the sequence of actions when coordinates are available.
+
+    image_paths: IterationPaths of the frame the coords belong to.
+    compensator: re-projects the coords into the current view (and leads the target) first.
+    The annotated screenshot is only logged after the shot, drawn from the in-memory frame
+    on the image logger's background writer.
     """
     # print(f"Coordinates found: {coords}. Proceeding with aiming and shooting.") # Less verbose
-    draw_point(point=coords, 
-               image_path=image_log_settings.get_screenshot_path(), 
-               output_path=image_log_settings.get_annotated_screenshot_path())
-    mouse_movements = get_mouse_movements(coords=coords)
-    aim(mouse_movements, desktop=desktop)
-    shoot(desktop=desktop)
+    target = coords
+    if compensator is not None:
+        target = compensator.compensate(coords, frame.captured_at)
+        if target != coords:
+            log(f"  [Compensation] {coords} -> {target} (frame age {frame_age_ms(frame):.0f}ms)")
+    mouse_movements = get_mouse_movements(coords=target)
+    aim_and_shoot(mouse_movements, desktop=desktop) # one round trip for the moves and the burst
+    if compensator is not None:
+        compensator.camera_motion.record_mouse_moves((move["x"], move["y"]) for move in mouse_movements)
+
+    if image_logger is not None:
+        image_logger.save_annotated(frame, coords, image_paths)
+    else:
+        frame.annotated(coords).save(image_paths.annotated)
 
 
 def handle_gameplay_actions(tool_calls, gameplay_model_instance): # Added gameplay_model_instance
@@ -217,16 +553,32 @@ def handle_gameplay_actions(tool_calls, gameplay_model_instance): # Added gamepl
         gameplay_model_instance._handle_tool_calls(tool_calls=tool_calls)
 
     else:
-        print("No coordinates found and no tool calls to execute from gameplay model.")
+        log("No coordinates found and no tool calls to execute from gameplay model.")
+
 
+FILE_EXTENSIONS = {"jpeg": "jpg", "png": "png", "webp": "webp", "gif": "gif"}
 
-def capture_screenshot(desktop, image_logger):
-    start_time = time.perf_counter()
-    screenshot_path = image_logger.generate_new_paths_for_iteration()
-    screenshot_message, base64_image = get_screenshot_message(desktop, filename=screenshot_path)
-    elapsed_time = time.perf_counter() - start_time
-    print(f"  [Time] Screenshot: {elapsed_time:.4f}s")
-    return screenshot_message, base64_image
+
+def capture_screenshot(desktop, image_logger, capture_backend=None, frame_source=None,
+                       newer_than: Optional[Frame] = None) -> Frame:
+    """
+    :param frame_source: a FrameGrabber to take the latest frame from instead of capturing one.
+    :param newer_than: with a frame_source, wait for a frame captured after this one.
+    """
+    with get_tracer().span("capture") as span:
+        if frame_source is not None:
+            frame = frame_source.latest(newer_than=newer_than)
+        else:
+            frame = capture_frame(desktop, backend=capture_backend)
+        # named after the captured format, desktop.screenshot() delivers PNG
+        image_logger.generate_new_paths_for_iteration(extension=FILE_EXTENSIONS[frame.format])
+        span.tag(iteration=image_logger.get_current_paths().iteration, frame_age_ms=round(frame_age_ms(frame), 1))
+    log(f"  [Time] Screenshot: {span.duration:.4f}s (frame age {frame_age_ms(frame):.0f}ms)")
+    image_logger.save_screenshot(frame, image_logger.get_current_paths())
+    return frame
+
+def frame_age_ms(frame: Frame) -> float:
+    return 1000 * (time.perf_counter() - frame.captured_at)
 
 def get_action_message(action: str) -> List[Dict]:
     return [{
@@ -234,65 +586,440 @@ def get_action_message(action: str) -> List[Dict]:
         "content": action
     }]
 
-def decide_and_act(coords, tool_calls, gameplay_time, desktop, image_logger, gameplay_model):
+def decide_and_act(coords, tool_calls, gameplay_time, desktop, frame: Frame, image_paths, gameplay_model,
+                   image_logger: Optional[ImageLoggingSettings] = None,
+                   tracker: Optional[TargetTracker] = None,
+                   compensator: Optional[LatencyCompensator] = None):
+    tracer = get_tracer()
     if coords:
-        print(f"  [Action] Coords found: {coords}. Aiming & Shooting.")
-        perform_aiming_sequence(coords, desktop, image_logger)
-        return f"Aim & Shoot. Coords: {coords}"
-    
-    if tool_calls:
-        print(f"  [Action] No Coords. Using Gameplay Model Tool Calls.")
+        log(f"  [Action] Coords found: {coords}. Aiming & Shooting.")
+        with tracer.span("act", action="aim", iteration=image_paths.iteration):
+            perform_aiming_sequence(coords, desktop, frame, image_paths, image_logger=image_logger,
+                                    compensator=compensator)
+        if tracker is not None:
+            tracker.engaged(frame, coords)
+        action_taken = f"Aim & Shoot. Coords: {coords}"
+
+    elif tool_calls:
+        log(f"  [Action] No Coords. Using Gameplay Model Tool Calls.")
         if gameplay_time > 0:
-            print(f"  [Time] Gameplay Model: {gameplay_time:.4f}s")
-        handle_gameplay_actions(tool_calls, gameplay_model)
-        return f"Action taken {tool_calls[0].function.name}, with the sequence: {tool_calls[0].function.arguments}"
-    
-    print(f"  [Action] No Coords, No Tool Calls.")
-    if gameplay_time > 0:
-        print(f"  [Time] Gameplay Model (no valid output): {gameplay_time:.4f}s")
-    return "No Action"
+            log(f"  [Time] Gameplay Model: {gameplay_time:.4f}s")
+        with tracer.span("act", action="move", iteration=image_paths.iteration):
+            handle_gameplay_actions(tool_calls, gameplay_model)
+        action_taken = f"Action taken {tool_calls[0].function.name}, with the sequence: {tool_calls[0].function.arguments}"
+
+    else:
+        log(f"  [Action] No Coords, No Tool Calls.")
+        if gameplay_time > 0:
+            log(f"  [Time] Gameplay Model (no valid output): {gameplay_time:.4f}s")
+        action_taken = "No Action"
+
+    # capture to action, the latency that matters in game
+    tracer.record("decision", time.perf_counter() - frame.captured_at, iteration=image_paths.iteration)
+    return action_taken
+
+def track_target(tracker: Optional[TargetTracker], frame: Frame):
+    """Follow-up aim point from the local tracker, None when the models have to decide."""
+    if tracker is None:
+        return None
+    coords = tracker.track(frame)
+    if coords is not None:
+        log(f"  [Track] Target followed to {coords}. No model calls.")
+    return coords
+
+def update_memory(agent_memory: AgentMemory, action_taken: str, frame: Frame):
+    with get_tracer().span("memory"):
+        agent_memory.add_frame(action_message=get_action_message(action_taken), frame=frame)
+
+
+def format_iteration_time(i: int, elapsed: float, frame_change_policy: Optional[FrameChangePolicy] = None) -> str:
+    line = f"  [Time] Iteration {i+1} Total: {elapsed:.4f}s"
+    if frame_change_policy is not None:
+        line += f" | Skip rate: {frame_change_policy.skip_rate():.0%}"
+    return line
+
+
+# The steps of one iteration shared by run_agent_serial() and async_agent.arun_agent(),
+# which only differ in how they wait for the models.
+
+def observe_frame(frame: Frame, tracker: Optional[TargetTracker] = None,
+                  frame_change_policy: Optional[FrameChangePolicy] = None):
+    """
+    The local verdicts on a new frame before any model call: (tracked_coords, decision), the
+    tracker's follow-up aim point and, when there is none, the frame change decision.
+    """
+    tracked_coords = track_target(tracker, frame)
+    decision = None
+    if tracked_coords is None and frame_change_policy is not None:
+        decision = frame_change_policy.observe(frame)
+    return tracked_coords, decision
+
+
+def skip_iteration(i: int, iteration_start: float, decision,
+                   frame_change_policy: Optional[FrameChangePolicy] = None) -> bool:
+    """True (and logged) when the frame is unchanged and the iteration makes no decision at all."""
+    if decision is None or decision.action != "skip":
+        return False
+    log(f"  [Skip] Frame unchanged (diff {decision.distance:.4f}). No model calls.")
+    log(format_iteration_time(i, time.perf_counter() - iteration_start, frame_change_policy))
+    return True
+
+
+def local_decision(tracked_coords, decision, frame_change_policy: Optional[FrameChangePolicy] = None):
+    """
+    (coords, tool_calls, aiming_time, gameplay_time) decided without the models: the tracked
+    target or the last movement on an unchanged frame. None when the models have to decide.
+    """
+    if tracked_coords is not None:
+        return tracked_coords, None, 0, 0
+    if decision is not None and decision.action == "reuse":
+        log(f"  [Skip] Frame unchanged (diff {decision.distance:.4f}). Reusing the last movement.")
+        return None, frame_change_policy.last_tool_calls, 0, 0
+    return None
+
+
+def record_model_decision(outcome, frame_change_policy: Optional[FrameChangePolicy] = None):
+    """Logs and remembers what the models decided, outcome as returned by process_models_concurrently()."""
+    coords, tool_calls, aiming_time, _ = outcome
+    log(f"  [Time] Aiming Model: {aiming_time:.4f}s")
+    if frame_change_policy is not None:
+        frame_change_policy.record_decision(coords, tool_calls)
+
+
+def finish_iteration(i: int, iteration_start: float, frame: Frame, image_paths: IterationPaths,
+                     image_logger: ImageLoggingSettings, action_taken: str, coords, aiming_time: float,
+                     gameplay_time: float, tracked: bool, decision_frame_age_ms: float, responses: Dict,
+                     frame_change_policy: Optional[FrameChangePolicy] = None):
+    """Logs the action and the time of an iteration and writes its session record."""
+    iteration_end = time.perf_counter()
+    log(f" Action taken: {action_taken}")
+    log(format_iteration_time(i, iteration_end - iteration_start, frame_change_policy))
+    image_logger.log_iteration(image_paths, {"action": action_taken, "coords": coords,
+                                             "aiming_time": aiming_time, "gameplay_time": gameplay_time,
+                                             "iteration_time": iteration_end - iteration_start,
+                                             "tracked": tracked,
+                                             "frame_age_at_decision_ms": decision_frame_age_ms,
+                                             "frame_age_at_action_ms": frame_age_ms(frame),
+                                             "aiming_responses": responses.get("aiming"),
+                                             "gameplay_tool_calls": responses.get("gameplay")})
+
+
+def print_run_report(aiming_model, agent_memory: AgentMemory,
+                     aiming_gate: Optional[AimingGate] = None,
+                     frame_change_policy: Optional[FrameChangePolicy] = None,
+                     capture_backend=None,
+                     frame_source=None,
+                     tracker: Optional[TargetTracker] = None,
+                     compensator: Optional[LatencyCompensator] = None):
+    """The stats printed at the end of run_agent() and arun_agent()."""
+    if isinstance(aiming_model, HedgedAimingModel):
+        print(f"Hedged aiming stats: {aiming_model.report()}")
+    if aiming_gate is not None:
+        print(f"Aiming gate stats: {aiming_gate.report()}")
+    if frame_change_policy is not None:
+        print(f"Frame change stats: {frame_change_policy.report()}")
+    print(f"Memory stats: {agent_memory.report()}")
+    print(f"Thumbnail encoding stats: {agent_memory.thumbnail_quality.report()}")
+    print(f"Rate limiter stats: {rate_limiter_report()}")
+    if capture_backend is not None:
+        print(f"Capture stats: {capture_backend.report()}")
+    if frame_source is not None:
+        print(f"Frame source stats: {frame_source.report()}")
+    if tracker is not None:
+        print(f"Tracker stats: {tracker.report()}")
+    if compensator is not None:
+        print(f"Compensation stats: {compensator.report()}")
+    print(f"Trace stats: {get_tracer().report()}")
+
 
 def run_agent(aiming_model: AimingModel,
               gameplay_model: OpenRouterGameplayModel, 
               desktop: Sandbox, 
               memory_capacity: int = 3,
               iterations:int =10,
-              image_logging_path: str = "images"):
+              image_logging_path: str = "images",
+              pipeline_depth: int = 0,
+              max_frame_age_ms: Optional[float] = None,
+              scheduler: Optional[InferenceScheduler] = None,
+              aiming_gate: Optional[AimingGate] = None,
+              frame_change_policy: Optional[FrameChangePolicy] = None,
+              aim_transform: Optional[AimInputTransform] = None,
+              memory_max_bytes: Optional[int] = 256 * 1024,
+              memory_max_image_tokens: Optional[int] = None,
+              memory_mosaic: bool = False,
+              max_retries_per_iteration: int = 2,
+              iteration_timeout: Optional[float] = None,
+              capture_backend=None,
+              frame_source=None,
+              tracker: Optional[TargetTracker] = None,
+              compensator: Optional[LatencyCompensator] = None):
+    """
+    :param pipeline_depth: 0 runs every iteration in series. A positive value runs capture,
+        inference, actuation and memory bookkeeping as separate stages, with at most
+        `pipeline_depth` frames between capture and actuation at any time.
+    :param max_frame_age_ms: pipelined mode only. Frames older than this are dropped
+        instead of being sent to the models or acted on.
+    :param scheduler: executor for the model calls. A private one is created and shut down
+        when not given.
+    :param aiming_gate: local enemy pre-detector which skips or downgrades the aiming call
+        on frames without enemy candidates.
+    :param frame_change_policy: skips inference (or reuses the last movement) when the frame
+        has not changed since the last decision, and paces the captures.
+    :param aim_transform: crops / downscales / tiles the frame for the aiming model.
+    :param memory_max_bytes: upload budget of the screenshot history in the gameplay request.
+        Together with the age-tiered resolution it keeps the request size flat however large
+        memory_capacity is.
+    :param memory_max_image_tokens: the same budget in (estimated) image tokens.
+    :param memory_mosaic: send the screenshot history as one labelled mosaic image next to the
+        current frame instead of one image per iteration.
+    :param max_retries_per_iteration: retries of throttled / failed model calls one iteration
+        may spend over all its calls. See llms.rate_limit for the shared rate limits.
+    :param iteration_timeout: seconds after the capture after which no retry is started any more.
+    :param capture_backend: how screenshots are taken, e.g. capture.SandboxEncodeBackend to
+        encode them inside the sandbox. None: desktop.screenshot().
+    :param frame_source: a frame_source.FrameGrabber which captures in the background. Every
+        iteration takes its freshest frame instead of capturing one (capture_backend is then
+        the grabber's business).
+    :param tracker: local TargetTracker. After a shot it follows the target over the next frames
+        and shoots again without model calls until it loses the target.
+    :param compensator: compensation.LatencyCompensator. Moves the aiming point by the turns made
+        since the frame was captured and leads moving targets. Give the MoveTool the same
+        CameraMotion, so the gameplay turns are accounted for as well.
+    """
     
     image_logger = ImageLoggingSettings(base_path=image_logging_path)
-    agent_memory = AgentMemory(max_iterations=memory_capacity) 
+    agent_memory = AgentMemory(max_iterations=memory_capacity, max_bytes=memory_max_bytes,
+                               max_image_tokens=memory_max_image_tokens, mosaic=memory_mosaic)
+
+    owns_scheduler = scheduler is None
+    if owns_scheduler:
+        scheduler = InferenceScheduler()
+
+    try:
+        if pipeline_depth > 0:
+            return run_agent_pipelined(aiming_model=aiming_model,
+                                       gameplay_model=gameplay_model,
+                                       desktop=desktop,
+                                       agent_memory=agent_memory,
+                                       image_logger=image_logger,
+                                       scheduler=scheduler,
+                                       aiming_gate=aiming_gate,
+                                       frame_change_policy=frame_change_policy,
+                                       aim_transform=aim_transform,
+                                       iterations=iterations,
+                                       pipeline_depth=pipeline_depth,
+                                       max_frame_age_ms=max_frame_age_ms,
+                                       max_retries_per_iteration=max_retries_per_iteration,
+                                       iteration_timeout=iteration_timeout,
+                                       capture_backend=capture_backend,
+                                       frame_source=frame_source,
+                                       tracker=tracker,
+                                       compensator=compensator)
+
+        return run_agent_serial(aiming_model=aiming_model,
+                                gameplay_model=gameplay_model,
+                                desktop=desktop,
+                                agent_memory=agent_memory,
+                                image_logger=image_logger,
+                                scheduler=scheduler,
+                                aiming_gate=aiming_gate,
+                                frame_change_policy=frame_change_policy,
+                                aim_transform=aim_transform,
+                                iterations=iterations,
+                                max_retries_per_iteration=max_retries_per_iteration,
+                                iteration_timeout=iteration_timeout,
+                                capture_backend=capture_backend,
+                                frame_source=frame_source,
+                                tracker=tracker,
+                                compensator=compensator)
+    finally:
+        if owns_scheduler:
+            scheduler.shutdown()
+        if isinstance(aiming_model, HedgedAimingModel):
+            aiming_model.close()
+        image_logger.close()
+        print_run_report(aiming_model, agent_memory, aiming_gate=aiming_gate,
+                         frame_change_policy=frame_change_policy, capture_backend=capture_backend,
+                         frame_source=frame_source, tracker=tracker, compensator=compensator)
 
+
+def run_agent_serial(aiming_model: AimingModel,
+                     gameplay_model: OpenRouterGameplayModel,
+                     desktop: Sandbox,
+                     agent_memory: AgentMemory,
+                     image_logger: ImageLoggingSettings,
+                     scheduler: InferenceScheduler,
+                     aiming_gate: Optional[AimingGate] = None,
+                     frame_change_policy: Optional[FrameChangePolicy] = None,
+                     aim_transform: Optional[AimInputTransform] = None,
+                     iterations: int = 10,
+                     max_retries_per_iteration: int = 2,
+                     iteration_timeout: Optional[float] = None,
+                     capture_backend=None,
+                     frame_source=None,
+                     tracker: Optional[TargetTracker] = None,
+                     compensator: Optional[LatencyCompensator] = None):
     for i in range(iterations):
-        print(f"\n--- Iteration {i + 1} ---")
+        log(f"\n--- Iteration {i + 1} ---")
         iteration_start = time.perf_counter()
 
         action_history = agent_memory.get_action_memory()
         image_history = agent_memory.get_image_memory()
-        screenshot_message, base64_image = capture_screenshot(desktop, image_logger)
+        frame = capture_screenshot(desktop, image_logger, capture_backend, frame_source)
+        image_paths = image_logger.get_current_paths()
+        decision_frame_age_ms = frame_age_ms(frame)
+
+        tracked_coords, decision = observe_frame(frame, tracker, frame_change_policy)
+        if skip_iteration(i, iteration_start, decision, frame_change_policy):
+            time.sleep(decision.wait_before_next)
+            continue
+
+        responses = {}
+        outcome = local_decision(tracked_coords, decision, frame_change_policy)
+        if outcome is None:
+            outcome = process_models_concurrently(
+                action_messages=action_history,
+                image_history_messages=image_history,
+                frame=frame,
+                aiming_model=aiming_model,
+                gameplay_model=gameplay_model,
+                scheduler=scheduler,
+                aiming_gate=aiming_gate,
+                aim_transform=aim_transform,
+                retry_budget=RetryBudget(max_retries_per_iteration, timeout=iteration_timeout),
+                responses=responses,
+            )
+            record_model_decision(outcome, frame_change_policy)
+        coords, tool_calls, aiming_time, gameplay_time = outcome
+
+        action_taken = decide_and_act(
+            coords, tool_calls, gameplay_time, desktop, frame, image_paths, gameplay_model,
+            image_logger=image_logger, tracker=tracker, compensator=compensator
+        )
+        finish_iteration(i, iteration_start, frame, image_paths, image_logger, action_taken, coords,
+                         aiming_time, gameplay_time, tracked_coords is not None, decision_frame_age_ms,
+                         responses, frame_change_policy)
+
+        update_memory(agent_memory, action_taken, frame)
+        if decision is not None:
+            time.sleep(decision.wait_before_next)
 
+    return agent_memory
+
+
+def run_agent_pipelined(aiming_model: AimingModel,
+                        gameplay_model: OpenRouterGameplayModel,
+                        desktop: Sandbox,
+                        agent_memory: AgentMemory,
+                        image_logger: ImageLoggingSettings,
+                        scheduler: InferenceScheduler,
+                        aiming_gate: Optional[AimingGate] = None,
+                        frame_change_policy: Optional[FrameChangePolicy] = None,
+                        aim_transform: Optional[AimInputTransform] = None,
+                        iterations: int = 10,
+                        pipeline_depth: int = 2,
+                        max_frame_age_ms: Optional[float] = None,
+                        max_retries_per_iteration: int = 2,
+                        iteration_timeout: Optional[float] = None,
+                        capture_backend=None,
+                        frame_source=None,
+                        tracker: Optional[TargetTracker] = None,
+                        compensator: Optional[LatencyCompensator] = None):
+    """
+    Pipelined variant of the agent loop: capture -> infer -> act -> memory.
+
+    While the models work on frame N, frame N+1 is already being captured and encoded,
+    and the thumbnail of frame N-1 is compressed into memory. The decision for a frame
+    is made with the memory available at the time it reaches the models, which may lag
+    behind by up to `pipeline_depth` iterations.
+    """
+
+    last_frame = [None]
+
+    def capture(item: PipelineItem):
+        if frame_change_policy is not None:
+            time.sleep(frame_change_policy.wait_before_next)
+        # a grabbed frame is only worth a pipeline slot if no earlier slot has it already
+        frame = capture_screenshot(desktop, image_logger, capture_backend, frame_source, newer_than=last_frame[0])
+        last_frame[0] = frame
+        item.captured_at = frame.captured_at
+        item.data["frame"] = frame
+        item.data["image_paths"] = image_logger.get_current_paths()
+
+    def infer(item: PipelineItem):
+        # frames captured before the last shot are left to the models, see TargetTracker.track()
+        tracked_coords = track_target(tracker, item.data["frame"])
+        if tracked_coords is not None:
+            item.data.update(coords=tracked_coords, tool_calls=None, aiming_time=0, gameplay_time=0)
+            return
+
+        decision = frame_change_policy.observe(item.data["frame"]) if frame_change_policy else None
+        if decision is not None and decision.action == "skip":
+            log(f"  [Skip] Frame {item.index + 1} unchanged (diff {decision.distance:.4f}). "
+                  f"Skip rate: {frame_change_policy.skip_rate():.0%}")
+            return False
+
+        if decision is not None and decision.action == "reuse":
+            item.data.update(coords=None, tool_calls=frame_change_policy.last_tool_calls,
+                             aiming_time=0, gameplay_time=0)
+            return
+
+        # the deadline counts from the capture, the frame may have waited for this stage
+        timeout = None if iteration_timeout is None else iteration_timeout - item.age_ms() / 1000
+        responses = item.data["responses"] = {}
         coords, tool_calls, aiming_time, gameplay_time = process_models_concurrently(
-            action_messages=action_history,
-            image_history_messages=image_history,
-            screenshot_message=screenshot_message,
+            action_messages=agent_memory.get_action_memory(),
+            image_history_messages=agent_memory.get_image_memory(),
+            frame=item.data["frame"],
             aiming_model=aiming_model,
             gameplay_model=gameplay_model,
+            scheduler=scheduler,
+            aiming_gate=aiming_gate,
+            aim_transform=aim_transform,
+            retry_budget=RetryBudget(max_retries_per_iteration, timeout=timeout),
+            responses=responses,
         )
-        print(f"  [Time] Aiming Model: {aiming_time:.4f}s")
+        if frame_change_policy is not None:
+            frame_change_policy.record_decision(coords, tool_calls)
+        item.data.update(coords=coords, tool_calls=tool_calls, aiming_time=aiming_time, gameplay_time=gameplay_time)
+        log(f"  [Time] Frame {item.index + 1} Aiming Model: {aiming_time:.4f}s")
 
-        action_taken = decide_and_act(
-            coords, tool_calls, gameplay_time, desktop, image_logger, gameplay_model
+    def act(item: PipelineItem):
+        log(f"\n--- Iteration {item.index + 1} (frame age {item.age_ms():.0f}ms) ---")
+        item.data["action_taken"] = decide_and_act(
+            item.data["coords"], item.data["tool_calls"], item.data["gameplay_time"],
+            desktop, item.data["frame"], item.data["image_paths"], gameplay_model,
+            image_logger=image_logger, tracker=tracker, compensator=compensator
         )
+        log(f" Action taken: {item.data['action_taken']}")
+        line = f"  [Time] Iteration {item.index + 1} Capture -> Action: {item.age_ms() / 1000:.4f}s"
+        if frame_change_policy is not None:
+            line += f" | Skip rate: {frame_change_policy.skip_rate():.0%}"
+        log(line)
+        image_logger.log_iteration(item.data["image_paths"], {
+            "action": item.data["action_taken"], "coords": item.data["coords"],
+            "aiming_time": item.data["aiming_time"], "gameplay_time": item.data["gameplay_time"],
+            "capture_to_action_time": item.age_ms() / 1000, "stage_times": dict(item.timings),
+            "aiming_responses": item.data.get("responses", {}).get("aiming"),
+            "gameplay_tool_calls": item.data.get("responses", {}).get("gameplay"),
+        })
 
-        iteration_end = time.perf_counter()
-        print(f" Action taken: {action_taken}")
-        print(f"  [Time] Iteration {i+1} Total: {iteration_end - iteration_start:.4f}s")
+    def remember(item: PipelineItem):
+        update_memory(agent_memory, item.data["action_taken"], item.data["frame"])
 
-        action_message = get_action_message(action_taken)
-        small_base64_image = compress_and_scale_base64_image(base64_image,
-                                                             target_size_percentage=50,
-                                                            scale_percentage=20)
-        compressed_image_message = get_screenshot_message_from_base64(small_base64_image)
+    pipeline = StagedPipeline(
+        source=Stage("capture", capture),
+        stages=[
+            Stage("infer", infer, drop_if_stale=True),
+            Stage("act", act, drop_if_stale=True, releases_slot=True),
+            Stage("memory", remember),
+        ],
+        depth=pipeline_depth,
+        max_frame_age_ms=max_frame_age_ms,
+    )
+    pipeline.run(iterations=iterations)
 
-        agent_memory.add_iteration(action_message=action_message, screenshot_message=compressed_image_message)
+    stale = sum(pipeline.stale.values())
+    print(f"\nPipeline finished: {pipeline.completed}/{iterations} frames acted on, {stale} dropped as stale.")
 
     return agent_memory
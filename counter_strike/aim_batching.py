@@ -0,0 +1,381 @@
+"""
+Batched aiming for many agents.
+
+With many agents in one process every agent sends its own frame to the aiming model.
+An AimingBatcher collects the aiming requests of up to `max_batch_size` agents which
+arrive within `max_delay` seconds, tiles their images into one grid and sends a single
+grounding request for all of them. The points of the answer are assigned to the tile
+they fall into and mapped back to that tile's view, so every agent gets the same
+answer a call of its own would have produced.
+
+A request which found no partner within `max_delay` is sent on its own, unchanged.
+So is every request of a batch whose call failed.
+
+    batcher = AimingBatcher(aiming_model, max_batch_size=4, max_delay=0.05)
+    run_agent(aiming_model=BatchedAimingModel(batcher), ...)  # in every agent of that side
+"""
+
+import asyncio
+import base64
+import concurrent.futures
+import io
+import json
+import math
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from llms.cancellation import CancellationToken, RequestCancelled
+from llms.models import AimingModel
+from llms.rate_limit import CombinedRetryBudget, RetryBudget
+from tracing import get_tracer, log
+
+from .aim_transform import AffineTransform
+from .image_handling import encode_jpeg, get_screenshot_message_from_base64, tile_images
+
+
+BATCH_INSTRUCTION = (
+    "The image is a grid of {count} separate gameplay screenshots, labelled 1 to {count}. "
+    "Locate the target in every screenshot which has one. "
+    "Output JSON with one point per screenshot in pixel coordinates of the whole grid image, e.g. "
+    '{{"points": [{{"tile": 1, "x": 500, "y": 452}}, {{"tile": 3, "x": 1400, "y": 800}}]}}. '
+    "Leave out the screenshots without a target. If there is none at all, return None."
+)
+
+
+def image_of_message(user_messages: List[Dict]) -> Optional[Image.Image]:
+    """The (last) image of a screenshot message, decoded from its data URL."""
+    for message in reversed(user_messages):
+        content = message.get("content")
+        if not isinstance(content, list):
+            continue
+        for part in reversed(content):
+            if part.get("type") == "image_url":
+                url = part["image_url"]["url"]
+                if url.startswith("data:"):
+                    return Image.open(io.BytesIO(base64.b64decode(url.split(",", 1)[1])))
+    return None
+
+
+def parse_points(content: Optional[str]) -> List[Dict[str, int]]:
+    """All {"x", "y"} points of a batched answer, in the order the model listed them."""
+    if not content:
+        return []
+    cleaned = content.strip().strip("`").strip()
+    if cleaned[:4].lower() == "json":
+        cleaned = cleaned[4:].strip()
+    if cleaned[:1].lower() == "n":  # None / null
+        return []
+
+    points = []
+
+    def collect(value):
+        if isinstance(value, dict):
+            if "x" in value and "y" in value:
+                try:
+                    points.append({"x": int(float(value["x"])), "y": int(float(value["y"]))})
+                except (TypeError, ValueError):
+                    pass
+                return
+            for child in value.values():
+                collect(child)
+        elif isinstance(value, list):
+            for child in value:
+                collect(child)
+
+    try:
+        collect(json.loads(cleaned))
+    except json.JSONDecodeError:
+        # truncated or chatty answers: take the pairs that are complete
+        for x, y in re.findall(r'"x"\s*:\s*"?(-?\d+(?:\.\d+)?)"?\s*,\s*"y"\s*:\s*"?(-?\d+(?:\.\d+)?)', cleaned):
+            points.append({"x": int(float(x)), "y": int(float(y))})
+    return points
+
+
+def _resolve(future: concurrent.futures.Future, result=None, exception: Optional[BaseException] = None):
+    """Sets the outcome unless the waiting agent already gave up on it."""
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except concurrent.futures.InvalidStateError:
+        pass
+
+
+class AimingRequest:
+    def __init__(self, user_messages: List[Dict], image: Image.Image,
+                 cancel_token: Optional[CancellationToken], retry_budget: Optional[RetryBudget]):
+        self.user_messages = user_messages
+        self.image = image
+        self.cancel_token = cancel_token
+        self.retry_budget = retry_budget
+        self.future = concurrent.futures.Future()
+        self.submitted_at = time.monotonic()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_token is not None and self.cancel_token.cancelled
+
+
+class AimingBatcher:
+    def __init__(self,
+                 aiming_model: AimingModel,
+                 max_batch_size: int = 4,
+                 max_delay: float = 0.05,
+                 max_grid_size: Tuple[int, int] = (1920, 1080),
+                 quality: int = 85,
+                 max_workers: int = 4):
+        """
+        :param aiming_model: the model all agents of the batcher share. Agents with a different
+            system prompt (the other side) need a batcher of their own.
+        :param max_batch_size: requests tiled into one image at most.
+        :param max_delay: seconds the first request of a batch waits for others. When no other
+            request arrived by then, it is sent on its own.
+        :param max_grid_size: the grid image is downscaled to fit, so a batch costs about as many
+            image tokens as a single full frame.
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size has to be at least 1.")
+
+        self.aiming_model = aiming_model
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.max_grid_size = max_grid_size
+        self.quality = quality
+
+        self._queue: List[AimingRequest] = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                               thread_name_prefix="aim-batch")
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="aim-batcher", daemon=True)
+        self._dispatcher.start()
+
+        self.requests = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.single_calls = 0     # requests sent on their own: no partner within max_delay, or past their deadline
+        self.fallback_calls = 0   # requests re-sent on their own after their batch failed
+        self.cancelled = 0
+
+    def submit(self, user_messages: List[Dict], cancel_token: Optional[CancellationToken] = None,
+               retry_budget: Optional[RetryBudget] = None) -> concurrent.futures.Future:
+        """Queues an aiming request. The future resolves to (content, response) as AimingModel.complete()."""
+        image = image_of_message(user_messages)
+        request = AimingRequest(user_messages, image, cancel_token, retry_budget)
+        if image is None:
+            # nothing to tile, e.g. a hint-only message
+            self._executor.submit(self._run_single, request)
+            return request.future
+
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The aiming batcher is closed.")
+            self.requests += 1
+            self._queue.append(request)
+            self._condition.notify()
+        return request.future
+
+    def _next_batch(self) -> Optional[List[AimingRequest]]:
+        with self._condition:
+            while True:
+                self._queue = [r for r in self._queue if not self._drop_if_cancelled(r)]
+                if self._closed and not self._queue:
+                    return None
+                if self._queue:
+                    waited = time.monotonic() - self._queue[0].submitted_at
+                    if len(self._queue) >= self.max_batch_size or waited >= self.max_delay or self._closed:
+                        batch = self._queue[:self.max_batch_size]
+                        self._queue = self._queue[self.max_batch_size:]
+                        return batch
+                    self._condition.wait(timeout=self.max_delay - waited)
+                else:
+                    self._condition.wait()
+
+    def _drop_if_cancelled(self, request: AimingRequest) -> bool:
+        if request.cancelled:
+            self.cancelled += 1
+            _resolve(request.future, exception=RequestCancelled())
+            return True
+        return False
+
+    def _dispatch_loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if len(batch) == 1:
+                with self._condition:
+                    self.single_calls += 1
+                self._executor.submit(self._run_single, batch[0])
+            else:
+                self._executor.submit(self._run_batch, batch)
+
+    def _run_single(self, request: AimingRequest):
+        try:
+            _resolve(request.future, self.aiming_model.complete(user_messages=request.user_messages,
+                                                                cancel_token=request.cancel_token,
+                                                                retry_budget=request.retry_budget))
+        except BaseException as e:
+            _resolve(request.future, exception=e)
+
+    def build_grid(self, images: List[Image.Image]) -> Tuple[Image.Image, List[AffineTransform]]:
+        """
+        Tiles the images and returns the grid with one transform per tile, which maps a
+        point of the grid back to the tile's own image.
+        """
+        columns = math.ceil(math.sqrt(len(images)))
+        rows = math.ceil(len(images) / columns)
+        width = max(image.width for image in images)
+        height = max(image.height for image in images)
+        scale = min(1.0, self.max_grid_size[0] / (columns * width), self.max_grid_size[1] / (rows * height))
+        tile_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+
+        grid = tile_images([image.convert("RGB") for image in images],
+                           labels=[str(i + 1) for i in range(len(images))],
+                           tile_size=tile_size, columns=columns)
+        transforms = [AffineTransform(scale_x=tile_size[0] / image.width,
+                                      scale_y=tile_size[1] / image.height,
+                                      offset_x=-(i % columns) * image.width,
+                                      offset_y=-(i // columns) * image.height)
+                      for i, image in enumerate(images)]
+        return grid, transforms
+
+    def _tile_of(self, point: Dict[str, int], grid: Image.Image, count: int) -> Optional[int]:
+        columns = math.ceil(math.sqrt(count))
+        rows = math.ceil(count / columns)
+        column = point["x"] * columns // max(1, grid.width)
+        row = point["y"] * rows // max(1, grid.height)
+        if not (0 <= column < columns and 0 <= row < rows):
+            return None
+        index = row * columns + column
+        return index if index < count else None
+
+    def _run_batch(self, batch: List[AimingRequest]):
+        # past its deadline a request gets no retries, it is not worth holding up the others
+        expired = [r for r in batch if r.retry_budget is not None and r.retry_budget.remaining_time() == 0]
+        if expired:
+            with self._condition:
+                self.single_calls += len(expired)
+            for request in expired:
+                self._executor.submit(self._run_single, request)
+            batch = [r for r in batch if r not in expired]
+            if len(batch) <= 1:
+                with self._condition:
+                    self.single_calls += len(batch)
+                if batch:
+                    self._run_single(batch[0])
+                return
+
+        # the batch call is only aborted once every agent in it lost interest
+        token = CancellationToken()
+        remaining = [len(batch)]
+        lock = threading.Lock()
+
+        def member_cancelled():
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    token.cancel()
+
+        for request in batch:
+            if request.cancel_token is not None:
+                request.cancel_token.add_callback(member_cancelled)
+
+        grid, transforms = self.build_grid([request.image for request in batch])
+        messages = get_screenshot_message_from_base64(base64.b64encode(encode_jpeg(grid, self.quality)).decode("utf-8"))
+        messages[0]["content"].append({"type": "text", "text": BATCH_INSTRUCTION.format(count=len(batch))})
+
+        try:
+            request_body = self.aiming_model._build_request(messages)
+            # no early stop: the answer has a point per tile
+            # a retry has to fit the retries and the deadline of every agent in the batch
+            budgets = [request.retry_budget for request in batch if request.retry_budget is not None]
+            retry_budget = CombinedRetryBudget(budgets) if budgets else None
+            content, _, response = self.aiming_model._stream_completion(token, retry_budget=retry_budget,
+                                                                        **request_body)
+        except RequestCancelled as e:
+            for request in batch:
+                _resolve(request.future, exception=e)
+            return
+        except Exception as e:
+            log(f"  [Aim batch] Batch of {len(batch)} failed ({type(e).__name__}), sending them one by one.")
+            get_tracer().add("aim_batch_fallbacks", len(batch), error=type(e).__name__)
+            with self._condition:
+                self.fallback_calls += len(batch)
+            for request in batch:
+                self._executor.submit(self._run_single, request)
+            return
+
+        with self._condition:
+            self.batches += 1
+            self.batched_requests += len(batch)
+
+        points: Dict[int, Dict[str, int]] = {}
+        for point in parse_points(content):
+            index = self._tile_of(point, grid, len(batch))
+            if index is not None and index not in points:
+                points[index] = transforms[index].to_screen(point)
+
+        for index, request in enumerate(batch):
+            if request.cancelled:
+                _resolve(request.future, exception=RequestCancelled())
+            elif index in points:
+                _resolve(request.future, (json.dumps({"point": points[index]}), response))
+            else:
+                _resolve(request.future, ("None", response))
+
+    def report(self) -> Dict:
+        with self._condition:
+            return {
+                "requests": self.requests,
+                "batches": self.batches,
+                "batched_requests": self.batched_requests,
+                "avg_batch_size": round(self.batched_requests / self.batches, 2) if self.batches else 0.0,
+                "single_calls": self.single_calls,
+                "fallback_calls": self.fallback_calls,
+                "cancelled": self.cancelled,
+                "model_calls": self.batches + self.single_calls + self.fallback_calls,
+            }
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._dispatcher.join()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class BatchedAimingModel:
+    """
+    One agent's handle on an AimingBatcher, usable as the aiming_model of run_agent().
+
+    The aiming gate's hint text is not part of the tiled request, only the image is.
+    """
+    def __init__(self, batcher: AimingBatcher):
+        self.batcher = batcher
+        self.model = batcher.aiming_model.model
+        self.system_message = batcher.aiming_model.system_message
+
+    def parse_point_json(self, model_response):
+        return self.batcher.aiming_model.parse_point_json(model_response)
+
+    def complete(self, user_messages: List, cancel_token: Optional[CancellationToken] = None,
+                 retry_budget: Optional[RetryBudget] = None):
+        future = self.batcher.submit(user_messages, cancel_token=cancel_token, retry_budget=retry_budget)
+        if cancel_token is not None:
+            # wakes the waiting agent right away; the batch itself goes on for the others
+            cancel_token.add_callback(lambda: _resolve(future, exception=RequestCancelled()))
+        return future.result()
+
+    async def acomplete(self, user_messages: List, retry_budget: Optional[RetryBudget] = None):
+        token = CancellationToken()
+        try:
+            return await asyncio.to_thread(self.complete, user_messages, token, retry_budget)
+        except asyncio.CancelledError:
+            token.cancel()
+            raise
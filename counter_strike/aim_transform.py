@@ -0,0 +1,151 @@
+"""
+Aiming input transforms.
+
+The aiming model does not need the full 1920x1080 frame: enemies that matter are
+usually near the horizon band around the crosshair. An AimInputTransform crops,
+downscales or tiles the frame before it is sent to the aiming model and records
+the affine transform of every view, so the point the model returns can be
+mapped back to screen space before calculate_mouse_movements().
+"""
+
+import base64
+import io
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from .image_handling import get_screenshot_message_from_base64
+
+
+class AffineTransform:
+    """
+    Maps a point of a transformed view back to the screen:
+        screen = offset + view / scale
+    """
+    def __init__(self, scale_x: float = 1.0, scale_y: float = 1.0, offset_x: float = 0.0, offset_y: float = 0.0):
+        self.scale_x = scale_x
+        self.scale_y = scale_y
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+
+    def to_screen(self, point: Dict[str, float]) -> Dict[str, int]:
+        return {
+            "x": int(round(self.offset_x + point["x"] / self.scale_x)),
+            "y": int(round(self.offset_y + point["y"] / self.scale_y)),
+        }
+
+    def to_view(self, point: Dict[str, float]) -> Dict[str, int]:
+        return {
+            "x": int(round((point["x"] - self.offset_x) * self.scale_x)),
+            "y": int(round((point["y"] - self.offset_y) * self.scale_y)),
+        }
+
+    def box_to_view(self, box: Tuple[int, int, int, int]) -> Tuple[int, int, int, int]:
+        top_left = self.to_view({"x": box[0], "y": box[1]})
+        bottom_right = self.to_view({"x": box[2], "y": box[3]})
+        return top_left["x"], top_left["y"], bottom_right["x"], bottom_right["y"]
+
+    def __repr__(self):
+        return (f"AffineTransform(scale=({self.scale_x:.3f}, {self.scale_y:.3f}), "
+                f"offset=({self.offset_x:.0f}, {self.offset_y:.0f}))")
+
+
+IDENTITY = AffineTransform()
+
+
+class AimingView:
+    """One image sent to the aiming model, with the transform back to screen space."""
+    def __init__(self,
+                 message: List[Dict],
+                 transform: AffineTransform = IDENTITY,
+                 bounds: Optional[Tuple[int, int, int, int]] = None):
+        """
+        :param message: the screenshot message sent to the aiming model
+        :param bounds: (x1, y1, x2, y2) screen region the view covers, None for the whole screen
+        """
+        self.message = message
+        self.transform = transform
+        self.bounds = bounds
+
+    def contains(self, box: Tuple[int, int, int, int]) -> bool:
+        if self.bounds is None:
+            return True
+        x1, y1, x2, y2 = self.bounds
+        return box[0] < x2 and box[2] > x1 and box[1] < y2 and box[3] > y1
+
+
+class AimInputTransform:
+    MODES = ("full", "crop", "tiles")
+
+    def __init__(self,
+                 mode: str = "crop",
+                 scale: float = 1.0,
+                 crop_size: Tuple[int, int] = (1280, 540),
+                 crop_center: Optional[Tuple[int, int]] = None,
+                 tiles: Tuple[int, int] = (2, 1),
+                 quality: int = 90):
+        """
+        :param mode: 'full' sends the whole frame (downscaled by `scale`),
+            'crop' a `crop_size` region around `crop_center` (the crosshair, i.e. the centre
+            of the frame, by default),
+            'tiles' splits the frame into a `tiles` (columns, rows) grid, one aiming call per tile.
+        :param scale: downscale factor applied after cropping, e.g. 0.5 halves both sides.
+        :param quality: JPEG quality of the views.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown aiming transform mode '{mode}'. Choose from {list(self.MODES)}.")
+        if not 0 < scale <= 1:
+            raise ValueError("scale has to be in (0, 1].")
+
+        self.mode = mode
+        self.scale = scale
+        self.crop_size = crop_size
+        self.crop_center = crop_center
+        self.tiles = tiles
+        self.quality = quality
+
+    def get_regions(self, width: int, height: int) -> List[Tuple[int, int, int, int]]:
+        """Screen regions (x1, y1, x2, y2) of the views for a frame of the given size."""
+        if self.mode == "full":
+            return [(0, 0, width, height)]
+
+        if self.mode == "crop":
+            crop_w, crop_h = min(self.crop_size[0], width), min(self.crop_size[1], height)
+            center_x, center_y = self.crop_center or (width // 2, height // 2)
+            x1 = min(max(0, center_x - crop_w // 2), width - crop_w)
+            y1 = min(max(0, center_y - crop_h // 2), height - crop_h)
+            return [(x1, y1, x1 + crop_w, y1 + crop_h)]
+
+        columns, rows = self.tiles
+        regions = []
+        for row in range(rows):
+            for column in range(columns):
+                regions.append((column * width // columns, row * height // rows,
+                                (column + 1) * width // columns, (row + 1) * height // rows))
+        return regions
+
+    def _encode(self, image: Image.Image) -> str:
+        buffer = io.BytesIO()
+        image.convert("RGB").save(buffer, format="JPEG", quality=self.quality)
+        return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+    def apply_to_image(self, image: Image.Image) -> List[AimingView]:
+        views = []
+        for region in self.get_regions(*image.size):
+            view = image.crop(region)
+            if self.scale < 1:
+                view = view.resize((max(1, int(view.width * self.scale)), max(1, int(view.height * self.scale))),
+                                   Image.Resampling.BILINEAR)
+
+            transform = AffineTransform(scale_x=view.width / (region[2] - region[0]),
+                                        scale_y=view.height / (region[3] - region[1]),
+                                        offset_x=region[0],
+                                        offset_y=region[1])
+            views.append(AimingView(message=get_screenshot_message_from_base64(self._encode(view)),
+                                    transform=transform,
+                                    bounds=region))
+        return views
+
+    def apply(self, frame) -> List[AimingView]:
+        """Views of a Frame, cached on the frame."""
+        return frame.aiming_views(self)
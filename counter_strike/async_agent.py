@@ -0,0 +1,268 @@
+"""
+asyncio version of run_agent().
+
+The model calls use the async clients (acomplete), so a single event loop can
+drive many agents. Cancelling a task closes its HTTP request. Sandbox RPCs and
+image work are blocking and run off-thread via asyncio.to_thread.
+"""
+
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from e2b_desktop import Sandbox
+
+from llms.models import OpenRouterGameplayModel, AimingModel
+from llms.rate_limit import RetryBudget, is_retryable
+from tracing import get_tracer, log
+
+from .agent import AgentMemory, capture_screenshot, combine_screenshot_message_with_image_history, \
+    decide_and_act, update_memory, frame_age_ms, get_aiming_views, raw_tool_calls, observe_frame, \
+    skip_iteration, local_decision, record_model_decision, finish_iteration, print_run_report
+from .aim_transform import AimInputTransform, AimingView
+from .detection import AimingGate
+from .frame import Frame
+from .frame_change import FrameChangePolicy
+from .image_logging import ImageLoggingSettings
+from .tracking import TargetTracker
+from .compensation import LatencyCompensator
+
+
+async def _cancel_and_wait(task: asyncio.Task):
+    task.cancel()
+    try:
+        await task
+    except BaseException:
+        pass
+
+
+async def _no_target():
+    return None
+
+
+def _acomplete(model, messages, retry_budget: Optional[RetryBudget] = None):
+    if retry_budget is None:
+        return model.acomplete(user_messages=messages)
+    return model.acomplete(user_messages=messages, retry_budget=retry_budget)
+
+
+async def alocate_target(model, aiming_model, views: List[AimingView], retry_budget: Optional[RetryBudget] = None,
+                         responses: Optional[List] = None):
+    """
+    Async counterpart of locate_target(): the first view with a point wins, the other calls
+    are cancelled. Returns coords in screen space or None.
+    """
+    tasks = {asyncio.create_task(_acomplete(model, view.message, retry_budget)): view for view in views}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    point_json, _ = task.result()
+                except Exception as e:
+                    if not is_retryable(e):
+                        raise
+                    log(f"  [Throttled] Aiming model gave up: {type(e).__name__}")
+                    continue
+                if responses is not None:
+                    responses.append(point_json)
+                point = aiming_model.parse_point_json(point_json)
+                if point is not None:
+                    return tasks[task].transform.to_screen(point)
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def aprocess_models_concurrently(action_messages: List[Dict],
+                                       image_history_messages,
+                                       frame: Frame,
+                                       aiming_model,
+                                       gameplay_model,
+                                       timeout: Optional[float] = None,
+                                       aiming_gate: Optional[AimingGate] = None,
+                                       aim_transform: Optional[AimInputTransform] = None,
+                                       retry_budget: Optional[RetryBudget] = None,
+                                       responses: Optional[Dict] = None):
+    """
+    Async counterpart of process_models_concurrently().
+
+    Both models are started at once and the aiming result is prioritized: as soon as
+    it yields coordinates, the gameplay task is cancelled. Each model gets until the
+    shared `timeout` (seconds) - an aiming timeout counts as "no coordinates" and a
+    gameplay timeout as "no tool calls". Retries are paid from the shared retry_budget.
+    `responses` is filled with the raw answers, as by process_models_concurrently().
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    deadline = start + timeout if timeout is not None else None
+
+    def remaining():
+        return None if deadline is None else max(0.0, deadline - loop.time())
+
+    screenshot_message_with_image_history = combine_screenshot_message_with_image_history(
+        image_history_messages, screenshot_message=frame.screenshot_message())
+    messages_with_context = action_messages + screenshot_message_with_image_history
+
+    gameplay_task = asyncio.create_task(_acomplete(gameplay_model, messages_with_context, retry_budget))
+
+    try:
+        aiming_model_to_call, views = await asyncio.to_thread(
+            get_aiming_views, frame, aiming_model, aiming_gate, aim_transform)
+    except BaseException:
+        await _cancel_and_wait(gameplay_task)
+        raise
+
+    if aiming_model_to_call is None:
+        aiming_task = asyncio.create_task(_no_target())
+    else:
+        aiming_task = asyncio.create_task(alocate_target(
+            aiming_model_to_call, aiming_model, views, retry_budget,
+            responses=responses.setdefault("aiming", []) if responses is not None else None))
+
+    coords = None
+    aiming_model_time = 0
+    gameplay_model_time = 0
+    tool_calls_output = None
+
+    try:
+        pending = {aiming_task, gameplay_task}
+        while aiming_task in pending:
+            done, pending = await asyncio.wait(pending, timeout=remaining(),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            if gameplay_task in done:
+                gameplay_model_time = loop.time() - start
+
+        aiming_model_time = loop.time() - start
+        if aiming_task.done():
+            coords = aiming_task.result()
+            if coords is not None:
+                coords = frame.to_screen(coords)
+        else:
+            log(f"  [Timeout] Aiming model did not answer within {timeout}s.")
+            get_tracer().add("model_timeouts", 1, stage="aiming")
+            await _cancel_and_wait(aiming_task)
+
+        if coords:
+            await _cancel_and_wait(gameplay_task)
+            gameplay_model_time = 0
+        else:
+            try:
+                _, _, tool_calls_output = await asyncio.wait_for(gameplay_task, timeout=remaining())
+                gameplay_model_time = gameplay_model_time or loop.time() - start
+            except asyncio.TimeoutError:
+                log(f"  [Timeout] Gameplay model did not answer within {timeout}s.")
+                get_tracer().add("model_timeouts", 1, stage="gameplay")
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                log(f"  [Throttled] Gameplay model gave up: {type(e).__name__}")
+    except BaseException:
+        await _cancel_and_wait(aiming_task)
+        await _cancel_and_wait(gameplay_task)
+        raise
+
+    if responses is not None:
+        responses["gameplay"] = raw_tool_calls(tool_calls_output)
+    return coords, tool_calls_output, aiming_model_time, gameplay_model_time
+
+
+async def arun_agent(aiming_model: AimingModel,
+                     gameplay_model: OpenRouterGameplayModel,
+                     desktop: Sandbox,
+                     memory_capacity: int = 3,
+                     iterations: int = 10,
+                     image_logging_path: str = "images",
+                     model_timeout: Optional[float] = 30.0,
+                     aiming_gate: Optional[AimingGate] = None,
+                     frame_change_policy: Optional[FrameChangePolicy] = None,
+                     aim_transform: Optional[AimInputTransform] = None,
+                     memory_max_bytes: Optional[int] = 256 * 1024,
+                     memory_max_image_tokens: Optional[int] = None,
+                     memory_mosaic: bool = False,
+                     max_retries_per_iteration: int = 2,
+                     capture_backend=None,
+                     frame_source=None,
+                     tracker: Optional[TargetTracker] = None,
+                     compensator: Optional[LatencyCompensator] = None):
+    """
+    :param model_timeout: deadline in seconds for the model calls of one iteration. No retry
+        is started after it.
+    :param aiming_gate: see run_agent().
+    :param frame_change_policy: see run_agent().
+    :param aim_transform: see run_agent().
+    :param memory_max_bytes: see run_agent().
+    :param memory_max_image_tokens: see run_agent().
+    :param memory_mosaic: see run_agent().
+    :param max_retries_per_iteration: see run_agent().
+    :param capture_backend: see run_agent().
+    :param frame_source: see run_agent().
+    :param tracker: see run_agent().
+    :param compensator: see run_agent().
+    """
+    image_logger = ImageLoggingSettings(base_path=image_logging_path)
+    agent_memory = AgentMemory(max_iterations=memory_capacity, max_bytes=memory_max_bytes,
+                               max_image_tokens=memory_max_image_tokens, mosaic=memory_mosaic)
+
+    try:
+        for i in range(iterations):
+            log(f"\n--- Iteration {i + 1} ---")
+            iteration_start = time.perf_counter()
+
+            action_history = agent_memory.get_action_memory()
+            image_history = agent_memory.get_image_memory()
+            frame = await asyncio.to_thread(capture_screenshot, desktop, image_logger, capture_backend,
+                                          frame_source)
+            image_paths = image_logger.get_current_paths()
+            decision_frame_age_ms = frame_age_ms(frame)
+
+            tracked_coords, decision = None, None
+            if tracker is not None or frame_change_policy is not None:
+                tracked_coords, decision = await asyncio.to_thread(observe_frame, frame, tracker,
+                                                                   frame_change_policy)
+            if skip_iteration(i, iteration_start, decision, frame_change_policy):
+                await asyncio.sleep(decision.wait_before_next)
+                continue
+
+            responses = {}
+            outcome = local_decision(tracked_coords, decision, frame_change_policy)
+            if outcome is None:
+                outcome = await aprocess_models_concurrently(
+                    action_messages=action_history,
+                    image_history_messages=image_history,
+                    frame=frame,
+                    aiming_model=aiming_model,
+                    gameplay_model=gameplay_model,
+                    timeout=model_timeout,
+                    aiming_gate=aiming_gate,
+                    aim_transform=aim_transform,
+                    retry_budget=RetryBudget(max_retries_per_iteration, timeout=model_timeout),
+                    responses=responses,
+                )
+                record_model_decision(outcome, frame_change_policy)
+            coords, tool_calls, aiming_time, gameplay_time = outcome
+
+            action_taken = await asyncio.to_thread(
+                decide_and_act, coords, tool_calls, gameplay_time, desktop, frame, image_paths, gameplay_model,
+                image_logger=image_logger, tracker=tracker, compensator=compensator
+            )
+            finish_iteration(i, iteration_start, frame, image_paths, image_logger, action_taken, coords,
+                             aiming_time, gameplay_time, tracked_coords is not None, decision_frame_age_ms,
+                             responses, frame_change_policy)
+
+            await asyncio.to_thread(update_memory, agent_memory, action_taken, frame)
+            if decision is not None:
+                await asyncio.sleep(decision.wait_before_next)
+
+    finally:
+        # waits for the queued image writes without blocking the event loop
+        await asyncio.to_thread(image_logger.close)
+        print_run_report(aiming_model, agent_memory, aiming_gate=aiming_gate,
+                         frame_change_policy=frame_change_policy, capture_backend=capture_backend,
+                         frame_source=frame_source, tracker=tracker, compensator=compensator)
+
+    return agent_memory
@@ -0,0 +1,217 @@
+"""
+Aim calibration.
+
+get_mouse_movements() assumes that moving the mouse by `aim_multiplier` pixels turns the
+view by one screen pixel, on both axes and for every distance. The real mapping depends
+on the in-game sensitivity and the field of view, and it is not linear: the perspective
+projection compresses the screen towards its edges.
+
+calibrate_aim() measures it. It moves the mouse by known offsets from the crosshair,
+captures the frames before and after, and measures the view shift by phase correlation.
+The measured (screen offset, mouse offset) pairs of every axis form an AimCalibration
+table, which get_mouse_movements() interpolates once it is set with
+image_handling.set_aim_calibration():
+
+    calibration = calibrate_aim(desktop)
+    calibration.save("aim_calibration.json")
+
+    set_aim_calibration(AimCalibration.load("aim_calibration.json"))
+"""
+
+import json
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from .frame import capture_frame
+from .input_script import InputScript
+from .tracking import to_grey
+
+
+def phase_correlation(before: np.ndarray, after: np.ndarray) -> Tuple[float, float, float]:
+    """
+    Translation of `after` against `before` (two grey images of the same shape) by phase
+    correlation: a point at (x, y) in `before` is at (x + dx, y + dy) in `after`.
+    Returns (dx, dy, peak); the peak (0..1) drops when the images have little in common.
+    """
+    height, width = before.shape
+    window = np.outer(np.hanning(height), np.hanning(width)).astype(np.float32)
+    spectrum = np.fft.rfft2(after * window) * np.conj(np.fft.rfft2(before * window))
+    spectrum /= np.maximum(np.abs(spectrum), 1e-9)
+    correlation = np.fft.irfft2(spectrum, (height, width))
+
+    y, x = np.unravel_index(int(np.argmax(correlation)), correlation.shape)
+    peak = float(correlation[y, x])
+
+    def refine(minus: float, centre: float, plus: float) -> float:
+        # sub-pixel position of the peak from a parabola through three samples
+        denominator = minus - 2 * centre + plus
+        return 0.0 if abs(denominator) < 1e-12 else 0.5 * (minus - plus) / denominator
+
+    dx = x + refine(correlation[y, x - 1], peak, correlation[y, (x + 1) % width])
+    dy = y + refine(correlation[y - 1, x], peak, correlation[(y + 1) % height, x])
+    # shifts past the middle wrap around
+    if dx > width / 2:
+        dx -= width
+    if dy > height / 2:
+        dy -= height
+    return float(dx), float(dy), peak
+
+
+class AimCalibration:
+    AXES = ("x", "y")
+
+    def __init__(self,
+                 tables: Dict[str, Sequence[Tuple[float, float]]],
+                 screen_center: Tuple[int, int] = (960, 540),
+                 screen_size: Tuple[int, int] = (1920, 1080)):
+        """
+        :param tables: per axis, (screen offset, mouse offset) pairs: moving the mouse by the mouse
+            offset from the crosshair brings a point at the screen offset from the crosshair to it.
+        """
+        self.tables = {}
+        for axis in self.AXES:
+            points = sorted(tables[axis])
+            if len(points) < 2:
+                raise ValueError(f"The {axis} table needs at least two points.")
+            screen = np.array([p[0] for p in points], dtype=np.float64)
+            mouse = np.array([p[1] for p in points], dtype=np.float64)
+            if np.any(np.diff(screen) <= 0) or np.any(np.diff(mouse) <= 0):
+                raise ValueError(f"The {axis} table has to be strictly increasing.")
+            self.tables[axis] = (screen, mouse)
+        self.screen_center = screen_center
+        self.screen_size = screen_size
+
+    @classmethod
+    def linear(cls, aim_multiplier: float = 1.3, **kwargs) -> "AimCalibration":
+        """The mapping get_mouse_movements() assumes without calibration."""
+        return cls({axis: [(-1000.0, -1000.0 * aim_multiplier), (1000.0, 1000.0 * aim_multiplier)]
+                    for axis in cls.AXES}, **kwargs)
+
+    @staticmethod
+    def _interpolate(value: float, xs: np.ndarray, ys: np.ndarray) -> float:
+        # linear inside the table, extended with the slope of the outermost segments
+        if value < xs[0]:
+            return float(ys[0] + (value - xs[0]) * (ys[1] - ys[0]) / (xs[1] - xs[0]))
+        if value > xs[-1]:
+            return float(ys[-1] + (value - xs[-1]) * (ys[-1] - ys[-2]) / (xs[-1] - xs[-2]))
+        return float(np.interp(value, xs, ys))
+
+    def mouse_offset(self, screen_offset: float, axis: str) -> float:
+        """Mouse offset from the crosshair that brings a point at `screen_offset` to the crosshair."""
+        screen, mouse = self.tables[axis]
+        return self._interpolate(screen_offset, screen, mouse)
+
+    def screen_offset(self, mouse_offset: float, axis: str) -> float:
+        """The inverse: how far from the crosshair a point is that a mouse move of `mouse_offset` centres."""
+        screen, mouse = self.tables[axis]
+        return self._interpolate(mouse_offset, mouse, screen)
+
+    def to_dict(self) -> Dict:
+        return {
+            "screen_center": list(self.screen_center),
+            "screen_size": list(self.screen_size),
+            **{axis: [[float(s), float(m)] for s, m in zip(*self.tables[axis])] for axis in self.AXES},
+        }
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> "AimCalibration":
+        with open(path) as f:
+            data = json.load(f)
+        return cls({axis: [tuple(point) for point in data[axis]] for axis in cls.AXES},
+                   screen_center=tuple(data["screen_center"]),
+                   screen_size=tuple(data["screen_size"]))
+
+    def __repr__(self):
+        def slope(axis):
+            screen, mouse = self.tables[axis]
+            return (mouse[-1] - mouse[0]) / (screen[-1] - screen[0])
+        return f"AimCalibration(mouse/screen x={slope('x'):.3f}, y={slope('y'):.3f})"
+
+
+def measure_view_shift(desktop, mouse_offset: Tuple[int, int], screen_center: Tuple[int, int] = (960, 540),
+                       settle_ms: int = 300, region: Tuple[float, float, float, float] = (0.1, 0.05, 0.9, 0.75),
+                       stride: int = 2, capture_backend=None) -> Tuple[float, float, float]:
+    """
+    Moves the mouse by `mouse_offset` from the crosshair and returns how far the view moved
+    (dx, dy in screen pixels, static points move by it) and the correlation peak. The move is
+    undone afterwards.
+
+    :param region: (left, top, right, bottom) fractions of the frame that are compared. The HUD
+        and the weapon at the bottom do not move with the view.
+    """
+    def grab():
+        frame = capture_frame(desktop, backend=capture_backend)
+        height, width = frame.pixels.shape[:2]
+        left, top, right, bottom = (int(region[0] * width), int(region[1] * height),
+                                    int(region[2] * width), int(region[3] * height))
+        scale = 1.0 if frame.screen_transform is None else frame.screen_transform.scale_x
+        return to_grey(frame.pixels[top:bottom, left:right], stride), scale
+
+    cx, cy = screen_center
+    before, scale = grab()
+    InputScript().move_mouse(cx + mouse_offset[0], cy + mouse_offset[1]).wait(settle_ms).run(desktop)
+    after, _ = grab()
+    InputScript().move_mouse(cx - mouse_offset[0], cy - mouse_offset[1]).wait(settle_ms).run(desktop)
+
+    dx, dy, peak = phase_correlation(before, after)
+    return dx * stride / scale, dy * stride / scale, peak
+
+
+def fit_table(samples: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+    """
+    (screen offset, mouse offset) table from measured samples: repeated mouse offsets are
+    averaged, (0, 0) is added and points which would make the table non-monotonic are dropped.
+    """
+    by_mouse: Dict[float, List[float]] = {}
+    for screen, mouse in samples:
+        by_mouse.setdefault(mouse, []).append(screen)
+    points = sorted([(float(np.median(screens)), mouse) for mouse, screens in by_mouse.items()] + [(0.0, 0.0)],
+                    key=lambda point: point[1])
+    table = [points[0]]
+    for screen, mouse in points[1:]:
+        if screen > table[-1][0] and mouse > table[-1][1]:
+            table.append((screen, mouse))
+    return table
+
+
+def calibrate_aim(desktop,
+                  mouse_offsets: Sequence[int] = (25, 50, 100, 200, 300, 400),
+                  repeats: int = 2,
+                  screen_center: Tuple[int, int] = (960, 540),
+                  screen_size: Tuple[int, int] = (1920, 1080),
+                  settle_ms: int = 300,
+                  min_peak: float = 0.05,
+                  capture_backend=None) -> AimCalibration:
+    """
+    Measures the view shift of known mouse moves on both axes and fits an AimCalibration.
+    Run it in game, facing a textured wall or scenery (not the sky), with no one moving in view.
+
+    :param mouse_offsets: mouse offsets from the crosshair to measure, each in both directions.
+        The view shift of the largest one has to stay well below the compared region's size.
+    :param min_peak: measurements with a weaker correlation peak are discarded.
+    """
+    samples = {"x": [], "y": []}
+    for axis in AimCalibration.AXES:
+        for _ in range(repeats):
+            for magnitude in mouse_offsets:
+                for offset in (magnitude, -magnitude):
+                    move = (offset, 0) if axis == "x" else (0, offset)
+                    dx, dy, peak = measure_view_shift(desktop, move, screen_center=screen_center,
+                                                      settle_ms=settle_ms, capture_backend=capture_backend)
+                    shift = dx if axis == "x" else dy
+                    if peak < min_peak:
+                        print(f"  [Calibration] {axis} {offset:+d}: weak match (peak {peak:.3f}), skipped.")
+                        continue
+                    # static points moved by `shift`; a target at -shift is what this move centres
+                    samples[axis].append((-shift, float(offset)))
+                    print(f"  [Calibration] {axis} mouse {offset:+d} -> view {shift:+.1f}px (peak {peak:.2f})")
+
+    calibration = AimCalibration({axis: fit_table(samples[axis]) for axis in AimCalibration.AXES},
+                                 screen_center=screen_center, screen_size=screen_size)
+    print(f"[Calibration] {calibration}")
+    return calibration
@@ -0,0 +1,145 @@
+"""
+Screenshot capture backends.
+
+ScreenshotBackend is desktop.screenshot(): a full-size PNG (about 2-3 MB at 1920x1080)
+is transferred every iteration. SandboxEncodeBackend grabs the X display with ffmpeg
+inside the sandbox, crops, scales and encodes it to JPEG or WebP there, and only
+transfers the final bytes, typically 100-200 KB for a full-size JPEG. When ffmpeg is
+missing or fails, it falls back to desktop.screenshot().
+
+The frames of a cropping / scaling backend are not in screen coordinates any more.
+Their screen_transform maps points back to the screen before aiming.
+
+    run_agent(..., capture_backend=SandboxEncodeBackend(format="jpeg", quality=80))
+"""
+
+import base64
+import shlex
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from .aim_transform import AffineTransform
+from .frame import Frame, detect_format
+from .image_handling import capture_screenshot_bytes
+
+
+class ScreenshotBackend:
+    """desktop.screenshot(), the full-size PNG."""
+    name = "screenshot"
+
+    def __init__(self):
+        self.captures = 0
+        self.bytes = 0
+        self.time = 0.0
+        self._lock = threading.Lock()
+
+    def _record(self, size: int, elapsed: float):
+        with self._lock:
+            self.captures += 1
+            self.bytes += size
+            self.time += elapsed
+
+    def capture(self, desktop) -> Frame:
+        captured_at = time.perf_counter()
+        data = capture_screenshot_bytes(desktop=desktop)
+        self._record(len(data), time.perf_counter() - captured_at)
+        return Frame(data, captured_at=captured_at)
+
+    def report(self) -> Dict:
+        with self._lock:
+            return {
+                "backend": self.name,
+                "captures": self.captures,
+                "avg_kb": round(self.bytes / self.captures / 1024, 1) if self.captures else 0.0,
+                "avg_ms": round(1000 * self.time / self.captures, 1) if self.captures else 0.0,
+            }
+
+
+def ffmpeg_quality(quality: int) -> int:
+    """Maps a JPEG quality (1-100) to ffmpeg's mjpeg qscale (31 worst - 2 best)."""
+    return int(round(31 - (min(max(quality, 1), 100) - 1) * 29 / 99))
+
+
+class SandboxEncodeBackend(ScreenshotBackend):
+    name = "sandbox"
+    FORMATS = {"jpeg": "-c:v mjpeg -q:v {qscale}", "webp": "-c:v libwebp -quality {quality}"}
+
+    def __init__(self,
+                 format: str = "jpeg",
+                 quality: int = 80,
+                 scale: float = 1.0,
+                 crop: Optional[Tuple[int, int, int, int]] = None,
+                 screen_size: Tuple[int, int] = (1920, 1080),
+                 timeout: float = 10,
+                 max_failures: int = 3):
+        """
+        :param format: 'jpeg' or 'webp' (needs an ffmpeg built with libwebp).
+        :param quality: 1-100.
+        :param scale: downscale factor applied in the sandbox after cropping.
+        :param crop: (x1, y1, x2, y2) screen region to capture, None for the whole screen.
+        :param screen_size: resolution of the sandbox display.
+        :param max_failures: consecutive failures after which the backend stays on
+            desktop.screenshot() for good, e.g. when ffmpeg is not installed.
+        """
+        if format not in self.FORMATS:
+            raise ValueError(f"Unknown capture format '{format}'. Choose from {list(self.FORMATS)}.")
+        if not 0 < scale <= 1:
+            raise ValueError("scale has to be in (0, 1].")
+
+        super().__init__()
+        self.format = format
+        self.quality = quality
+        self.scale = scale
+        self.crop = crop or (0, 0, screen_size[0], screen_size[1])
+        self.timeout = timeout
+        self.max_failures = max_failures
+
+        x1, y1, x2, y2 = self.crop
+        self.output_size = (max(2, int((x2 - x1) * scale) // 2 * 2), max(2, int((y2 - y1) * scale) // 2 * 2))
+        self.screen_transform = AffineTransform(scale_x=self.output_size[0] / (x2 - x1),
+                                                scale_y=self.output_size[1] / (y2 - y1),
+                                                offset_x=x1, offset_y=y1)
+
+        self.fallback = ScreenshotBackend()
+        self.failures = 0
+        self.disabled = False
+
+    def command(self, display: str) -> str:
+        x1, y1, x2, y2 = self.crop
+        scale = ""
+        if self.output_size != (x2 - x1, y2 - y1):
+            scale = f"-vf scale={self.output_size[0]}:{self.output_size[1]}:flags=bilinear "
+        codec = self.FORMATS[self.format].format(qscale=ffmpeg_quality(self.quality), quality=self.quality)
+        return ("set -o pipefail; "
+                f"ffmpeg -hide_banner -loglevel error -f x11grab -draw_mouse 0 -video_size {x2 - x1}x{y2 - y1} "
+                f"-i {shlex.quote(f'{display}+{x1},{y1}')} -frames:v 1 {scale}{codec} -f image2pipe - "
+                "| base64 -w0")
+
+    def capture(self, desktop) -> Frame:
+        if self.disabled:
+            return self.fallback.capture(desktop)
+
+        captured_at = time.perf_counter()
+        display = getattr(desktop, "_display", ":0")
+        try:
+            result = desktop.commands.run(self.command(display), envs={"DISPLAY": display}, timeout=self.timeout)
+            data = base64.b64decode(result.stdout)
+            detect_format(data)
+        except Exception as e:
+            self.failures += 1
+            if self.failures >= self.max_failures:
+                self.disabled = True
+                print(f"  [Capture] In-sandbox capture failed {self.failures} times ({type(e).__name__}: {e}). "
+                      f"Using desktop.screenshot() from now on.")
+            return self.fallback.capture(desktop)
+
+        self.failures = 0
+        self._record(len(data), time.perf_counter() - captured_at)
+        return Frame(data, captured_at=captured_at, screen_transform=self.screen_transform)
+
+    def report(self) -> Dict:
+        report = super().report()
+        report.update(format=self.format, output_size=self.output_size, disabled=self.disabled,
+                      fallback=self.fallback.report())
+        return report
@@ -0,0 +1,187 @@
+"""
+Latency compensation of aiming points.
+
+The aiming model answers for a frame that is one to three seconds old. Every aim move
+and every turn issued since that capture has moved the view, so the point no longer
+is where the target is on the screen.
+
+CameraMotion logs the view shifts caused by our own mouse moves. In game the mouse is
+warped back to the crosshair, so a move to (x, y) turns the view by the offset from
+the screen centre. get_mouse_movements() scales a screen offset by the aim multiplier,
+so a static point on the screen moves by -offset / aim_multiplier, or by the inverse of
+the aim calibration table when one is set (see calibration.py). Small-angle
+approximation: the shift is treated as the same everywhere on the screen.
+
+The LatencyCompensator re-projects a point of an old frame into the current view and
+leads moving targets with the velocity of consecutive detections:
+
+    motion = CameraMotion()
+    move_tool = MoveTool(desktop=desktop, camera_motion=motion)
+    run_agent(..., compensator=LatencyCompensator(motion))
+"""
+
+import bisect
+import collections
+import math
+import threading
+import time
+from typing import Deque, Dict, Iterable, Optional, Tuple
+
+from .image_handling import get_aim_calibration
+
+
+class CameraMotion:
+    def __init__(self,
+                 screen_center: Tuple[int, int] = (960, 540),
+                 aim_multiplier: float = 1.3,
+                 history: int = 512,
+                 calibration=None):
+        """
+        :param aim_multiplier: mouse pixels per screen pixel, see get_mouse_movements().
+        :param calibration: AimCalibration to use instead of `aim_multiplier`, by default the one
+            set with set_aim_calibration().
+        :param history: number of moves kept. Older captures count as before all of them.
+        """
+        self.screen_center = screen_center
+        self.aim_multiplier = aim_multiplier
+        self.calibration = calibration
+        # (time, cumulative x shift, cumulative y shift), in time order
+        self._log: Deque[Tuple[float, float, float]] = collections.deque(maxlen=history)
+        self._total = (0.0, 0.0)
+        self._base = (0.0, 0.0)  # cumulative shift before the oldest entry of the log
+        self._lock = threading.Lock()
+
+    def record(self, dx: float, dy: float, at: Optional[float] = None):
+        """Records a view shift: static points moved by (dx, dy) screen pixels at time `at`."""
+        at = time.perf_counter() if at is None else at
+        with self._lock:
+            self._total = (self._total[0] + dx, self._total[1] + dy)
+            if self._log and at < self._log[-1][0]:
+                at = self._log[-1][0]  # keep the log sorted
+            if len(self._log) == self._log.maxlen:
+                self._base = self._log[0][1:]
+            self._log.append((at, self._total[0], self._total[1]))
+
+    def record_mouse_moves(self, moves: Iterable[Tuple[int, int]], at: Optional[float] = None):
+        """Records the view shift of absolute mouse moves, each one starting from the crosshair."""
+        calibration = self.calibration or get_aim_calibration()
+        dx = dy = 0.0
+        for x, y in moves:
+            offset_x, offset_y = x - self.screen_center[0], y - self.screen_center[1]
+            if calibration is not None:
+                dx -= calibration.screen_offset(offset_x, "x")
+                dy -= calibration.screen_offset(offset_y, "y")
+            else:
+                dx -= offset_x / self.aim_multiplier
+                dy -= offset_y / self.aim_multiplier
+        if dx or dy:
+            self.record(dx, dy, at)
+
+    def record_script(self, script, at: Optional[float] = None):
+        """Records the mouse moves of an InputScript after it ran."""
+        self.record_mouse_moves(script.mouse_moves(), at)
+
+    def offset_at(self, at: float) -> Tuple[float, float]:
+        """Cumulative view shift of all moves recorded up to time `at`."""
+        with self._lock:
+            index = bisect.bisect_right(self._log, (at, math.inf, math.inf))
+            if index == 0:
+                return self._base
+            return self._log[index - 1][1], self._log[index - 1][2]
+
+    def shift_since(self, at: float, now: Optional[float] = None) -> Tuple[float, float]:
+        """How far a static point seen at time `at` has moved on the screen by `now`."""
+        start = self.offset_at(at)
+        end = self.offset_at(time.perf_counter() if now is None else now)
+        return end[0] - start[0], end[1] - start[1]
+
+
+class LatencyCompensator:
+    def __init__(self,
+                 camera_motion: CameraMotion,
+                 lead: bool = True,
+                 actuation_delay: float = 0.1,
+                 min_track_gap: float = 0.3,
+                 max_track_gap: float = 2.0,
+                 max_target_speed: float = 400.0,
+                 max_camera_shift: float = 100.0,
+                 max_lead: float = 150.0):
+        """
+        :param lead: also predict where a moving target will be.
+        :param actuation_delay: seconds between compensating and the shot, added to the lead time.
+        :param min_track_gap: detections closer in time than this give a velocity dominated by the
+            detection noise. The older one is kept as the reference instead.
+        :param max_track_gap: detections further apart than this are not used for the velocity.
+        :param max_target_speed: screen pixels / s. Faster apparent motion means the two
+            detections are different targets, or one of them is wrong.
+        :param max_camera_shift: screen pixels. When the view turned more than this between two
+            detections, the error of the turn estimate would dominate the velocity, so there is no lead.
+        :param max_lead: cap of the lead in screen pixels.
+        """
+        self.camera_motion = camera_motion
+        self.lead = lead
+        self.actuation_delay = actuation_delay
+        self.min_track_gap = min_track_gap
+        self.max_track_gap = max_track_gap
+        self.max_target_speed = max_target_speed
+        self.max_camera_shift = max_camera_shift
+        self.max_lead = max_lead
+
+        # last detection as (captured_at, x, y, view offset) in view-independent coordinates
+        self._last: Optional[Tuple[float, float, float, Tuple[float, float]]] = None
+        self._lock = threading.Lock()
+
+        self.compensated = 0
+        self.led = 0
+        self.shift_sum = 0.0
+        self.lead_sum = 0.0
+
+    def compensate(self, point: Dict[str, int], captured_at: float, now: Optional[float] = None) -> Dict[str, int]:
+        """
+        Where to aim now for a target found at `point` (screen coordinates) in a frame
+        captured at `captured_at`.
+        """
+        now = time.perf_counter() if now is None else now
+        offset_then = self.camera_motion.offset_at(captured_at)
+        offset_now = self.camera_motion.offset_at(now)
+        # subtracting the cumulative view shift makes positions of different frames comparable
+        x, y = point["x"] - offset_then[0], point["y"] - offset_then[1]
+
+        lead_x = lead_y = 0.0
+        with self._lock:
+            last = self._last
+            if last is None or not 0 <= captured_at - last[0] < self.min_track_gap:
+                self._last = (captured_at, x, y, offset_then)
+            if self.lead and last is not None and self.min_track_gap <= captured_at - last[0] <= self.max_track_gap \
+                    and math.hypot(offset_then[0] - last[3][0], offset_then[1] - last[3][1]) <= self.max_camera_shift:
+                elapsed = captured_at - last[0]
+                vx, vy = (x - last[1]) / elapsed, (y - last[2]) / elapsed
+                if math.hypot(vx, vy) <= self.max_target_speed:
+                    horizon = now + self.actuation_delay - captured_at
+                    lead_x, lead_y = vx * horizon, vy * horizon
+                    length = math.hypot(lead_x, lead_y)
+                    if length > self.max_lead:
+                        lead_x, lead_y = lead_x * self.max_lead / length, lead_y * self.max_lead / length
+
+            shift = (offset_now[0] - offset_then[0], offset_now[1] - offset_then[1])
+            self.compensated += 1
+            self.shift_sum += math.hypot(*shift)
+            if lead_x or lead_y:
+                self.led += 1
+                self.lead_sum += math.hypot(lead_x, lead_y)
+
+        return {"x": int(round(x + lead_x + offset_now[0])), "y": int(round(y + lead_y + offset_now[1]))}
+
+    def reset(self):
+        """Forgets the last detection, e.g. when the target was lost."""
+        with self._lock:
+            self._last = None
+
+    def report(self) -> Dict:
+        with self._lock:
+            return {
+                "compensated": self.compensated,
+                "led": self.led,
+                "avg_shift_px": round(self.shift_sum / self.compensated, 1) if self.compensated else 0.0,
+                "avg_lead_px": round(self.lead_sum / self.led, 1) if self.led else 0.0,
+            }
@@ -1,16 +1,15 @@
 from typing import List
 from e2b_desktop import Sandbox
 
+from .input_script import InputScript
+
 
 def aim(mouse_movements: List, desktop: "Sandbox"):
-    for i, move_coords in enumerate(mouse_movements):
-        #print(f"Aiming to coords {i+1}: {move_coords}")
-        desktop.move_mouse(**move_coords)
+    InputScript().aim(mouse_movements).run(desktop)
         
 def shoot(desktop: "Sandbox", clicks: int = 3):
-    for i in range(clicks):
-        desktop.left_click()
-        desktop.wait(150)
-        desktop.left_click()
-        desktop.wait(150)
-        desktop.left_click()
\ No newline at end of file
+    InputScript().burst(clicks=clicks).run(desktop)
+
+def aim_and_shoot(mouse_movements: List, desktop: "Sandbox", clicks: int = 3):
+    """aim() and shoot() in a single round trip to the sandbox."""
+    InputScript().aim(mouse_movements).burst(clicks=clicks).run(desktop)
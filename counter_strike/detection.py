@@ -0,0 +1,252 @@
+"""
+Fast local enemy pre-detection.
+
+The aiming prompts identify enemies by fixed colour cues (the red helmet / red
+headband of T, the blue clothing of CT). A few vectorized NumPy colour masks
+and a connected-components pass find regions with those colours in a few
+milliseconds. The AimingGate uses them to skip (or downgrade) the aiming LLM
+call on frames without any candidate and to pass candidate boxes as hints
+when there are some.
+"""
+
+import copy
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+# The enemy colour each side is looking for. See prompts.py.
+ENEMY_COLOURS = {
+    "CT": "red",  # T wear a red helmet / headband
+    "T": "blue",  # CT wear blue or grey clothing
+}
+
+
+def colour_mask(pixels: np.ndarray, colour: str, min_margin: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns (mask, margin): pixels where `colour` dominates the other channels by at least
+    `min_margin`, and by how much it dominates (0 outside the mask).
+    """
+    rgb = pixels.astype(np.int16)
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+
+    if colour == "red":
+        margin = r - np.maximum(g, b)
+    elif colour == "blue":
+        margin = b - np.maximum(r, g)
+    else:
+        raise ValueError(f"Unknown enemy colour '{colour}'. Choose from ['red', 'blue'].")
+
+    mask = margin >= min_margin
+    return mask, np.where(mask, margin, 0)
+
+
+def label_components(mask: np.ndarray, max_iterations: int = 1000) -> np.ndarray:
+    """
+    4-connected component labelling of a boolean mask, using only NumPy.
+
+    Every foreground pixel starts as its own tree. Each round hooks the root of the larger
+    label of every pair of touching pixels to the smaller one and then compresses the trees
+    by pointer jumping, until no pair of touching pixels has different labels. This takes
+    about log(component size) rounds, however long and thin a component is. max_iterations
+    is only a safety net. Returns an int array where 0 is background and every component
+    shares a label.
+    """
+    labels = np.zeros(mask.shape, dtype=np.int32)
+    count = int(np.count_nonzero(mask))
+    if count == 0:
+        return labels
+
+    ids = np.zeros(mask.shape, dtype=np.int32)
+    ids[mask] = np.arange(1, count + 1, dtype=np.int32)
+    # the pairs of touching foreground pixels
+    horizontal = mask[:, :-1] & mask[:, 1:]
+    vertical = mask[:-1, :] & mask[1:, :]
+    a = np.concatenate([ids[:, :-1][horizontal], ids[:-1, :][vertical]])
+    b = np.concatenate([ids[:, 1:][horizontal], ids[1:, :][vertical]])
+
+    parent = np.arange(count + 1, dtype=np.int32)
+    for _ in range(max_iterations):
+        root_a, root_b = parent[a], parent[b]
+        differ = root_a != root_b
+        if not differ.any():
+            break
+        root_a, root_b = root_a[differ], root_b[differ]
+        np.minimum.at(parent, np.maximum(root_a, root_b), np.minimum(root_a, root_b))
+        while True:
+            jumped = parent[parent]
+            if np.array_equal(jumped, parent):
+                break
+            parent = jumped
+
+    labels[mask] = parent[ids[mask]]
+    return labels
+
+
+class Candidate:
+    def __init__(self, box: Tuple[int, int, int, int], score: float, area: int):
+        """
+        :param box: (x1, y1, x2, y2) in screen pixels
+        """
+        self.box = box
+        self.score = score
+        self.area = area
+
+    def center(self) -> Dict[str, int]:
+        x1, y1, x2, y2 = self.box
+        return {"x": (x1 + x2) // 2, "y": (y1 + y2) // 2}
+
+    def __repr__(self):
+        return f"Candidate(box={self.box}, score={self.score:.2f})"
+
+
+class EnemyCandidateDetector:
+    def __init__(self,
+                 side: str,
+                 threshold: float = 0.3,
+                 stride: int = 2,
+                 min_margin: int = 60,
+                 reference_area: int = 12,
+                 max_area_fraction: float = 0.05,
+                 ignore_bottom_fraction: float = 0.08,
+                 max_candidates: int = 5,
+                 box_padding: int = 24):
+        """
+        :param side: the agent's side, 'CT' or 'T'. Decides which enemy colour is searched for.
+        :param threshold: 0..1, the recall/precision knob. A candidate's score grows with its
+            colour strength and its size (up to `reference_area` pixels at the sampled
+            resolution). Lower values keep more, weaker candidates: fewer missed enemies,
+            fewer skipped LLM calls.
+        :param stride: the frame is sampled every `stride` pixels.
+        :param min_margin: how much the enemy colour has to dominate the other channels.
+        :param max_area_fraction: larger blobs are scenery (walls, boxes), not players.
+        :param ignore_bottom_fraction: the HUD at the bottom of the screen is orange.
+        """
+        if side not in ENEMY_COLOURS:
+            raise ValueError(f"Please choose a valid side from {list(ENEMY_COLOURS)}.")
+
+        self.colour = ENEMY_COLOURS[side]
+        self.threshold = threshold
+        self.stride = stride
+        self.min_margin = min_margin
+        self.reference_area = reference_area
+        self.max_area_fraction = max_area_fraction
+        self.ignore_bottom_fraction = ignore_bottom_fraction
+        self.max_candidates = max_candidates
+        self.box_padding = box_padding
+
+    def detect(self, pixels: np.ndarray) -> List[Candidate]:
+        """Returns candidate enemy regions in screen coordinates, best first."""
+        height, width = pixels.shape[:2]
+        usable_height = int(height * (1 - self.ignore_bottom_fraction))
+        sampled = pixels[:usable_height:self.stride, ::self.stride]
+
+        mask, margin = colour_mask(sampled, self.colour, self.min_margin)
+        if not mask.any():
+            return []
+
+        labels = label_components(mask)
+        ys, xs = np.nonzero(labels)
+        component_labels, component_index, areas = np.unique(labels[ys, xs], return_inverse=True,
+                                                             return_counts=True)
+        n = len(component_labels)
+
+        x_min = np.full(n, sampled.shape[1]); np.minimum.at(x_min, component_index, xs)
+        y_min = np.full(n, sampled.shape[0]); np.minimum.at(y_min, component_index, ys)
+        x_max = np.zeros(n, dtype=np.int64); np.maximum.at(x_max, component_index, xs)
+        y_max = np.zeros(n, dtype=np.int64); np.maximum.at(y_max, component_index, ys)
+        margin_sum = np.bincount(component_index, weights=margin[ys, xs], minlength=n)
+
+        strength = np.clip(margin_sum / areas / 128, 0, 1)
+        size = np.clip(areas / self.reference_area, 0, 1)
+        scores = strength * size
+
+        max_area = self.max_area_fraction * mask.size
+        keep = np.nonzero((scores >= self.threshold) & (areas <= max_area))[0]
+        keep = keep[np.argsort(-scores[keep])][:self.max_candidates]
+
+        candidates = []
+        for i in keep:
+            box = (max(0, int(x_min[i]) * self.stride - self.box_padding),
+                   max(0, int(y_min[i]) * self.stride - self.box_padding),
+                   min(width, int(x_max[i] + 1) * self.stride + self.box_padding),
+                   min(height, int(y_max[i] + 1) * self.stride + self.box_padding))
+            candidates.append(Candidate(box=box, score=float(scores[i]), area=int(areas[i])))
+        return candidates
+
+
+class AimingGate:
+    """
+    Decides, per frame, whether and how the aiming model is called.
+
+    - no candidate: the aiming call is skipped, or sent to `downgrade_model` if given
+    - candidates: the aiming call is made, with the candidate boxes as a text hint
+    """
+    def __init__(self,
+                 detector: EnemyCandidateDetector,
+                 downgrade_model=None,
+                 send_hints: bool = True):
+        self.detector = detector
+        self.downgrade_model = downgrade_model
+        self.send_hints = send_hints
+
+        self.frames = 0
+        self.frames_with_candidates = 0
+        self.calls_skipped = 0
+        self.calls_downgraded = 0
+        self.detect_time = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_hint_message(screenshot_message: List[Dict], candidates: List[Candidate], transform=None) -> List[Dict]:
+        """
+        Appends the candidate boxes as a text hint to the last message.
+        :param transform: AffineTransform of the image in the message, when it is not the full screen
+        """
+        boxes = [c.box if transform is None else transform.box_to_view(c.box) for c in candidates]
+        hint = {
+            "type": "text",
+            "text": f"A fast colour detector found possible enemies in these regions "
+                    f"[x1, y1, x2, y2]: {', '.join(str(list(box)) for box in boxes)}. "
+                    f"Check them first, but answer None if none of them matches the description.",
+        }
+        message = copy.copy(screenshot_message)
+        last = dict(message[-1])
+        last["content"] = list(last.get("content", [])) + [hint]
+        message[-1] = last
+        return message
+
+    def select_model(self, frame, aiming_model):
+        """
+        Runs the detector on the Frame's pixels and returns (model, candidates).
+        model is None when the aiming call should be skipped.
+        """
+        start = time.perf_counter()
+        candidates = self.detector.detect(frame.pixels)
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.frames += 1
+            self.detect_time += elapsed
+            if candidates:
+                self.frames_with_candidates += 1
+            elif self.downgrade_model is None:
+                self.calls_skipped += 1
+            else:
+                self.calls_downgraded += 1
+
+        if not candidates:
+            return self.downgrade_model, candidates
+        return aiming_model, candidates
+
+    def report(self) -> Dict:
+        with self._lock:
+            return {
+                "frames": self.frames,
+                "frames_with_candidates": self.frames_with_candidates,
+                "aiming_calls_skipped": self.calls_skipped,
+                "aiming_calls_downgraded": self.calls_downgraded,
+                "avg_detect_ms": round(1000 * self.detect_time / self.frames, 2) if self.frames else 0.0,
+            }
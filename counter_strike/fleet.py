@@ -0,0 +1,210 @@
+"""
+Runs several agents, each in its own sandbox, from one process.
+
+    agents = [FleetAgent(f"ct{i}", AgentSettings(side="CT", memory=4)) for i in range(5)] + \
+             [FleetAgent(f"t{i}", AgentSettings(side="T", memory=4)) for i in range(5)]
+    with Fleet(agents, server_ip=CS_SERVER_IP, max_concurrency=12) as fleet:
+        fleet.provision()
+        results = fleet.run()
+
+Every agent runs run_agent() on its own thread with its own memory and image log. The model
+calls of all agents go through one FairInferenceScheduler, which hands out the
+`max_concurrency` slots round-robin over the agents. With `batch_aiming`, the aiming
+requests of the agents of one side are tiled into shared requests (see aim_batching).
+"""
+
+import concurrent.futures
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from e2b_desktop import Sandbox
+
+from llms.models import AimingModel, OpenRouterGameplayModel
+from llms.tools import MoveTool
+
+from .agent import AgentSettings, run_agent
+from .aim_batching import AimingBatcher, BatchedAimingModel
+from .detection import AimingGate, EnemyCandidateDetector
+from .install_cs import install_cs_1_6, connect_to_server, choose_team
+from .scheduler import FairInferenceScheduler
+
+
+def create_sandbox() -> Sandbox:
+    desktop = Sandbox(
+        display=":0",
+        resolution=(1920, 1080),  # keep this resolution
+        timeout=3600)
+    desktop.stream.start()
+    print(desktop.stream.get_url())
+    print(desktop.stream.get_url(view_only=True))  # only viewing
+    return desktop
+
+
+class FleetAgent:
+    def __init__(self,
+                 name: str,
+                 settings: AgentSettings,
+                 iterations: int = 70,
+                 aiming_model: str = "qwen/qwen2.5-vl-72b-instruct",
+                 gameplay_model: str = "google/gemini-2.5-flash-preview",
+                 use_aiming_gate: bool = True,
+                 **run_agent_kwargs):
+        """
+        :param name: unique name, also used for the image log directory and the scheduler stats.
+        :param settings: side, memory and API key of this agent.
+        :param run_agent_kwargs: passed on to run_agent(), e.g. pipeline_depth or memory_mosaic.
+        """
+        self.name = name
+        self.settings = settings
+        self.iterations = iterations
+        self.aiming_model_name = aiming_model
+        self.gameplay_model_name = gameplay_model
+        self.use_aiming_gate = use_aiming_gate
+        self.run_agent_kwargs = run_agent_kwargs
+        self.desktop: Optional[Sandbox] = None
+
+    def build_models(self, desktop: Sandbox):
+        aiming_model = AimingModel(model=self.aiming_model_name,
+                                   system_message=self.settings.aiming_system_prompt,
+                                   api_key_name=self.settings.open_router_key_name)
+        move_tool = MoveTool(desktop=desktop)
+        gameplay_model = OpenRouterGameplayModel(tools={move_tool.name: move_tool},
+                                                 model=self.gameplay_model_name,
+                                                 api_key_name=self.settings.open_router_key_name)
+        aiming_gate = None
+        if self.use_aiming_gate:
+            aiming_gate = AimingGate(EnemyCandidateDetector(side=self.settings.side, threshold=0.3))
+        return aiming_model, gameplay_model, aiming_gate
+
+
+class Fleet:
+    def __init__(self,
+                 agents: List[FleetAgent],
+                 server_ip: str,
+                 max_concurrency: int = 8,
+                 max_in_flight_per_agent: Optional[int] = None,
+                 image_logging_path: str = "images",
+                 sandbox_factory: Callable[[], Sandbox] = create_sandbox,
+                 batch_aiming: bool = False,
+                 max_aiming_batch: int = 4,
+                 max_aiming_batch_delay: float = 0.05):
+        """
+        :param max_concurrency: model calls in flight at the same time, over all agents.
+        :param max_in_flight_per_agent: optional cap of one agent's calls in flight.
+        :param sandbox_factory: creates the sandbox of one agent.
+        :param batch_aiming: tile the aiming requests of up to `max_aiming_batch` agents of the
+            same side and aiming model into one request. A request which found no partner within
+            `max_aiming_batch_delay` seconds is sent on its own.
+        """
+        names = [agent.name for agent in agents]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Agent names have to be unique, got {names}.")
+
+        self.agents = agents
+        self.server_ip = server_ip
+        self.image_logging_path = image_logging_path
+        self.sandbox_factory = sandbox_factory
+        self.scheduler = FairInferenceScheduler(max_concurrency=max_concurrency,
+                                                max_in_flight_per_client=max_in_flight_per_agent)
+        self.batch_aiming = batch_aiming
+        self.max_aiming_batch = max_aiming_batch
+        self.max_aiming_batch_delay = max_aiming_batch_delay
+        self.batchers: Dict[tuple, AimingBatcher] = {}
+        self._batchers_lock = threading.Lock()
+
+    def _batcher_for(self, agent: FleetAgent, aiming_model) -> AimingBatcher:
+        # agents of one side share the aiming prompt, so only they can share a request
+        key = (agent.settings.side, agent.aiming_model_name)
+        with self._batchers_lock:
+            if key not in self.batchers:
+                self.batchers[key] = AimingBatcher(aiming_model,
+                                                   max_batch_size=self.max_aiming_batch,
+                                                   max_delay=self.max_aiming_batch_delay)
+            return self.batchers[key]
+
+    def _provision_agent(self, agent: FleetAgent, join: bool):
+        agent.desktop = self.sandbox_factory()
+        if join:
+            install_cs_1_6(desktop=agent.desktop)
+            connect_to_server(desktop=agent.desktop, ip_address=self.server_ip)
+            choose_team(desktop=agent.desktop,
+                        team_option=agent.settings.team_choice,
+                        skin=agent.settings.skin_choice)
+
+    def provision(self, join: bool = True):
+        """
+        Creates the sandboxes in parallel and, with `join`, installs the game, connects to the
+        server and picks each agent's team.
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.agents) or 1,
+                                                   thread_name_prefix="provision") as executor:
+            futures = {executor.submit(self._provision_agent, agent, join): agent for agent in self.agents}
+            for future in concurrent.futures.as_completed(futures):
+                future.result()  # raises the first provisioning error
+                print(f"[Fleet] {futures[future].name} ready.")
+
+    def _run_agent(self, agent: FleetAgent) -> Dict:
+        if agent.desktop is None:
+            raise RuntimeError(f"{agent.name} has no sandbox. Call provision() first.")
+        aiming_model, gameplay_model, aiming_gate = agent.build_models(agent.desktop)
+        batcher = None
+        if self.batch_aiming:
+            batcher = self._batcher_for(agent, aiming_model)
+            aiming_model = BatchedAimingModel(batcher)
+        client = self.scheduler.client(agent.name)
+
+        result = {"name": agent.name, "side": agent.settings.side, "iterations": agent.iterations, "error": None}
+        start = time.perf_counter()
+        try:
+            agent_memory = run_agent(aiming_model=aiming_model,
+                                     gameplay_model=gameplay_model,
+                                     desktop=agent.desktop,
+                                     memory_capacity=agent.settings.memory,
+                                     iterations=agent.iterations,
+                                     image_logging_path=f"{self.image_logging_path}/{agent.name}",
+                                     scheduler=client,
+                                     aiming_gate=aiming_gate,
+                                     **agent.run_agent_kwargs)
+            result["memory"] = agent_memory.report()
+            # only the iterations acted on: skipped frames and frames dropped as stale never reach the memory
+            result["iterations_acted"] = agent_memory.added
+        except Exception as e:
+            # one crashed agent must not end the match for the others
+            print(f"[Fleet] {agent.name} failed: {e!r}")
+            result["error"] = repr(e)
+
+        result["elapsed"] = time.perf_counter() - start
+        result["iterations_per_second"] = result["iterations_acted"] / result["elapsed"] \
+            if result["error"] is None else None
+        result["scheduler"] = client.report()
+        if aiming_gate is not None:
+            result["aiming_gate"] = aiming_gate.report()
+        if batcher is not None:
+            result["aiming_batcher"] = batcher.report()  # shared by the agents of the side
+        return result
+
+    def run(self) -> List[Dict]:
+        """Runs all agents concurrently and returns one metrics dict per agent, in agent order."""
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.agents) or 1,
+                                                   thread_name_prefix="agent") as executor:
+            futures = [executor.submit(self._run_agent, agent) for agent in self.agents]
+            return [future.result() for future in futures]
+
+    def close(self):
+        self.scheduler.shutdown()
+        for batcher in self.batchers.values():
+            batcher.close()
+        for agent in self.agents:
+            if agent.desktop is not None:
+                try:
+                    agent.desktop.kill()
+                except Exception as e:
+                    print(f"[Fleet] Could not kill the sandbox of {agent.name}: {e!r}")
+                agent.desktop = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
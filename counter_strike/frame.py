@@ -0,0 +1,150 @@
+"""
+In-memory frames.
+
+A screenshot arrives from the sandbox as encoded bytes. Frame keeps those bytes,
+decodes them at most once and caches every variant derived from them (the data
+URL sent to the models, the aiming views, the memory thumbnail, the detector's
+pixel array, the frame-change signature), so no stage re-decodes or
+re-encodes what another stage already produced.
+"""
+
+import base64
+import io
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from tracing import get_tracer
+
+from .aim_transform import AffineTransform
+from .image_handling import (capture_screenshot_bytes, compress_image_bytes,
+                             draw_point_on_image, get_screenshot_message_from_base64, save_image, to_rgb)
+
+
+_MAGIC_NUMBERS = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"GIF8", "gif"),
+)
+
+
+def detect_format(data: bytes) -> str:
+    """Image format from the first bytes of the encoded data ('png', 'jpeg', 'webp', ...)."""
+    for magic, name in _MAGIC_NUMBERS:
+        if data.startswith(magic):
+            return name
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    raise ValueError("Unknown image format, expected PNG, JPEG, WEBP or GIF data.")
+
+
+class Frame:
+    """One captured screenshot and its lazily computed, cached variants."""
+
+    def __init__(self, data: bytes, captured_at: Optional[float] = None,
+                 screen_transform: Optional[AffineTransform] = None):
+        """
+        :param data: the encoded screenshot as returned by desktop.screenshot()
+        :param captured_at: time.perf_counter() of the capture, defaults to now
+        :param screen_transform: maps frame pixels to screen pixels when the capture was
+            cropped or scaled, None when the frame is the full screen
+        """
+        self.data = data
+        self.format = detect_format(data)
+        self.captured_at = time.perf_counter() if captured_at is None else captured_at
+        self.screen_transform = screen_transform
+
+        self._image: Optional[Image.Image] = None
+        self._pixels: Optional[np.ndarray] = None
+        self._variants: Dict[Hashable, object] = {}
+        # stages of the pipelined loop ask for variants from different threads
+        self._lock = threading.RLock()
+
+    @property
+    def mime_type(self) -> str:
+        return f"image/{self.format}"
+
+    @property
+    def image(self) -> Image.Image:
+        """The decoded RGB image. Treat it as read-only, copy() before drawing on it."""
+        if self._image is None:
+            with self._lock:
+                if self._image is None:
+                    with get_tracer().span("decode", format=self.format):
+                        image = Image.open(io.BytesIO(self.data))
+                        image.load()
+                        self._image = to_rgb(image)
+        return self._image
+
+    @property
+    def pixels(self) -> np.ndarray:
+        """Read-only (height, width, 3) uint8 view of the decoded image."""
+        if self._pixels is None:
+            with self._lock:
+                if self._pixels is None:
+                    self._pixels = np.asarray(self.image)
+        return self._pixels
+
+    @property
+    def size(self):
+        return self.image.size
+
+    def variant(self, key: Hashable, factory: Callable[["Frame"], object]):
+        """Returns the cached variant `key`, computing it with factory(frame) the first time."""
+        with self._lock:
+            if key not in self._variants:
+                with get_tracer().span("encode", variant=key if isinstance(key, str) else key[0]):
+                    self._variants[key] = factory(self)
+            return self._variants[key]
+
+    @property
+    def base64(self) -> str:
+        return self.variant("base64", lambda frame: base64.b64encode(frame.data).decode("utf-8"))
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{self.base64}"
+
+    def screenshot_message(self) -> List[Dict]:
+        return self.variant("message",
+                            lambda frame: get_screenshot_message_from_base64(frame.base64, frame.mime_type))
+
+    def aiming_views(self, aim_transform) -> list:
+        """The AimingViews of an AimInputTransform, computed once per transform."""
+        return self.variant(("aiming_views", id(aim_transform)),
+                            lambda frame: aim_transform.apply_to_image(frame.image))
+
+    def to_screen(self, point: Dict[str, int]) -> Dict[str, int]:
+        """Maps a point of the frame to the screen."""
+        return point if self.screen_transform is None else self.screen_transform.to_screen(point)
+
+    def annotated(self, point: Dict[str, int]) -> Image.Image:
+        """A copy of the frame with the aiming point (in screen coordinates) drawn on it."""
+        if self.screen_transform is not None:
+            point = self.screen_transform.to_view(point)
+        return draw_point_on_image(self.image.copy(), point)
+
+
+def capture_frame(desktop, filename: Optional[str] = None, quality: Optional[int] = None,
+                  backend=None) -> Frame:
+    """
+    Takes a screenshot of the sandbox as a Frame, optionally saving the encoded bytes to `filename`.
+
+    :param backend: a capture backend (see capture.py), None for desktop.screenshot()
+    """
+    if backend is not None:
+        frame = backend.capture(desktop)
+        if filename:
+            save_image(frame.data, filename)
+        return frame
+
+    captured_at = time.perf_counter()
+    data = capture_screenshot_bytes(desktop=desktop)
+    if quality:
+        data = compress_image_bytes(data, quality=quality)
+    if filename:
+        save_image(data, filename)
+    return Frame(data, captured_at=captured_at)
@@ -0,0 +1,115 @@
+"""
+Cheap frame-change detection.
+
+When the bot is stuck against a wall or waiting to respawn, consecutive
+screenshots are nearly identical. Each frame is reduced once to a tiny
+grayscale signature; if it barely differs from the frame the last decision was
+made on, the policy skips inference (or reuses the previous movement) instead
+of paying for both model calls again.
+"""
+
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+def frame_signature(image: Image.Image, size: Tuple[int, int] = (32, 18)) -> np.ndarray:
+    """Downsampled grayscale version of a frame, values in 0..1."""
+    small = image.convert("L").resize(size, Image.Resampling.BOX)
+    return np.asarray(small, dtype=np.float32) / 255
+
+
+def frame_distance(signature_a: np.ndarray, signature_b: np.ndarray) -> float:
+    """Mean absolute difference of two signatures, 0 (identical) .. 1."""
+    return float(np.mean(np.abs(signature_a - signature_b)))
+
+
+class FrameChangeDecision:
+    def __init__(self, action: str, distance: float, wait_before_next: float):
+        """
+        :param action: 'infer', 'skip' (no model calls, no action) or 'reuse' (repeat the last movement)
+        :param distance: difference to the frame of the last decision
+        :param wait_before_next: seconds to wait before the next capture
+        """
+        self.action = action
+        self.distance = distance
+        self.wait_before_next = wait_before_next
+
+
+class FrameChangePolicy:
+    def __init__(self,
+                 threshold: float = 0.02,
+                 on_static: str = "skip",
+                 max_consecutive_skips: int = 3,
+                 static_wait: float = 0.5,
+                 changed_wait: float = 0.0,
+                 signature_size: Tuple[int, int] = (32, 18)):
+        """
+        :param threshold: frames closer than this to the last decided frame count as unchanged.
+        :param on_static: 'skip' the iteration or 'reuse' the previous movement on unchanged frames.
+            The aim & shoot decision is never reused - a stale point would only miss.
+        :param max_consecutive_skips: after this many skipped frames the models are asked again,
+            so a stuck bot still gets a new decision.
+        :param static_wait: wait before the next capture when nothing changed (e.g. waiting to respawn).
+        :param changed_wait: wait before the next capture when the scene changed.
+        """
+        if on_static not in ("skip", "reuse"):
+            raise ValueError("on_static has to be one of ['skip', 'reuse'].")
+
+        self.threshold = threshold
+        self.on_static = on_static
+        self.max_consecutive_skips = max_consecutive_skips
+        self.static_wait = static_wait
+        self.changed_wait = changed_wait
+        self.signature_size = signature_size
+
+        self.frames = 0
+        self.skipped = 0
+        self.reused = 0
+        self.wait_before_next = 0.0
+        self._reference: Optional[np.ndarray] = None
+        self._consecutive_skips = 0
+        self._last_tool_calls = None
+
+    def observe(self, frame) -> FrameChangeDecision:
+        signature = frame.variant(("signature", self.signature_size),
+                                  lambda f: frame_signature(f.image, self.signature_size))
+        distance = 1.0 if self._reference is None else frame_distance(signature, self._reference)
+        static = distance < self.threshold
+        self.frames += 1
+
+        if static and self._consecutive_skips < self.max_consecutive_skips:
+            self._consecutive_skips += 1
+            if self.on_static == "reuse" and self._last_tool_calls:
+                action = "reuse"
+                self.reused += 1
+            else:
+                action = "skip"
+                self.skipped += 1
+        else:
+            action = "infer"
+            self._consecutive_skips = 0
+            self._reference = signature
+
+        self.wait_before_next = self.static_wait if static else self.changed_wait
+        return FrameChangeDecision(action=action, distance=distance, wait_before_next=self.wait_before_next)
+
+    def record_decision(self, coords, tool_calls):
+        """Remembers the movement decided for the last inferred frame, for 'reuse'."""
+        self._last_tool_calls = None if coords else tool_calls
+
+    @property
+    def last_tool_calls(self):
+        return self._last_tool_calls
+
+    def skip_rate(self) -> float:
+        return (self.skipped + self.reused) / self.frames if self.frames else 0.0
+
+    def report(self) -> dict:
+        return {
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "reused": self.reused,
+            "skip_rate": round(self.skip_rate(), 3),
+        }
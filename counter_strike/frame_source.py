@@ -0,0 +1,152 @@
+"""
+Background frame grabbing.
+
+Without a frame source every iteration starts with a screenshot round trip, and the
+models see a frame that is as old as that round trip when the decision starts. A
+FrameGrabber captures frames on its own thread, back to back (or every `interval`
+seconds), into a small ring buffer. The agent loop takes the freshest frame with
+latest() and does not wait for the capture at all.
+
+Every frame carries its captured_at time, so the age of the image behind each
+decision is measured (report(), and the iteration logs of run_agent).
+
+    with FrameGrabber(desktop, backend=SandboxEncodeBackend(quality=80)) as grabber:
+        run_agent(..., frame_source=grabber)
+
+The grabber polls a capture backend (see capture.py). The sandbox's desktop.stream is
+a noVNC page for humans, decoding it would need a VNC client in this process.
+"""
+
+import collections
+import threading
+import time
+from typing import Deque, Dict, List, Optional
+
+from tracing import get_tracer, log
+
+from .capture import ScreenshotBackend
+from .frame import Frame
+
+
+class FrameGrabber:
+    def __init__(self,
+                 desktop,
+                 backend=None,
+                 buffer_size: int = 4,
+                 interval: float = 0.0,
+                 start: bool = True):
+        """
+        :param backend: capture backend, a ScreenshotBackend when not given.
+        :param buffer_size: number of recent frames kept, oldest first.
+        :param interval: minimum seconds between the starts of two captures, 0 grabs back to back.
+        :param start: start grabbing right away, otherwise call start().
+        """
+        if buffer_size < 1:
+            raise ValueError("buffer_size has to be at least 1.")
+
+        self.desktop = desktop
+        self.backend = backend or ScreenshotBackend()
+        self.interval = interval
+        self._frames: Deque[Frame] = collections.deque(maxlen=buffer_size)
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_taken: Optional[Frame] = None
+
+        self.grabbed = 0
+        self.failed = 0
+        self.taken = 0
+        self.reused = 0
+        self.unused = 0  # frames replaced before anyone took them
+        self.age_sum = 0.0
+        self.age_max = 0.0
+        self.started_at: Optional[float] = None
+
+        if start:
+            self.start()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="frame-grabber", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            try:
+                frame = self.backend.capture(self.desktop)
+            except Exception as e:
+                self.failed += 1
+                log(f"  [Grabber] Capture failed: {e!r}")
+                get_tracer().add("capture_failures", 1, source="grabber")
+                self._stop.wait(max(self.interval, 0.5))
+                continue
+
+            with self._condition:
+                if self._frames and self._frames[-1] is not self._last_taken:
+                    self.unused += 1
+                self._frames.append(frame)
+                self.grabbed += 1
+                self._condition.notify_all()
+
+            self._stop.wait(max(0.0, self.interval - (time.perf_counter() - started)))
+
+    def latest(self, newer_than: Optional[Frame] = None, timeout: Optional[float] = 10.0) -> Frame:
+        """
+        The freshest frame. Only waits while there is no frame yet, or, with `newer_than`,
+        until a frame captured after that one arrives.
+        """
+        with self._condition:
+            def ready():
+                if not self._frames:
+                    return False
+                return newer_than is None or self._frames[-1].captured_at > newer_than.captured_at
+
+            if not self._condition.wait_for(ready, timeout=timeout):
+                if not self._frames:
+                    raise TimeoutError(f"No frame was captured within {timeout}s.")
+            frame = self._frames[-1]
+
+            age = time.perf_counter() - frame.captured_at
+            self.taken += 1
+            if frame is self._last_taken:
+                self.reused += 1
+            self._last_taken = frame
+            self.age_sum += age
+            self.age_max = max(self.age_max, age)
+            return frame
+
+    def recent(self) -> List[Frame]:
+        """The buffered frames, oldest first."""
+        with self._condition:
+            return list(self._frames)
+
+    def report(self) -> Dict:
+        with self._condition:
+            running = time.perf_counter() - self.started_at if self.started_at else 0.0
+            return {
+                "grabbed": self.grabbed,
+                "failed": self.failed,
+                "taken": self.taken,
+                "reused": self.reused,
+                "unused": self.unused,
+                "grab_fps": round(self.grabbed / running, 2) if running else 0.0,
+                "avg_age_ms": round(1000 * self.age_sum / self.taken, 1) if self.taken else 0.0,
+                "max_age_ms": round(1000 * self.age_max, 1),
+                "backend": self.backend.report(),
+            }
+
+    def close(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
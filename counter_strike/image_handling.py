@@ -42,7 +42,7 @@ def get_screenshot(desktop, filename="screenshot.jpg", quality: int = None) -> s
 
     return base64.b64encode(raw_bytes).decode("utf-8")
 
-def get_screenshot_message_from_base64(base64_image):
+def get_screenshot_message_from_base64(base64_image, mime_type: str = "image/jpeg"):
     return [
         {
             "role": "user",
@@ -50,7 +50,7 @@ def get_screenshot_message_from_base64(base64_image):
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/jpeg;base64,{base64_image}",
+                        "url": f"data:{mime_type};base64,{base64_image}",
                     },
                 },
             ], }
@@ -61,19 +61,19 @@ def get_screenshot_message(desktop: Sandbox, filename: str | None = None, qualit
     screenshot_message = get_screenshot_message_from_base64(base64_image)
     return screenshot_message, base64_image
 
-def draw_point(point, image_path, output_path,
-               marker_radius=5, marker_color='red'):
+def draw_point_on_image(img: Image.Image, point, marker_radius=5, marker_color='red') -> Image.Image:
     """
-    Draw a circle at the given point and save the image.
+    Draw a circle at the given point on an in-memory image (in place).
 
     Args:
+        img (PIL.Image.Image): Image to annotate.
         point (dict): {'x': int, 'y': int}
-        image_path (str): Path to the input image.
-        output_path (str): Where to save the annotated image.
         marker_radius (int): Radius of the point marker.
         marker_color (str): Color for the marker and label background.
+
+    Returns:
+        PIL.Image.Image: The annotated image.
     """
-    img = Image.open(image_path)
     draw = ImageDraw.Draw(img)
     font = ImageFont.load_default()
 
@@ -101,6 +101,23 @@ def draw_point(point, image_path, output_path,
     )
     draw.text((text_x, text_y), label, fill='white', font=font)
 
+    return img
+
+
+def draw_point(point, image_path, output_path,
+               marker_radius=5, marker_color='red'):
+    """
+    Draw a circle at the given point and save the image.
+
+    Args:
+        point (dict): {'x': int, 'y': int}
+        image_path (str): Path to the input image.
+        output_path (str): Where to save the annotated image.
+        marker_radius (int): Radius of the point marker.
+        marker_color (str): Color for the marker and label background.
+    """
+    img = Image.open(image_path)
+    draw_point_on_image(img, point, marker_radius=marker_radius, marker_color=marker_color)
     img.save(output_path)
 
 
@@ -203,8 +220,51 @@ def calculate_mouse_movements(screenshot_coords, x_mid, y_mid, aim_multiplier, s
     return movements
 
 
-def get_mouse_movements(coords: Dict[str, float]):
-    """Get list of mouse movements towards a target derived from input coordinates."""
+_aim_calibration = None
+
+
+def set_aim_calibration(calibration):
+    """Makes get_mouse_movements() use a calibration.AimCalibration. None restores the fixed multiplier."""
+    global _aim_calibration
+    _aim_calibration = calibration
+
+
+def get_aim_calibration():
+    return _aim_calibration
+
+
+def calibrated_mouse_movements(coords: Dict[str, float], calibration, max_moves: int = 4) -> List[Dict[str, int]]:
+    """
+    Mouse movements for a target with a fitted AimCalibration. The game re-centres the mouse
+    after every move, so an offset beyond the screen edge is split into several moves, each
+    one starting from the crosshair.
+    """
+    x_mid, y_mid = calibration.screen_center
+    screen_width, screen_height = calibration.screen_size
+    remaining_x = calibration.mouse_offset(coords["x"] - x_mid, "x")
+    remaining_y = calibration.mouse_offset(coords["y"] - y_mid, "y")
+
+    movements = []
+    while (abs(remaining_x) >= 1 or abs(remaining_y) >= 1) and len(movements) < max_moves:
+        step_x = max(-x_mid, min(remaining_x, screen_width - x_mid))
+        step_y = max(-y_mid, min(remaining_y, screen_height - y_mid))
+        movements.append({"x": int(round(x_mid + step_x)), "y": int(round(y_mid + step_y))})
+        remaining_x -= step_x
+        remaining_y -= step_y
+    return movements or [{"x": int(x_mid), "y": int(y_mid)}]
+
+
+def get_mouse_movements(coords: Dict[str, float], calibration=None):
+    """
+    Get list of mouse movements towards a target derived from input coordinates.
+
+    calibration: an AimCalibration, by default the one set with set_aim_calibration().
+    Without any, the fixed aim multiplier below is used.
+    """
+    calibration = calibration or _aim_calibration
+    if calibration is not None:
+        return calibrated_mouse_movements(coords, calibration)
+
     scr_x = coords["x"]
     scr_y = coords["y"]
     screenshot_coords = (scr_x, scr_y)
@@ -232,17 +292,131 @@ def get_mouse_movements(coords: Dict[str, float]):
 
 RESAMPLE_METHOD = Image.Resampling.LANCZOS
 
-def compress_and_scale_base64_image(base64_string, target_size_percentage=50, scale_percentage=50):
-    if not base64_string: return None
-    # Ensure percentages are within a valid range for the operation's intent
-    if not (1 <= target_size_percentage <= 100): return None
-    if not (1 <= scale_percentage <= 100): return None
+def to_rgb(img: Image.Image) -> Image.Image:
+    """Converts to RGB, flattening transparency onto a white background."""
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        converted_img = img.convert('RGBA')
+        if converted_img.mode == 'RGBA':
+             mask = converted_img.split()[-1]
+             background.paste(converted_img, (0, 0), mask=mask)
+             return background
+        return img.convert('RGB')
+    elif img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
 
-    img_data = base64.b64decode(base64_string)
-    original_size_bytes = len(img_data)
-    target_size_bytes = original_size_bytes * target_size_percentage / 100
 
-    img = Image.open(io.BytesIO(img_data))
+def encode_jpeg(img: Image.Image, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+class JpegQualityController:
+    """
+    Picks the JPEG quality of consecutive thumbnails.
+
+    Consecutive frames compress to almost the same size, so instead of searching the
+    quality from scratch every time, the controller starts from the quality that met
+    the size target for the previous frame and steps up or down from there. A full
+    binary search only runs when one step is not enough, i.e. the size drifted.
+    """
+    def __init__(self,
+                 initial_quality: int = 85,
+                 min_quality: int = 1,
+                 max_quality: int = 95,
+                 step: int = 5,
+                 tolerance: float = 0.15,
+                 probe_interval: int = 10):
+        """
+        :param step: quality change tried when the last quality misses the target
+        :param tolerance: results smaller than (1 - tolerance) * target try one step higher quality
+        :param probe_interval: after a failed step up, wait this many frames before trying again
+        """
+        if not 1 <= min_quality <= initial_quality <= max_quality <= 100:
+            raise ValueError("Expected 1 <= min_quality <= initial_quality <= max_quality <= 100.")
+
+        self.quality = initial_quality
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.step = step
+        self.tolerance = tolerance
+        self.probe_interval = probe_interval
+
+        self._frames_until_probe = 0
+        self.frames = 0
+        self.encodes = 0
+        self.searches = 0
+
+    def _encode(self, img: Image.Image, quality: int) -> bytes:
+        self.encodes += 1
+        return encode_jpeg(img, quality=quality)
+
+    def _search(self, img: Image.Image, target_size_bytes: float, quality_min: int, quality_max: int) -> bytes:
+        self.searches += 1
+        best_quality, best_data = None, None
+        while quality_min <= quality_max:
+            current_quality = (quality_min + quality_max) // 2
+            current_data = self._encode(img, current_quality)
+            if len(current_data) <= target_size_bytes:
+                best_quality, best_data = current_quality, current_data
+                quality_min = current_quality + 1
+            else:
+                quality_max = current_quality - 1
+
+        if best_data is None:
+            best_quality = self.min_quality
+            best_data = self._encode(img, best_quality)
+        self.quality = best_quality
+        return best_data
+
+    def encode(self, img: Image.Image, target_size_bytes: float) -> bytes:
+        """JPEG bytes of img with (about) the highest quality that fits into target_size_bytes."""
+        self.frames += 1
+        quality = self.quality
+        data = self._encode(img, quality)
+
+        if len(data) <= target_size_bytes:
+            self._frames_until_probe -= 1
+            if quality < self.max_quality and len(data) < target_size_bytes * (1 - self.tolerance) \
+                    and self._frames_until_probe <= 0:
+                higher = min(self.max_quality, quality + self.step)
+                higher_data = self._encode(img, higher)
+                if len(higher_data) > target_size_bytes:
+                    self._frames_until_probe = self.probe_interval
+                    return data
+                quality, data = higher, higher_data
+            self.quality = quality
+            return data
+
+        if quality == self.min_quality:
+            return data
+
+        lower = max(self.min_quality, quality - self.step)
+        lower_data = self._encode(img, lower)
+        if len(lower_data) <= target_size_bytes or lower == self.min_quality:
+            self.quality = lower
+            return lower_data
+        return self._search(img, target_size_bytes, self.min_quality, lower - 1)
+
+    def report(self) -> dict:
+        return {
+            "frames": self.frames,
+            "encodes": self.encodes,
+            "encodes_per_frame": round(self.encodes / self.frames, 2) if self.frames else 0.0,
+            "searches": self.searches,
+            "quality": self.quality,
+        }
+
+
+def compress_and_scale_image(img: Image.Image, target_size_bytes: float, scale_percentage=50,
+                             quality_controller: JpegQualityController = None) -> bytes:
+    """
+    Scales a decoded image and encodes it as JPEG with the highest quality that fits
+    into target_size_bytes (or the lowest quality if none does).
+    With a quality_controller the quality is tracked across calls instead of searched each time.
+    """
     original_width, original_height = img.size
 
     if scale_percentage < 100:
@@ -251,34 +425,18 @@ def compress_and_scale_base64_image(base64_string, target_size_percentage=50, sc
         if (new_width, new_height) != (original_width, original_height):
              img = img.resize((new_width, new_height), RESAMPLE_METHOD)
 
-    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
-        background = Image.new('RGB', img.size, (255, 255, 255))
-        converted_img = img.convert('RGBA')
-        if converted_img.mode == 'RGBA':
-             mask = converted_img.split()[-1]
-             background.paste(converted_img, (0, 0), mask=mask)
-             img = background
-        else:
-             img = img.convert('RGB')
-    elif img.mode != 'RGB':
-        img = img.convert('RGB')
+    img = to_rgb(img)
 
-    buffer_q95 = io.BytesIO()
-    img.save(buffer_q95, format="JPEG", quality=95, optimize=True)
-    data_q95 = buffer_q95.getvalue()
+    if quality_controller is not None:
+        return quality_controller.encode(img, target_size_bytes)
 
-    if target_size_percentage == 100:
-         return base64.b64encode(data_q95).decode('utf-8')
+    data_q95 = encode_jpeg(img, quality=95)
 
     if len(data_q95) <= target_size_bytes:
-        return base64.b64encode(data_q95).decode('utf-8')
+        return data_q95
 
     best_data_under_target = None
-    lowest_quality_data = None
-
-    buffer_q1 = io.BytesIO()
-    img.save(buffer_q1, format="JPEG", quality=1, optimize=True)
-    lowest_quality_data = buffer_q1.getvalue()
+    lowest_quality_data = encode_jpeg(img, quality=1)
 
     quality_min, quality_max = 1, 95
     for _ in range(8):
@@ -287,9 +445,7 @@ def compress_and_scale_base64_image(base64_string, target_size_percentage=50, sc
         current_quality = (quality_min + quality_max) // 2
         if current_quality < 1: current_quality = 1
 
-        buffer = io.BytesIO()
-        img.save(buffer, format="JPEG", quality=current_quality, optimize=True)
-        current_data = buffer.getvalue()
+        current_data = encode_jpeg(img, quality=current_quality)
         current_size = len(current_data)
 
         if current_size <= target_size_bytes:
@@ -299,9 +455,45 @@ def compress_and_scale_base64_image(base64_string, target_size_percentage=50, sc
             quality_max = current_quality - 1
 
     if best_data_under_target is not None:
-        final_data = best_data_under_target
-    else:
-        final_data = lowest_quality_data
+        return best_data_under_target
+    return lowest_quality_data
+
+
+def compress_and_scale_base64_image(base64_string, target_size_percentage=50, scale_percentage=50):
+    if not base64_string: return None
+    # Ensure percentages are within a valid range for the operation's intent
+    if not (1 <= target_size_percentage <= 100): return None
+    if not (1 <= scale_percentage <= 100): return None
+
+    img_data = base64.b64decode(base64_string)
+    target_size_bytes = len(img_data) * target_size_percentage / 100
+    if target_size_percentage == 100:
+        target_size_bytes = float("inf")
+
+    img = Image.open(io.BytesIO(img_data))
+    final_data = compress_and_scale_image(img, target_size_bytes, scale_percentage=scale_percentage)
+    return base64.b64encode(final_data).decode('utf-8')
+
+
+def tile_images(images: List[Image.Image], labels: List[str], tile_size: Tuple[int, int], columns: int,
+                label_color='yellow') -> Image.Image:
+    """
+    Tiles images row by row into one mosaic, each resized to tile_size and labelled in its top left corner.
+    """
+    rows = -(-len(images) // columns)
+    tile_w, tile_h = tile_size
+    mosaic = Image.new('RGB', (columns * tile_w, rows * tile_h), (0, 0, 0))
+    draw = ImageDraw.Draw(mosaic)
+    font = ImageFont.load_default()
+
+    for i, (img, label) in enumerate(zip(images, labels)):
+        x, y = (i % columns) * tile_w, (i // columns) * tile_h
+        if img.size != tile_size:
+            img = img.resize(tile_size, RESAMPLE_METHOD)
+        mosaic.paste(img, (x, y))
+
+        bbox = draw.textbbox((0, 0), label, font=font)
+        draw.rectangle([x, y, x + bbox[2] - bbox[0] + 4, y + bbox[3] - bbox[1] + 4], fill='black')
+        draw.text((x + 2, y + 2), label, fill=label_color, font=font)
 
-    final_base64 = base64.b64encode(final_data).decode('utf-8')
-    return final_base64
\ No newline at end of file
+    return mosaic
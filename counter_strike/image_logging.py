@@ -1,36 +1,202 @@
 from datetime import datetime
+import json
 import os 
+import queue
+import threading
+from typing import NamedTuple, Optional
+
+from .image_handling import save_image
+from .session_recording import SessionRecorder
+
+
+_STOP = object()
+
+
+class BackgroundWriter:
+    """
+    Runs disk writes on a worker thread, so the agent loop never waits on the disk.
+
+    Writes are queued in order. When the queue is full - the disk is slower than
+    the agent - new writes are dropped ('drop') or the caller waits ('block').
+    """
+    POLICIES = ("drop", "block")
+
+    def __init__(self, max_pending: int = 32, on_full: str = "drop"):
+        if on_full not in self.POLICIES:
+            raise ValueError(f"on_full has to be one of {list(self.POLICIES)}.")
+
+        self.on_full = on_full
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="image-log-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args) -> bool:
+        """Queues fn(*args). Returns False if the write was dropped."""
+        if self._closed:
+            raise RuntimeError("The writer is already closed.")
+        try:
+            if self.on_full == "block":
+                self._queue.put((fn, args))
+            else:
+                self._queue.put_nowait((fn, args))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is _STOP:
+                    return
+                fn, args = task
+                try:
+                    fn(*args)
+                    with self._lock:
+                        self.written += 1
+                except Exception as e:
+                    with self._lock:
+                        self.failed += 1
+                    print(f"  [ImageLog] Write failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Blocks until every queued write is done."""
+        self._queue.join()
+
+    def close(self):
+        """Flushes the queue and stops the worker thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def report(self) -> dict:
+        with self._lock:
+            return {"written": self.written, "dropped": self.dropped, "failed": self.failed,
+                    "pending": self._queue.qsize()}
+
+
+def _save_annotated(frame, point, path):
+    frame.annotated(point).save(path)
+
+
+def _append_json_line(data: dict, path: str):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(data, default=str) + "\n")
+
+
+class IterationPaths(NamedTuple):
+    """Where the images of one iteration are logged. Travels with the frame through the loop."""
+    iteration: int
+    screenshot: str
+    annotated: str
+
 
 class ImageLoggingSettings:
-    def __init__(self, base_path="../images"):
+    def __init__(self,
+                 base_path="../images",
+                 writer: Optional[BackgroundWriter] = None,
+                 background: bool = True,
+                 recording: bool = True,
+                 max_segment_bytes: int = 512 * 1024 * 1024):
         """
         Initializes settings for image logging.
         Creates a unique directory for this session based on the current date and time.
+
+        :param writer: BackgroundWriter used for the disk writes
+        :param background: without a writer, create one (True) or write synchronously (False)
+        :param recording: append frames, annotations and per-iteration data to a session recording
+            (see session_recording.py) instead of writing loose image files
         """
         self.session_timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S")
         self.session_log_dir = os.path.join(base_path, self.session_timestamp_str)
-        os.makedirs(self.session_log_dir, exist_ok=True)
-        
-        self._current_screenshot_path = None
-        self._current_annotated_screenshot_path = None
+        suffix = 0
+        while True:
+            try:
+                os.makedirs(self.session_log_dir)
+                break
+            except FileExistsError:
+                # another session started in the same second
+                suffix += 1
+                self.session_log_dir = os.path.join(base_path, f"{self.session_timestamp_str}_{suffix}")
+
+        self.iteration = -1
+        self._current_paths: Optional[IterationPaths] = None
+
+        self.writer = writer if writer is not None or not background else BackgroundWriter()
+        self.recorder = SessionRecorder(self.session_log_dir, max_segment_bytes=max_segment_bytes) \
+            if recording else None
         
         print(f"ImageLoggingSettings: Session directory created at {self.session_log_dir}")
 
+    def _write(self, fn, *args):
+        if self.writer is None:
+            fn(*args)
+        else:
+            self.writer.submit(fn, *args)
 
-    def generate_new_paths_for_iteration(self) -> str:
-        iteration_file_timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S") 
-        
-        screenshot_filename = f"screenshot_{iteration_file_timestamp_str}.jpg"
-        self._current_screenshot_path = os.path.join(self.session_log_dir, screenshot_filename)
+    def save_screenshot(self, frame, paths: IterationPaths):
+        """Logs the encoded bytes of a Frame, in the background if there is a writer."""
+        if self.recorder is not None:
+            self._write(self.recorder.record_frame, paths.iteration, frame)
+        else:
+            self._write(save_image, frame.data, paths.screenshot)
+
+    def save_annotated(self, frame, point, paths: IterationPaths):
+        """Draws the aiming point on a copy of the in-memory frame and logs it."""
+        if self.recorder is not None:
+            self._write(lambda: self.recorder.record_annotated(paths.iteration, frame.annotated(point)))
+        else:
+            self._write(_save_annotated, frame, point, paths.annotated)
+
+    def log_iteration(self, paths: IterationPaths, data: dict):
+        """Logs what happened in an iteration (action, coordinates, timings, raw model answers)."""
+        data = dict(data, iteration=paths.iteration)
+        if self.recorder is not None:
+            self._write(self.recorder.record_iteration, paths.iteration, data)
+        else:
+            self._write(_append_json_line, data, os.path.join(self.session_log_dir, "iterations.jsonl"))
+
+    def close(self):
+        """Waits for the pending writes and closes the recording."""
+        if self.writer is not None:
+            self.writer.close()
+            print(f"Image logging stats: {self.writer.report()}")
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def generate_new_paths_for_iteration(self, extension: str = "jpg") -> str:
+        """:param extension: of the screenshot file, matching the format of the captured bytes."""
+        self.iteration += 1
+        # the iteration number keeps names unique, the timestamp (in ms) keeps them readable
+        iteration_file_timestamp_str = f"{self.iteration:05d}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')[:-3]}"
         
+        screenshot_filename = f"screenshot_{iteration_file_timestamp_str}.{extension}"
         # Ensure annotated version uses the same unique timestamp as the screenshot
         annotated_filename = f"screenshot_annotated_{iteration_file_timestamp_str}.jpg"
-        self._current_annotated_screenshot_path = os.path.join(self.session_log_dir, annotated_filename)
-        
-        return self._current_screenshot_path
+
+        self._current_paths = IterationPaths(iteration=self.iteration,
+                                             screenshot=os.path.join(self.session_log_dir, screenshot_filename),
+                                             annotated=os.path.join(self.session_log_dir, annotated_filename))
+        return self._current_paths.screenshot
 
     def get_screenshot_path(self) -> str:
-        return self._current_screenshot_path
+        return self._current_paths.screenshot if self._current_paths else None
 
     def get_annotated_screenshot_path(self) -> str:
-        return self._current_annotated_screenshot_path
\ No newline at end of file
+        return self._current_paths.annotated if self._current_paths else None
+
+    def get_current_paths(self) -> IterationPaths:
+        """The IterationPaths of the current iteration."""
+        return self._current_paths
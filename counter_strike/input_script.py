@@ -0,0 +1,80 @@
+"""
+Batched input for the sandbox.
+
+Every Sandbox input method (move_mouse, left_click, write, wait) is a round trip to
+E2B. An InputScript records a whole action - the aiming moves and the burst, or a
+movement sequence with its turns - and compiles it into a single shell command,
+run with one commands.run(). The waits become xdotool sleeps, so the timing is
+kept on the sandbox side and the action costs one round trip.
+
+    InputScript().aim(mouse_movements).burst(clicks=3).run(desktop)
+"""
+
+import shlex
+from typing import Dict, List, Optional, Tuple
+
+from e2b_desktop import Sandbox
+
+
+class InputScript:
+    def __init__(self):
+        # every step is a list of xdotool arguments
+        self.steps: List[List[str]] = []
+
+    def move_mouse(self, x: int, y: int) -> "InputScript":
+        self.steps.append(["mousemove", "--sync", str(int(x)), str(int(y))])
+        return self
+
+    def click(self, button: int = 1) -> "InputScript":
+        self.steps.append(["click", str(button)])
+        return self
+
+    def wait(self, ms: float) -> "InputScript":
+        if ms > 0:
+            self.steps.append(["sleep", f"{ms / 1000:g}"])
+        return self
+
+    def write(self, text: str, chunk_size: int = 25, delay_in_ms: int = 75) -> "InputScript":
+        """Types text like Sandbox.write(), in chunks of chunk_size characters."""
+        for i in range(0, len(text), chunk_size):
+            self.steps.append(["type", "--delay", str(delay_in_ms), "--", text[i:i + chunk_size]])
+        return self
+
+    def aim(self, mouse_movements: List[Dict[str, int]]) -> "InputScript":
+        for move_coords in mouse_movements:
+            self.move_mouse(move_coords["x"], move_coords["y"])
+        return self
+
+    def burst(self, clicks: int = 3, interval_ms: int = 150) -> "InputScript":
+        """The clicks of controls.shoot(): `clicks` rounds of three clicks, `interval_ms` apart within a round."""
+        for _ in range(clicks):
+            self.click().wait(interval_ms).click().wait(interval_ms).click()
+        return self
+
+    def mouse_moves(self) -> List[Tuple[int, int]]:
+        """The absolute mouse positions the script moves to, in order."""
+        return [(int(step[2]), int(step[3])) for step in self.steps if step[0] == "mousemove"]
+
+    def compile(self) -> str:
+        """
+        One shell command for the whole script. Consecutive steps are chained into a single
+        xdotool call; 'type' takes all remaining arguments as text, so it ends a chain.
+        """
+        chains, chain = [], []
+        for step in self.steps:
+            chain.extend(step)
+            if step[0] == "type":
+                chains.append(chain)
+                chain = []
+        if chain:
+            chains.append(chain)
+        return " && ".join("xdotool " + " ".join(shlex.quote(arg) for arg in chain) for chain in chains)
+
+    def run(self, desktop: "Sandbox", timeout: Optional[float] = None):
+        if not self.steps:
+            return None
+        kwargs = {} if timeout is None else {"timeout": timeout}
+        return desktop.commands.run(self.compile(), envs={"DISPLAY": getattr(desktop, "_display", ":0")}, **kwargs)
+
+    def __len__(self):
+        return len(self.steps)
@@ -1,6 +1,13 @@
 from e2b_desktop import Sandbox, CommandExitException
 
 
+def install_ffmpeg(desktop: Sandbox):
+    # needed by capture.SandboxEncodeBackend
+    # a fresh sandbox has no package lists; apt-get is apt's interface for scripts
+    desktop.commands.run("sudo apt-get update && sudo DEBIAN_FRONTEND=noninteractive apt-get install -y ffmpeg",
+                         timeout=0)
+
+
 def install_cs_1_6(desktop: Sandbox):
     desktop.open("https://www.cybersports.lt/setup/") # open the link in the default browser
     desktop.commands.run("sudo dpkg --add-architecture i386")
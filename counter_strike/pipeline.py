@@ -0,0 +1,187 @@
+"""
+Small staged pipeline used by the pipelined agent loop.
+
+Every stage runs in its own thread and hands its items to the next stage
+through a bounded queue, so a new screenshot can be captured while the models
+are still working on the previous one.
+"""
+
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+
+_STOP = object()
+
+
+class PipelineItem:
+    """One frame travelling through the pipeline together with everything the stages attach to it."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.captured_at = time.perf_counter()
+        self.data: Dict = {}
+        self.timings: Dict[str, float] = {}
+
+    def age_ms(self) -> float:
+        return (time.perf_counter() - self.captured_at) * 1000
+
+
+class Stage:
+    def __init__(self, name: str, fn: Callable[[PipelineItem], bool], drop_if_stale: bool = False,
+                 releases_slot: bool = False):
+        """
+        :param name: used for timings and drop counters
+        :param fn: processes an item; returning False drops the item
+        :param drop_if_stale: drop items older than the pipeline's staleness limit before running fn
+        :param releases_slot: the item no longer counts towards the pipeline depth once this stage is done
+        """
+        self.name = name
+        self.fn = fn
+        self.drop_if_stale = drop_if_stale
+        self.releases_slot = releases_slot
+
+
+class StagedPipeline:
+    """
+    Runs a source stage followed by a chain of stages, each in its own thread.
+
+    `depth` bounds the number of frames that have been captured but not yet
+    released (see Stage.releases_slot), so the source never races ahead of the
+    slowest stage. Frames older than `max_frame_age_ms` are dropped by stages
+    which opt into it instead of being acted on.
+    """
+
+    def __init__(self,
+                 source: Stage,
+                 stages: List[Stage],
+                 depth: int = 2,
+                 max_frame_age_ms: Optional[float] = None):
+        if depth < 1:
+            raise ValueError("Pipeline depth has to be at least 1.")
+
+        self.source = source
+        self.stages = stages
+        self.depth = depth
+        self.max_frame_age_ms = max_frame_age_ms
+
+        # items a stage chose to drop (fn returned False or raised) and items dropped as too old
+        self.dropped: Dict[str, int] = {stage.name: 0 for stage in [source] + stages}
+        self.stale: Dict[str, int] = {stage.name: 0 for stage in [source] + stages}
+        self.completed = 0
+
+        self._slots = threading.Semaphore(depth)
+        self._queues = [queue.Queue(maxsize=depth) for _ in stages]
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._error: Optional[BaseException] = None
+
+    def _is_stale(self, item: PipelineItem) -> bool:
+        return self.max_frame_age_ms is not None and item.age_ms() > self.max_frame_age_ms
+
+    def _fail(self, error: BaseException):
+        with self._lock:
+            if self._error is None:
+                self._error = error
+        self._stop_event.set()
+
+    def _drop(self, stage: Stage, item: PipelineItem, slot_held: bool, stale: bool = False):
+        with self._lock:
+            if stale:
+                self.stale[stage.name] += 1
+            else:
+                self.dropped[stage.name] += 1
+        if slot_held:
+            self._slots.release()
+
+    def _run_source(self, iterations: int):
+        output = self._queues[0] if self._queues else None
+        for i in range(iterations):
+            self._slots.acquire()
+            if self._stop_event.is_set():
+                self._slots.release()
+                break
+
+            item = PipelineItem(index=i)
+            start = time.perf_counter()
+            try:
+                keep = self.source.fn(item)
+            except BaseException as e:
+                self._fail(e)
+                self._slots.release()
+                break
+            item.timings[self.source.name] = time.perf_counter() - start
+
+            if keep is False:
+                self._drop(self.source, item, slot_held=True)
+                continue
+            if output is None:
+                self._slots.release()
+                continue
+            output.put(item)
+
+        if output is not None:
+            output.put(_STOP)
+
+    def _run_stage(self, index: int):
+        stage = self.stages[index]
+        input_queue = self._queues[index]
+        output = self._queues[index + 1] if index + 1 < len(self._queues) else None
+        # Slots are released by the first stage flagged as releasing; without one, by the last stage.
+        release_index = next((i for i, s in enumerate(self.stages) if s.releases_slot), len(self.stages) - 1)
+
+        while True:
+            item = input_queue.get()
+            if item is _STOP:
+                if output is not None:
+                    output.put(_STOP)
+                break
+
+            slot_held = index <= release_index
+            if self._stop_event.is_set():
+                self._drop(stage, item, slot_held=slot_held)
+                continue
+            if stage.drop_if_stale and self._is_stale(item):
+                self._drop(stage, item, slot_held=slot_held, stale=True)
+                continue
+
+            start = time.perf_counter()
+            try:
+                keep = stage.fn(item)
+            except BaseException as e:
+                self._fail(e)
+                self._drop(stage, item, slot_held=slot_held)
+                continue
+            item.timings[stage.name] = time.perf_counter() - start
+
+            if keep is False:
+                self._drop(stage, item, slot_held=slot_held)
+                continue
+            if index == release_index:
+                self._slots.release()
+
+            if output is not None:
+                output.put(item)
+            else:
+                with self._lock:
+                    self.completed += 1
+
+    def run(self, iterations: int):
+        """
+        Pushes `iterations` frames through the pipeline and blocks until every stage is drained.
+        Re-raises the first exception raised by any stage.
+        """
+        threads = [threading.Thread(target=self._run_source, args=(iterations,),
+                                    name=f"pipeline-{self.source.name}", daemon=True)]
+        for i, stage in enumerate(self.stages):
+            threads.append(threading.Thread(target=self._run_stage, args=(i,),
+                                            name=f"pipeline-{stage.name}", daemon=True))
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,254 @@
+"""
+Long-lived executor for model calls.
+
+The agent owns one InferenceScheduler for its whole run instead of creating a
+thread pool per iteration. Jobs carry a CancellationToken, so a call whose
+result is no longer needed can be aborted instead of waited for.
+"""
+
+import collections
+import concurrent.futures
+import threading
+import time
+from typing import Callable, Deque, Dict, List, Optional, Set
+
+from llms.cancellation import CancellationToken
+
+
+class InferenceJob:
+    def __init__(self, future: concurrent.futures.Future, token: CancellationToken):
+        self.future = future
+        self.token = token
+        self.submitted_at = time.perf_counter()
+
+    def result(self, timeout: float | None = None):
+        return self.future.result(timeout=timeout)
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def cancel(self):
+        """Aborts the job: drops it if it has not started yet, otherwise stops the in-flight request."""
+        self.future.cancel()
+        self.token.cancel()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.token.cancelled
+
+
+class InferenceScheduler:
+    def __init__(self, max_workers: int = 4, name: str = "inference"):
+        """
+        :param max_workers: a cancelled call can linger until its next streamed chunk arrives,
+            so keep a few more workers than the number of concurrent calls per iteration.
+        """
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                               thread_name_prefix=name)
+        self._jobs: Set[InferenceJob] = set()
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> InferenceJob:
+        """
+        Runs `fn(*args, cancel_token=<token>, **kwargs)` on the pool.
+        """
+        token = CancellationToken()
+        future = self._executor.submit(fn, *args, cancel_token=token, **kwargs)
+        job = InferenceJob(future=future, token=token)
+
+        with self._lock:
+            self._jobs.add(job)
+        future.add_done_callback(lambda _: self._forget(job))
+        return job
+
+    def _forget(self, job: InferenceJob):
+        with self._lock:
+            self._jobs.discard(job)
+
+    def cancel_all(self):
+        with self._lock:
+            jobs = list(self._jobs)
+        for job in jobs:
+            job.cancel()
+
+    def shutdown(self):
+        """Cancels everything still running and releases the pool without waiting for it."""
+        self.cancel_all()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+
+
+class FairInferenceScheduler:
+    """
+    Shares a bounded number of concurrent model calls between several agents.
+
+    Every agent submits through its own SchedulerClient (see client()). Jobs wait in a
+    queue per agent; whenever a slot frees up, the next job is taken round-robin over
+    the agents, so an agent with many or slow calls cannot starve the others.
+    """
+    def __init__(self, max_concurrency: int = 8, max_in_flight_per_client: Optional[int] = None,
+                 max_workers: Optional[int] = None, name: str = "fleet-inference"):
+        """
+        :param max_concurrency: model calls running at the same time, over all agents
+        :param max_in_flight_per_client: optional cap of running calls per agent
+        :param max_workers: threads of the pool. Cancelled calls linger until their next chunk,
+            so it defaults to twice max_concurrency.
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency has to be at least 1.")
+
+        self.max_concurrency = max_concurrency
+        self.max_in_flight_per_client = max_in_flight_per_client
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or 2 * max_concurrency,
+                                                               thread_name_prefix=name)
+        self._queues: Dict[str, Deque] = {}
+        self._clients: List[str] = []
+        self._cursor = 0
+        self._running = 0
+        self._in_flight: Dict[str, int] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def client(self, name: str) -> "SchedulerClient":
+        """The handle one agent submits its calls through. Can be passed to run_agent() as scheduler."""
+        with self._lock:
+            if name not in self._queues:
+                self._queues[name] = collections.deque()
+                self._clients.append(name)
+                self._in_flight[name] = 0
+                self._stats[name] = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0,
+                                     "queue_wait": 0.0, "max_queue_wait": 0.0}
+        return SchedulerClient(self, name)
+
+    def submit(self, client: str, fn: Callable, *args, **kwargs) -> InferenceJob:
+        """Queues `fn(*args, cancel_token=<token>, **kwargs)` for `client`."""
+        token = CancellationToken()
+        job = InferenceJob(future=concurrent.futures.Future(), token=token)
+        with self._lock:
+            self._queues[client].append((job, fn, args, kwargs))
+            self._stats[client]["submitted"] += 1
+        self._dispatch()
+        return job
+
+    def _next_job(self):
+        for step in range(len(self._clients)):
+            client = self._clients[(self._cursor + step) % len(self._clients)]
+            if not self._queues[client]:
+                continue
+            if self.max_in_flight_per_client is not None \
+                    and self._in_flight[client] >= self.max_in_flight_per_client:
+                continue
+            self._cursor = (self._cursor + step + 1) % len(self._clients)
+            return client, self._queues[client].popleft()
+        return None
+
+    def _dispatch(self):
+        with self._lock:
+            while self._running < self.max_concurrency:
+                picked = self._next_job()
+                if picked is None:
+                    break
+                client, (job, fn, args, kwargs) = picked
+                if not job.future.set_running_or_notify_cancel():
+                    self._stats[client]["cancelled"] += 1  # cancelled while queued
+                    continue
+
+                wait = time.perf_counter() - job.submitted_at
+                self._stats[client]["queue_wait"] += wait
+                self._stats[client]["max_queue_wait"] = max(self._stats[client]["max_queue_wait"], wait)
+                self._running += 1
+                self._in_flight[client] += 1
+                self._executor.submit(self._run, client, job, fn, args, kwargs)
+
+    def _run(self, client: str, job: InferenceJob, fn: Callable, args, kwargs):
+        outcome = "completed"
+        try:
+            job.future.set_result(fn(*args, cancel_token=job.token, **kwargs))
+        except BaseException as e:
+            outcome = "cancelled" if job.token.cancelled else "failed"
+            job.future.set_exception(e)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._in_flight[client] -= 1
+                self._stats[client][outcome] += 1
+            self._dispatch()
+
+    def cancel_all(self, client: Optional[str] = None):
+        """Cancels the queued jobs of one client, or of all clients. Running jobs keep running."""
+        with self._lock:
+            clients = [client] if client is not None else list(self._clients)
+            jobs = [job for name in clients for job, _, _, _ in self._queues[name]]
+        for job in jobs:
+            job.cancel()
+        self._dispatch()  # lets the dispatcher drop them
+
+    def report(self) -> Dict[str, Dict]:
+        with self._lock:
+            report = {}
+            for client, stats in self._stats.items():
+                started = stats["completed"] + stats["failed"] + stats["cancelled"] + self._in_flight[client]
+                report[client] = {
+                    "submitted": int(stats["submitted"]),
+                    "completed": int(stats["completed"]),
+                    "failed": int(stats["failed"]),
+                    "cancelled": int(stats["cancelled"]),
+                    "avg_queue_wait_ms": round(1000 * stats["queue_wait"] / started, 1) if started else 0.0,
+                    "max_queue_wait_ms": round(1000 * stats["max_queue_wait"], 1),
+                }
+            return report
+
+    def shutdown(self):
+        """Cancels the queued jobs and releases the pool without waiting for running calls."""
+        self.cancel_all()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+
+
+class SchedulerClient:
+    """One agent's view of a FairInferenceScheduler, with the interface of InferenceScheduler."""
+    def __init__(self, scheduler: FairInferenceScheduler, name: str):
+        self.scheduler = scheduler
+        self.name = name
+        self._jobs: Set[InferenceJob] = set()
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> InferenceJob:
+        job = self.scheduler.submit(self.name, fn, *args, **kwargs)
+        with self._lock:
+            self._jobs.add(job)
+        job.future.add_done_callback(lambda _: self._forget(job))
+        return job
+
+    def _forget(self, job: InferenceJob):
+        with self._lock:
+            self._jobs.discard(job)
+
+    def cancel_all(self):
+        with self._lock:
+            jobs = list(self._jobs)
+        for job in jobs:
+            job.cancel()
+
+    def shutdown(self):
+        """Cancels this agent's calls. The shared pool belongs to the FairInferenceScheduler."""
+        self.cancel_all()
+
+    def report(self) -> Dict:
+        return self.scheduler.report().get(self.name, {})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
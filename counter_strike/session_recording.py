@@ -0,0 +1,237 @@
+"""
+Append-only session recordings.
+
+A session is recorded into a directory with segment files and an offset index:
+
+    segment_00000.rec   records appended back to back, a new segment every max_segment_bytes
+    index.jsonl         one line per record: iteration, kind, segment, offset, length, timestamp
+
+The timestamps are time.perf_counter() seconds of the recording process, the clock of
+Frame.captured_at; a frame record carries the capture time of its frame.
+
+Every record in a segment is a fixed header followed by its payload:
+
+    kind (uint8) | 3 pad bytes | iteration (uint32) | payload length (uint64) | timestamp (float64)
+
+Payloads are the encoded screenshot ('frame'), the JPEG of the annotated screenshot
+('annotated') or UTF-8 JSON ('iteration': action, coordinates, timings and the raw
+model answers). The SessionReader memory-maps the segments and seeks straight to any
+record through the index, which it can also rebuild from the record headers if it was lost.
+"""
+
+import io
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+from .frame import Frame
+
+
+SEGMENT_MAGIC = b"CSREC\x00\x01\x00"
+RECORD_HEADER = struct.Struct("<B3xIQd")
+KINDS = {"frame": 1, "annotated": 2, "iteration": 3}
+KIND_NAMES = {value: name for name, value in KINDS.items()}
+INDEX_FILENAME = "index.jsonl"
+
+
+def segment_filename(segment: int) -> str:
+    return f"segment_{segment:05d}.rec"
+
+
+class SessionRecorder:
+    """Appends the records of one session. Thread-safe."""
+
+    def __init__(self, directory: str, max_segment_bytes: int = 512 * 1024 * 1024, annotated_quality: int = 85):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.annotated_quality = annotated_quality
+        os.makedirs(directory, exist_ok=True)
+
+        self.records = 0
+        self.bytes_written = 0
+        self._segment = -1
+        self._segment_file = None
+        self._index_file = open(os.path.join(directory, INDEX_FILENAME), "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._open_segment()
+
+    def _open_segment(self):
+        if self._segment_file is not None:
+            self._segment_file.close()
+        self._segment += 1
+        self._segment_file = open(os.path.join(self.directory, segment_filename(self._segment)), "ab")
+        if self._segment_file.tell() == 0:
+            self._segment_file.write(SEGMENT_MAGIC)
+
+    def append(self, kind: str, iteration: int, payload: bytes, timestamp: Optional[float] = None) -> Dict:
+        """Appends one record and its index entry. Returns the index entry."""
+        if kind not in KINDS:
+            raise ValueError(f"Unknown record kind '{kind}'. Choose from {list(KINDS)}.")
+        timestamp = time.perf_counter() if timestamp is None else timestamp
+
+        with self._lock:
+            if self._segment_file is None:
+                raise RuntimeError("The recorder is already closed.")
+            if self._segment_file.tell() + RECORD_HEADER.size + len(payload) > self.max_segment_bytes \
+                    and self._segment_file.tell() > len(SEGMENT_MAGIC):
+                self._open_segment()
+
+            self._segment_file.write(RECORD_HEADER.pack(KINDS[kind], iteration, len(payload), timestamp))
+            offset = self._segment_file.tell()
+            self._segment_file.write(payload)
+            self._segment_file.flush()
+
+            entry = {"iteration": iteration, "kind": kind, "segment": self._segment,
+                     "offset": offset, "length": len(payload), "timestamp": timestamp}
+            # the index line is only written once its record is in the segment
+            self._index_file.write(json.dumps(entry) + "\n")
+            self._index_file.flush()
+
+            self.records += 1
+            self.bytes_written += RECORD_HEADER.size + len(payload)
+        return entry
+
+    def record_frame(self, iteration: int, frame: Frame) -> Dict:
+        return self.append("frame", iteration, frame.data, timestamp=frame.captured_at)
+
+    def record_annotated(self, iteration: int, image: Image.Image) -> Dict:
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=self.annotated_quality)
+        return self.append("annotated", iteration, buffer.getvalue())
+
+    def record_iteration(self, iteration: int, data: Dict) -> Dict:
+        return self.append("iteration", iteration, json.dumps(data, default=str).encode("utf-8"))
+
+    def close(self):
+        with self._lock:
+            if self._segment_file is None:
+                return
+            self._segment_file.close()
+            self._index_file.close()
+            self._segment_file = None
+
+
+def rebuild_index(directory: str) -> List[Dict]:
+    """Scans the record headers of every segment, e.g. when index.jsonl is missing or truncated."""
+    entries = []
+    segment = 0
+    while os.path.exists(os.path.join(directory, segment_filename(segment))):
+        with open(os.path.join(directory, segment_filename(segment)), "rb") as f:
+            if f.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+                raise ValueError(f"{segment_filename(segment)} is not a session recording segment.")
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                kind, iteration, length, timestamp = RECORD_HEADER.unpack(header)
+                offset = f.tell()
+                f.seek(length, os.SEEK_CUR)
+                if f.tell() > os.fstat(f.fileno()).st_size:
+                    break  # record cut off by a crash
+                entries.append({"iteration": iteration, "kind": KIND_NAMES.get(kind, str(kind)),
+                                "segment": segment, "offset": offset, "length": length, "timestamp": timestamp})
+        segment += 1
+    return entries
+
+
+class SessionReader:
+    """
+    Random access to a session recording through memory-mapped segments.
+
+        with SessionReader("images/20250101_120000") as session:
+            for iteration in session.iterations():
+                frame = session.frame(iteration)
+                info = session.iteration_data(iteration)
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._files = {}
+        self.reload()
+
+    def reload(self):
+        """Re-reads the index, e.g. to follow a session which is still being recorded."""
+        index_path = os.path.join(self.directory, INDEX_FILENAME)
+        entries = []
+        if os.path.exists(index_path):
+            with open(index_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break  # last line cut off by a crash
+        else:
+            entries = rebuild_index(self.directory)
+
+        self.entries = entries
+        self._by_iteration: Dict[int, Dict[str, Dict]] = {}
+        for entry in entries:
+            self._by_iteration.setdefault(entry["iteration"], {})[entry["kind"]] = entry
+
+    def _map(self, segment: int, end: int) -> mmap.mmap:
+        mapped = self._maps.get(segment)
+        if mapped is None or len(mapped) < end:
+            # (re)map: the segment may have grown since it was mapped
+            if mapped is not None:
+                try:
+                    mapped.close()
+                except BufferError:
+                    pass  # a caller still holds a view, the old map is freed with it
+            if segment not in self._files:
+                self._files[segment] = open(os.path.join(self.directory, segment_filename(segment)), "rb")
+            mapped = mmap.mmap(self._files[segment].fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = mapped
+        return mapped
+
+    def read(self, entry: Dict) -> memoryview:
+        """Zero-copy view of a record's payload."""
+        end = entry["offset"] + entry["length"]
+        return memoryview(self._map(entry["segment"], end))[entry["offset"]:end]
+
+    def iterations(self) -> List[int]:
+        return sorted(self._by_iteration)
+
+    def __len__(self):
+        return len(self._by_iteration)
+
+    def entry(self, iteration: int, kind: str) -> Optional[Dict]:
+        return self._by_iteration.get(iteration, {}).get(kind)
+
+    def frame(self, iteration: int) -> Optional[Frame]:
+        entry = self.entry(iteration, "frame")
+        if entry is None:
+            return None
+        return Frame(bytes(self.read(entry)), captured_at=entry["timestamp"])
+
+    def annotated(self, iteration: int) -> Optional[Image.Image]:
+        entry = self.entry(iteration, "annotated")
+        if entry is None:
+            return None
+        return Image.open(io.BytesIO(self.read(entry)))
+
+    def iteration_data(self, iteration: int) -> Optional[Dict]:
+        entry = self.entry(iteration, "iteration")
+        if entry is None:
+            return None
+        return json.loads(bytes(self.read(entry)))
+
+    def close(self):
+        for mapped in self._maps.values():
+            mapped.close()
+        for f in self._files.values():
+            f.close()
+        self._maps.clear()
+        self._files.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,208 @@
+"""
+Local target tracking between aiming model detections.
+
+After a shot the next correction would wait for a whole aiming model round trip.
+The TargetTracker keeps a grey-level patch around the detected point and finds it
+again in the next frames with normalized cross-correlation (NumPy FFTs, a few
+milliseconds on a downsampled search window). While the match is confident it
+hands out follow-up aim points without any model call; when the confidence drops,
+or after `max_follow_ups` corrections, the models take over again.
+
+    tracker = TargetTracker()
+    run_agent(..., tracker=tracker)
+"""
+
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+def to_grey(pixels: np.ndarray, stride: int = 1) -> np.ndarray:
+    """float32 grey levels of an RGB array, sampled every `stride` pixels."""
+    sampled = pixels[::stride, ::stride]
+    return sampled.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def match_template(image: np.ndarray, template: np.ndarray) -> np.ndarray:
+    """
+    Normalized cross-correlation of `template` at every position where it fits into `image`.
+    Returns an array of shape (H - h + 1, W - w + 1) with values in [-1, 1]; flat image
+    windows score 0.
+    """
+    h, w = template.shape
+    height, width = image.shape
+    t = template - template.mean()
+    t_norm = np.sqrt(np.sum(t * t))
+    if t_norm < 1e-6:
+        return np.zeros((height - h + 1, width - w + 1), dtype=np.float32)
+
+    # correlation as a convolution with the flipped template
+    shape = (height + h - 1, width + w - 1)
+    spectrum = np.fft.rfft2(image, shape) * np.fft.rfft2(t[::-1, ::-1], shape)
+    numerator = np.fft.irfft2(spectrum, shape)[h - 1:height, w - 1:width]
+
+    # window sums from integral images
+    def window_sums(values: np.ndarray) -> np.ndarray:
+        integral = np.pad(values.astype(np.float64).cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+        return integral[h:, w:] - integral[:-h, w:] - integral[h:, :-w] + integral[:-h, :-w]
+
+    n = h * w
+    sums = window_sums(image)
+    variance = window_sums(image * image) - sums * sums / n
+    denominator = np.sqrt(np.maximum(variance, 0)) * t_norm
+    return np.where(denominator > 1e-3 * n, numerator / np.maximum(denominator, 1e-9), 0).astype(np.float32)
+
+
+class TargetTracker:
+    def __init__(self,
+                 patch_size: int = 48,
+                 search_radius: int = 160,
+                 stride: int = 2,
+                 min_confidence: float = 0.6,
+                 max_follow_ups: int = 3,
+                 screen_center: Tuple[int, int] = (960, 540)):
+        """
+        :param patch_size: side of the square template around the detected point, in screen pixels.
+        :param search_radius: how far from the expected positions the target is searched for.
+            After a shot the view has turned towards the target, so it is expected near the
+            crosshair (`screen_center`) as well as near its last position.
+        :param stride: the frames are matched at 1/stride of their resolution.
+        :param min_confidence: correlation below which the target counts as lost.
+        :param max_follow_ups: corrections per model detection before the models take over.
+        """
+        if not 0 < min_confidence <= 1:
+            raise ValueError("min_confidence has to be in (0, 1].")
+
+        self.patch_size = patch_size
+        self.search_radius = search_radius
+        self.stride = stride
+        self.min_confidence = min_confidence
+        self.max_follow_ups = max_follow_ups
+        self.screen_center = screen_center
+
+        self._template: Optional[np.ndarray] = None
+        self._last_point: Optional[Dict[str, int]] = None
+        self._last_tracked_frame = None
+        self._shot_at = 0.0
+        self._follow_ups = 0
+        # the pipelined loop tracks on the inference thread and shoots on the action thread
+        self._lock = threading.Lock()
+
+        self.tracks = 0
+        self.follow_ups = 0
+        self.lost = 0
+        self.exhausted = 0
+        self.matches = 0
+        self.confidence_sum = 0.0
+        self.match_time = 0.0
+
+    @property
+    def active(self) -> bool:
+        return self._template is not None
+
+    def _frame_point(self, frame, point: Dict[str, int]) -> Dict[str, int]:
+        return point if frame.screen_transform is None else frame.screen_transform.to_view(point)
+
+    def _frame_scale(self, frame) -> float:
+        return 1.0 if frame.screen_transform is None else frame.screen_transform.scale_x
+
+    def engaged(self, frame, point: Dict[str, int]):
+        """
+        Called after every shot at `point` (screen coordinates) of `frame`. A shot at a point
+        found by track() continues the track, any other shot starts a new one from `frame`.
+        """
+        with self._lock:
+            self._shot_at = time.perf_counter()
+            if frame is self._last_tracked_frame:
+                return
+
+            scale = self._frame_scale(frame)
+            half = max(4, int(self.patch_size * scale / 2))
+            center = self._frame_point(frame, point)
+            pixels = frame.pixels
+            # on the sampling grid of to_grey(frame.pixels, stride)
+            x1 = (center["x"] - half) // self.stride * self.stride
+            y1 = (center["y"] - half) // self.stride * self.stride
+            x2, y2 = x1 + 2 * half, y1 + 2 * half
+            if x1 < 0 or y1 < 0 or x2 > pixels.shape[1] or y2 > pixels.shape[0]:
+                self._template = None  # too close to the border to be tracked
+                return
+
+            self._template = to_grey(pixels[y1:y2, x1:x2], self.stride)
+            self._last_point = dict(point)
+            self._last_tracked_frame = None
+            self._follow_ups = 0
+            self.tracks += 1
+
+    def stop(self):
+        with self._lock:
+            self._template = None
+
+    def track(self, frame) -> Optional[Dict[str, int]]:
+        """
+        The target's position in `frame` (screen coordinates), or None when there is no track,
+        the frame was captured before the last shot, or the target is lost.
+        """
+        with self._lock:
+            if self._template is None or frame.captured_at <= self._shot_at:
+                return None
+            if self._follow_ups >= self.max_follow_ups:
+                self._template = None
+                self.exhausted += 1
+                return None
+
+            start = time.perf_counter()
+            point, confidence = self._match(frame)
+            self.match_time += time.perf_counter() - start
+            self.matches += 1
+            self.confidence_sum += confidence
+
+            if point is None or confidence < self.min_confidence:
+                self._template = None
+                self.lost += 1
+                return None
+
+            self._follow_ups += 1
+            self.follow_ups += 1
+            self._last_point = point
+            self._last_tracked_frame = frame
+            return point
+
+    def _match(self, frame) -> Tuple[Optional[Dict[str, int]], float]:
+        pixels = frame.pixels
+        height, width = (pixels.shape[0] + self.stride - 1) // self.stride, (pixels.shape[1] + self.stride - 1) // self.stride
+        scale = self._frame_scale(frame) / self.stride
+        radius = int(self.search_radius * scale)
+        expected = [self._frame_point(frame, self._last_point), self._frame_point(frame, {
+            "x": self.screen_center[0], "y": self.screen_center[1]})]
+
+        t_h, t_w = self._template.shape
+        x1 = max(0, int(min(p["x"] for p in expected) / self.stride) - radius - t_w // 2)
+        y1 = max(0, int(min(p["y"] for p in expected) / self.stride) - radius - t_h // 2)
+        x2 = min(width, int(max(p["x"] for p in expected) / self.stride) + radius + t_w // 2 + 1)
+        y2 = min(height, int(max(p["y"] for p in expected) / self.stride) + radius + t_h // 2 + 1)
+        if x2 - x1 < t_w or y2 - y1 < t_h:
+            return None, 0.0
+
+        # only the search window is converted, at the sampling grid of the template
+        s = self.stride
+        window = to_grey(pixels[y1 * s:y2 * s, x1 * s:x2 * s], s)
+        scores = match_template(window, self._template)
+        y, x = np.unravel_index(int(np.argmax(scores)), scores.shape)
+        view_point = {"x": int(x1 + x + t_w // 2) * s, "y": int(y1 + y + t_h // 2) * s}
+        return frame.to_screen(view_point), float(scores[y, x])
+
+    def report(self) -> Dict:
+        with self._lock:
+            matches = self.matches
+            return {
+                "tracks": self.tracks,
+                "follow_ups": self.follow_ups,
+                "follow_ups_per_track": round(self.follow_ups / self.tracks, 2) if self.tracks else 0.0,
+                "lost": self.lost,
+                "exhausted": self.exhausted,
+                "avg_confidence": round(self.confidence_sum / matches, 3) if matches else 0.0,
+                "avg_match_ms": round(1000 * self.match_time / matches, 1) if matches else 0.0,
+            }
@@ -0,0 +1,52 @@
+import threading
+from typing import Callable, List
+
+
+class RequestCancelled(Exception):
+    """Raised inside a model call after its cancellation token was triggered."""
+
+
+class CancellationToken:
+    """
+    Thread-safe flag shared between the agent and a running model call.
+
+    The model checks the token between streamed chunks and closes the HTTP
+    response as soon as it is cancelled, so the provider stops generating.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def add_callback(self, callback: Callable[[], None]):
+        """Calls `callback` on cancellation, or right away if the token is already cancelled."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def wait(self, timeout: float) -> bool:
+        """Sleeps up to `timeout` seconds, or until cancelled. Returns whether the token is cancelled."""
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise RequestCancelled()
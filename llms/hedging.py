@@ -0,0 +1,349 @@
+"""
+Hedged aiming requests.
+
+The same frame is sent to a second model (or the same model on another provider)
+when the first one has not answered within `hedge_delay` seconds. The first
+response that parse_point_json() accepts wins and every other request is
+cancelled. Aiming latency has a long tail, so this trades some extra spend for a
+much better p99.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import threading
+import time
+from typing import Dict, List, Optional
+
+from llms.cancellation import CancellationToken, RequestCancelled
+from llms.models import AimingModel
+from llms.rate_limit import RetryBudget
+from llms.streaming import StreamedResponse
+
+
+def _usage_of(usage):
+    """(total_tokens, cost) of a response's usage, None when the provider did not report it. The
+    cost is None when only the tokens were reported."""
+    if usage is None:
+        return None
+    tokens = getattr(usage, "total_tokens", 0) or 0
+    cost = getattr(usage, "cost", None)
+    if cost is None:
+        cost = (getattr(usage, "model_extra", None) or {}).get("cost")
+    return tokens, cost
+
+
+def percentile(samples, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class HedgeStats:
+    """Per-model counters of one HedgedAimingModel."""
+    def __init__(self, max_samples: int = 1000):
+        self.launched = 0
+        self.wins = 0
+        self.no_target = 0     # answered, but without a point
+        self.errors = 0
+        self.cancelled = 0     # still running when another model won; the usage of these is unknown
+        self.wasted = 0        # finished, but the answer was not used
+        self.wasted_unknown = 0  # of these, without a reported usage
+        self.wasted_tokens = 0
+        self.wasted_cost = 0.0
+        self.wasted_priced = 0   # wasted answers with a reported cost
+        self.latencies = collections.deque(maxlen=max_samples)  # from the launch of the request
+
+    def summary(self) -> Dict:
+        return {
+            "launched": self.launched,
+            "wins": self.wins,
+            "no_target": self.no_target,
+            "errors": self.errors,
+            "cancelled": self.cancelled,
+            "wasted": self.wasted,
+            "wasted_unknown": self.wasted_unknown,
+            # None rather than 0 when no wasted answer reported its usage
+            "wasted_tokens": self.wasted_tokens if self.wasted > self.wasted_unknown else None,
+            "wasted_cost": round(self.wasted_cost, 6) if self.wasted_priced else None,
+            "p50_s": round(percentile(self.latencies, 50), 3),
+            "p99_s": round(percentile(self.latencies, 99), 3),
+        }
+
+
+class HedgedAimingModel:
+    """
+    Drop-in replacement for AimingModel which hedges each request over several aiming models.
+
+    :param models: aiming models in the order they are tried. Use different models or the
+        same model with a different provider_order.
+    :param hedge_delay: seconds to wait for an answer before the next model is launched.
+        0 sends the frame to all models right away.
+    """
+    def __init__(self, models: List[AimingModel], hedge_delay: float = 0.5):
+        if not models:
+            raise ValueError("HedgedAimingModel needs at least one aiming model.")
+
+        self.models = models
+        self.hedge_delay = hedge_delay
+        self.model = models[0].model
+        self.system_message = models[0].system_message
+
+        self.labels = [self._label(m) for m in models]
+        self.stats: Dict[str, HedgeStats] = {label: HedgeStats() for label in self.labels}
+        self._lock = threading.Lock()
+        # cancelled requests linger until their next streamed chunk, hence the extra workers
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=2 * len(models),
+                                                               thread_name_prefix="hedge")
+
+    @classmethod
+    def from_models_ordered(cls,
+                            system_message: Dict = AimingModel.DEFAULT_SYSTEM_MESSAGE,
+                            n_models: int = 2,
+                            hedge_delay: float = 0.5,
+                            temperature: Optional[float] = None,
+                            api_key_name: str = "OPENROUTER_API_KEY"):
+        """Hedges over the first `n_models` of AimingModel.MODELS_ORDERED."""
+        models = [AimingModel(model=name,
+                              system_message=system_message,
+                              temperature=temperature,
+                              api_key_name=api_key_name)
+                  for name in AimingModel.MODELS_ORDERED[:n_models]]
+        return cls(models=models, hedge_delay=hedge_delay)
+
+    @staticmethod
+    def _label(model: AimingModel) -> str:
+        providers = getattr(model, "provider_order", None)
+        return f"{model.model}@{providers[0]}" if providers else model.model
+
+    def parse_point_json(self, model_response):
+        return self.models[0].parse_point_json(model_response)
+
+    def _record_launch(self, index: int) -> float:
+        """Counts a launch and returns its time, where the latency of the request starts."""
+        with self._lock:
+            self.stats[self.labels[index]].launched += 1
+        return time.perf_counter()
+
+    def _record_answer(self, index: int, latency: float, content) -> bool:
+        """Records a finished attempt and returns True when its answer contains a point."""
+        has_point = self.parse_point_json(content) is not None
+        with self._lock:
+            stats = self.stats[self.labels[index]]
+            stats.latencies.append(latency)
+            if not has_point:
+                stats.no_target += 1
+        return has_point
+
+    def _record_error(self, index: int):
+        with self._lock:
+            self.stats[self.labels[index]].errors += 1
+
+    def _record_outcome(self, winner: Optional[int], used_index: Optional[int],
+                        answers: Dict[int, tuple], cancelled: List[int]):
+        with self._lock:
+            if winner is not None:
+                self.stats[self.labels[winner]].wins += 1
+            for index in cancelled:
+                self.stats[self.labels[index]].cancelled += 1
+        for index, (_, response) in answers.items():
+            if index == used_index:
+                continue
+            if isinstance(response, StreamedResponse):
+                # a stream stopped early only knows its usage once it was read to the end
+                response.when_usage(lambda usage, index=index: self._record_wasted(index, usage))
+            else:
+                self._record_wasted(index, getattr(response, "usage", None))
+
+    def _record_wasted(self, index: int, usage):
+        usage = _usage_of(usage)
+        with self._lock:
+            stats = self.stats[self.labels[index]]
+            stats.wasted += 1
+            if usage is None:
+                stats.wasted_unknown += 1
+                return
+            tokens, cost = usage
+            stats.wasted_tokens += tokens
+            if cost is not None:
+                stats.wasted_cost += cost
+                stats.wasted_priced += 1
+
+    def _pick(self, winner: Optional[int], answers: Dict[int, tuple], last_error: Optional[BaseException]):
+        """Winner if any, otherwise the first "no target" answer, otherwise the last error is raised."""
+        if winner is not None:
+            return winner
+        if answers:
+            return min(answers)
+        if last_error is not None:
+            raise last_error
+        return None
+
+    def complete(self, user_messages: List, cancel_token: Optional[CancellationToken] = None,
+                 retry_budget: Optional[RetryBudget] = None):
+        start = time.perf_counter()
+        tokens = [CancellationToken() for _ in self.models]
+        if cancel_token is not None:
+            cancel_token.add_callback(lambda: [token.cancel() for token in tokens])
+
+        pending: Dict[concurrent.futures.Future, int] = {}
+        answers: Dict[int, tuple] = {}
+        launched_at: Dict[int, float] = {}
+        winner = None
+        last_error = None
+        next_index = 0
+        last_launch = start
+        stop_hedging = False
+
+        def launch():
+            nonlocal next_index, last_launch
+            index = next_index
+            future = self._executor.submit(self.models[index].complete,
+                                           user_messages=user_messages,
+                                           cancel_token=tokens[index],
+                                           retry_budget=retry_budget)
+            pending[future] = index
+            launched_at[index] = self._record_launch(index)
+            next_index += 1
+            last_launch = time.perf_counter()
+
+        launch()
+        while self.hedge_delay == 0 and next_index < len(self.models):
+            launch()
+
+        while pending or (next_index < len(self.models) and not stop_hedging):
+            if not pending:
+                launch()
+            can_hedge = next_index < len(self.models) and not stop_hedging
+            timeout = max(0.0, self.hedge_delay - (time.perf_counter() - last_launch)) if can_hedge else None
+            done, _ = concurrent.futures.wait(list(pending), timeout=timeout,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    content, response = future.result()
+                except RequestCancelled:
+                    continue
+                except Exception as e:
+                    self._record_error(index)
+                    last_error = e
+                    continue
+
+                answers[index] = (content, response)
+                if self._record_answer(index, time.perf_counter() - launched_at[index], content):
+                    winner = index
+                    break
+                # A model saw no target. Don't pay for more opinions on this frame.
+                stop_hedging = True
+
+            if winner is not None:
+                break
+            if cancel_token is not None and cancel_token.cancelled:
+                break
+            if not done and can_hedge:
+                launch()
+
+        cancelled = []
+        for future, index in pending.items():
+            if future.done() and not future.cancelled() and future.exception() is None:
+                answers[index] = future.result()
+                continue
+            tokens[index].cancel()
+            future.cancel()
+            cancelled.append(index)
+
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+
+        used_index = self._pick(winner, answers, last_error)
+        self._record_outcome(winner, used_index, answers, cancelled)
+        if used_index is None:
+            return None, None
+        return answers[used_index]
+
+    async def acomplete(self, user_messages: List, retry_budget: Optional[RetryBudget] = None):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+
+        pending: Dict[asyncio.Task, int] = {}
+        answers: Dict[int, tuple] = {}
+        launched_at: Dict[int, float] = {}
+        winner = None
+        last_error = None
+        next_index = 0
+        last_launch = start
+        stop_hedging = False
+
+        def launch():
+            nonlocal next_index, last_launch
+            index = next_index
+            task = asyncio.create_task(self.models[index].acomplete(user_messages=user_messages,
+                                                                    retry_budget=retry_budget))
+            pending[task] = index
+            launched_at[index] = self._record_launch(index)
+            next_index += 1
+            last_launch = loop.time()
+
+        try:
+            launch()
+            while self.hedge_delay == 0 and next_index < len(self.models):
+                launch()
+
+            while pending or (next_index < len(self.models) and not stop_hedging):
+                if not pending:
+                    launch()
+                can_hedge = next_index < len(self.models) and not stop_hedging
+                timeout = max(0.0, self.hedge_delay - (loop.time() - last_launch)) if can_hedge else None
+                done, _ = await asyncio.wait(list(pending), timeout=timeout,
+                                             return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    index = pending.pop(task)
+                    try:
+                        content, response = task.result()
+                    except Exception as e:
+                        self._record_error(index)
+                        last_error = e
+                        continue
+
+                    answers[index] = (content, response)
+                    if self._record_answer(index, time.perf_counter() - launched_at[index], content):
+                        winner = index
+                        break
+                    stop_hedging = True
+
+                if winner is not None:
+                    break
+                if not done and can_hedge:
+                    launch()
+        finally:
+            cancelled = []
+            for task, index in pending.items():
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    answers[index] = task.result()
+                    continue
+                task.cancel()
+                cancelled.append(index)
+
+        used_index = self._pick(winner, answers, last_error)
+        self._record_outcome(winner, used_index, answers, cancelled)
+        if used_index is None:
+            return None, None
+        return answers[used_index]
+
+    def report(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {label: stats.summary() for label, stats in self.stats.items()}
+
+    def close(self):
+        """Releases the pool of the sync calls without waiting for the cancelled ones still running."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,3 +1,4 @@
+import asyncio
 import os
 from dotenv import load_dotenv
 from typing import Dict, List, Tuple, Optional
@@ -5,16 +6,178 @@ import json
 from abc import ABC, abstractmethod
 
 
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+from llms.cancellation import CancellationToken
+from llms.rate_limit import RateLimiter, RetryBudget, get_rate_limiter
+from llms.streaming import (StreamAccumulator, StreamedResponse, PointStreamParser, ToolCallWatcher, start_adrain,
+                            start_drain)
 from llms.tools import BaseTool
+from tracing import Span, get_tracer, log
 
 load_dotenv()
 
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+GROQ_BASE_URL = "https://api.groq.com/openai/v1"
+
+
 class BaseModel(ABC):
+    # All models of a provider share its process-wide limiter (see llms.rate_limit).
+    # Set rate_limiter on an instance to give it a limiter of its own.
+    rate_limit_group: str = "openrouter"
+    rate_limiter: Optional[RateLimiter] = None
+    # stage name of the calls' spans, see tracing.py
+    trace_name: str = "model"
+    # seconds to keep reading a stream stopped early for its usage chunk
+    usage_drain_timeout: float = 30.0
+
     @abstractmethod
     def complete(self, **kwargs):
         pass
 
+    @abstractmethod
+    async def acomplete(self, **kwargs):
+        pass
+
+    def _log_blocked(self, response):
+        """A response without an id, e.g. blocked by the provider. Counted as model_blocked."""
+        log(f"Response blocked: {response}")
+        get_tracer().add("model_blocked", 1, model=getattr(self, "model", None))
+
+    @property
+    def limiter(self) -> RateLimiter:
+        return self.rate_limiter or get_rate_limiter(self.rate_limit_group)
+
+    def _trace_response(self, span: Span, response):
+        """
+        Tags the span of a call with the model and provider that answered and the token usage.
+        A streamed response may only learn its usage after the call returned, its span is
+        deferred and recorded then. Unknown usage is tagged as such, not as zero tokens.
+        """
+        model = getattr(response, "model", None) or span.tags.get("model")
+        span.tag(model=model, provider=getattr(response, "provider", None))
+
+        def tag_usage(usage):
+            if usage is None:
+                span.tag(usage_unknown=True)
+                get_tracer().add("model_usage_unknown", 1, model=model)
+            for kind in ("prompt", "completion"):
+                tokens = getattr(usage, f"{kind}_tokens", None)
+                if tokens is not None:
+                    span.tag(**{f"{kind}_tokens": tokens})
+                    get_tracer().add("model_tokens", tokens, model=model, kind=kind)
+            if span.deferred:
+                get_tracer().finish(span)
+
+        if isinstance(response, StreamedResponse):
+            response.when_usage(tag_usage)
+        else:
+            tag_usage(getattr(response, "usage", None))
+
+    def _create_completion(self, retry_budget: Optional[RetryBudget] = None, **request):
+        """Non-streamed chat completion within the rate limits, retried on 429s and transient errors."""
+        with get_tracer().span(self.trace_name, model=request.get("model"), stream=False) as span:
+            response = self.limiter.call(lambda: self.client.chat.completions.create(**request),
+                                         retry_budget=retry_budget)
+            self._trace_response(span, response)
+            return response
+
+    async def _acreate_completion(self, retry_budget: Optional[RetryBudget] = None, **request):
+        with get_tracer().span(self.trace_name, model=request.get("model"), stream=False) as span:
+            response = await self.limiter.acall(lambda: self.async_client.chat.completions.create(**request),
+                                                retry_budget=retry_budget)
+            self._trace_response(span, response)
+            return response
+
+    def _stream_completion(self, cancel_token: Optional[CancellationToken] = None, stop_early=None,
+                           retry_budget: Optional[RetryBudget] = None, **request):
+        """
+        Streams a chat completion so that it can be aborted mid-flight.
+        The token is checked after every chunk; once it is cancelled the HTTP response
+        is closed, the provider stops generating and RequestCancelled is raised.
+
+        stop_early(content_delta, tool_call_parts) is called after every chunk. Returning True
+        returns right away, e.g. once the answer can already be parsed. The rest of the stream
+        is then read in the background, without acting on it, for its usage chunk.
+
+        The request is sent within the rate limits and retried from retry_budget. Only the
+        request itself is retried: errors while reading the stream are not retryable, so
+        stop_early never sees a chunk twice.
+
+        Returns:
+            tuple: (content, tool_calls, response) - the same pieces a non-streamed
+            response would provide. response is a StreamedResponse with the id, model and
+            the usage once it is known.
+        """
+        def attempt():
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            stream = self.client.chat.completions.create(stream=True,
+                                                         stream_options={"include_usage": True},
+                                                         **request)
+
+            accumulator = StreamAccumulator()
+            stopped_early = False
+            try:
+                for chunk in stream:
+                    if cancel_token is not None:
+                        cancel_token.raise_if_cancelled()
+                    content_delta = accumulator.add(chunk)
+                    if stop_early is not None and stop_early(content_delta, accumulator.tool_call_parts):
+                        stopped_early = True
+                        break
+            except BaseException:
+                stream.close()
+                accumulator.response.resolve()
+                raise
+
+            if stopped_early and accumulator.response.usage is None:
+                start_drain(stream, accumulator.response, self.usage_drain_timeout)
+            else:
+                stream.close()
+                accumulator.response.resolve()
+            return accumulator.content, accumulator.tool_calls(), accumulator.response
+
+        with get_tracer().span(self.trace_name, model=request.get("model"), stream=True) as span:
+            content, tool_calls, response = self.limiter.call(attempt, cancel_token=cancel_token,
+                                                              retry_budget=retry_budget)
+            span.defer()
+        self._trace_response(span, response)
+        return content, tool_calls, response
+
+    async def _astream_completion(self, stop_early=None, retry_budget: Optional[RetryBudget] = None, **request):
+        """Async version of _stream_completion(). Cancelling the awaiting task closes the stream."""
+        async def attempt():
+            stream = await self.async_client.chat.completions.create(stream=True,
+                                                                     stream_options={"include_usage": True},
+                                                                     **request)
+
+            accumulator = StreamAccumulator()
+            stopped_early = False
+            try:
+                async for chunk in stream:
+                    content_delta = accumulator.add(chunk)
+                    if stop_early is not None and stop_early(content_delta, accumulator.tool_call_parts):
+                        stopped_early = True
+                        break
+            except BaseException:
+                try:
+                    await stream.close()
+                finally:
+                    accumulator.response.resolve()
+                raise
+
+            if stopped_early and accumulator.response.usage is None:
+                start_adrain(stream, accumulator.response, self.usage_drain_timeout)
+            else:
+                await stream.close()
+                accumulator.response.resolve()
+            return accumulator.content, accumulator.tool_calls(), accumulator.response
+
+        with get_tracer().span(self.trace_name, model=request.get("model"), stream=True) as span:
+            content, tool_calls, response = await self.limiter.acall(attempt, retry_budget=retry_budget)
+            span.defer()
+        self._trace_response(span, response)
+        return content, tool_calls, response
 
 
 class OpenAIModel(BaseModel):
@@ -28,34 +191,63 @@ class OpenAIModel(BaseModel):
             "speak": SpeakFunction(robot)
             }
     """
+    rate_limit_group = "openai"
+
     def __init__(self, 
                  tools: Dict[str, BaseTool] = {},
                  model: str="gpt-4o",
-                 api_key_name: str = "OPEN_AI_KEY"):
+                 api_key_name: str = "OPEN_AI_KEY",
+                 base_url: Optional[str] = None):
+        """
+        :param base_url: OpenAI-compatible endpoint, e.g. the stub server of benchmarks/replay_server.py.
+        """
         
         self.model = model
         self.default_image_quality = "low"
 
         openai_api_key = os.environ.get(api_key_name)
-        self.client = OpenAI(api_key=openai_api_key)
+        # retries are done by the shared rate limiter, not per client
+        self.client = OpenAI(base_url=base_url, api_key=openai_api_key, max_retries=0)
+        self.async_client = AsyncOpenAI(base_url=base_url, api_key=openai_api_key, max_retries=0)
         self.tools = tools
 
-    def complete(self, user_messages: List):
-        """
-        Sends a conversation to the OpenAI API and processes responses,
-        including tool calls when required.
-        """
-        response = self.client.chat.completions.create(
+    def _build_request(self, user_messages: List) -> Dict:
+        return dict(
             model=self.model,
             messages=user_messages,
             tools=[tool.function_schema for tool in self.tools.values()],
             tool_choice="auto"
         )
 
+    def complete(self, user_messages: List, cancel_token: Optional[CancellationToken] = None,
+                 retry_budget: Optional[RetryBudget] = None):
+        """
+        Sends a conversation to the OpenAI API and processes responses,
+        including tool calls when required.
+        """
+        request = self._build_request(user_messages)
+
+        if cancel_token is not None:
+            content, tool_calls, response = self._stream_completion(cancel_token, retry_budget=retry_budget,
+                                                                    **request)
+        else:
+            response = self._create_completion(retry_budget, **request)
+            content, tool_calls = response.choices[0].message.content, response.choices[0].message.tool_calls
+
+        if tool_calls:
+            tool_responses = self._handle_tool_calls(tool_calls)        
+
+        return content, response
+
+    async def acomplete(self, user_messages: List, retry_budget: Optional[RetryBudget] = None):
+        """
+        Async version of complete(). The tools talk to the sandbox, so they are executed off-thread.
+        """
+        response = await self._acreate_completion(retry_budget, **self._build_request(user_messages))
         response_message = response.choices[0].message
 
         if response_message.tool_calls:
-            tool_responses = self._handle_tool_calls(response_message.tool_calls)        
+            await asyncio.to_thread(self._handle_tool_calls, response_message.tool_calls)
 
         return response_message.content, response
 
@@ -77,7 +269,8 @@ class OpenAIModel(BaseModel):
             # print(f"Arguments: {arguments}")
 
             if tool_name not in self.tools:
-                print(f"The model halucinated a tool {tool_name}. The tool is not defined.")
+                log(f"The model halucinated a tool {tool_name}. The tool is not defined.")
+                get_tracer().add("unknown_tool_calls", 1, model=self.model)
                 continue
 
             tool_response = self.tools[tool_name].execute(**arguments)
@@ -86,15 +279,20 @@ class OpenAIModel(BaseModel):
     
 
 class GroqModel(OpenAIModel):
+    rate_limit_group = "groq"
+
     def __init__(self, 
                  tools: Dict[str, BaseTool] = {},
-                 model: str = "meta-llama/llama-4-scout-17b-16e-instruct"):
+                 model: str = "meta-llama/llama-4-scout-17b-16e-instruct",
+                 base_url: str = GROQ_BASE_URL):
 
         self.model = model
 
         groq_api_key = os.environ.get("GROQ_API_KEY")
-        self.client = OpenAI(base_url="https://api.groq.com/openai/v1",
-                             api_key=groq_api_key)
+        self.client = OpenAI(base_url=base_url,
+                             api_key=groq_api_key, max_retries=0)
+        self.async_client = AsyncOpenAI(base_url=base_url,
+                                        api_key=groq_api_key, max_retries=0)
         self.tools = tools
 
 
@@ -102,35 +300,62 @@ class BaseOpenRouterModel(BaseModel):
     "No tools" 
     def __init__(self, 
                  model: str = "qwen/qwen2.5-vl-3b-instruct:free",
-                 api_key_name: str = "OPENROUTER_API_KEY"
+                 api_key_name: str = "OPENROUTER_API_KEY",
+                 base_url: str = OPENROUTER_BASE_URL
                  ):
 
         self.model = model
         open_router_api_key = os.environ.get(api_key_name)
-        self.client = OpenAI(base_url="https://openrouter.ai/api/v1",
-                             api_key=open_router_api_key)
+        self.client = OpenAI(base_url=base_url,
+                             api_key=open_router_api_key, max_retries=0)
+        self.async_client = AsyncOpenAI(base_url=base_url,
+                                        api_key=open_router_api_key, max_retries=0)
         
 
-    def complete(self, user_messages: List):
+    def _build_request(self, user_messages: List) -> Dict:
         # Don't include the system message here.
         # Image should be provided to locate the enemy.
-
-        response = self.client.chat.completions.create(
+        return dict(
             model= self.model,
             temperature=self.temperature,
             messages=user_messages,
         )
 
+    def complete(self, user_messages: List, cancel_token: Optional[CancellationToken] = None,
+                 retry_budget: Optional[RetryBudget] = None):
+        request = self._build_request(user_messages)
+
+        if cancel_token is not None:
+            content, _, response = self._stream_completion(cancel_token, retry_budget=retry_budget, **request)
+            if response is None or not response.id:
+                self._log_blocked(response)
+                return None, response
+            return content, response
+
+        response = self._create_completion(retry_budget, **request)
+
         if not response.id:
-            print(f"Response blocked: {response}")
+            self._log_blocked(response)
             return None, response
 
         response_message = response.choices[0].message
 
         return response_message.content, response
+
+    async def acomplete(self, user_messages: List, retry_budget: Optional[RetryBudget] = None):
+        response = await self._acreate_completion(retry_budget, **self._build_request(user_messages))
+
+        if not response.id:
+            self._log_blocked(response)
+            return None, response
+
+        return response.choices[0].message.content, response
     
 
 class OpenRouterGameplayModel(OpenAIModel):
+    rate_limit_group = "openrouter"
+    trace_name = "gameplay_model"
+
     # The system message forces the model to always call move_tool for actions
     SYSTEM_MESSAGE = [
         {
@@ -168,24 +393,30 @@ class OpenRouterGameplayModel(OpenAIModel):
     def __init__(self, 
                  tools: Dict[str, BaseTool] = {},
                  model: str = "google/gemini-2.5-flash-preview",
-                 api_key_name: str = "OPENROUTER_API_KEY"):
+                 api_key_name: str = "OPENROUTER_API_KEY",
+                 stream: bool = True,
+                 base_url: str = OPENROUTER_BASE_URL):
+        """
+        :param stream: stream the response and return as soon as the arguments of the
+            first tool call are complete, without waiting for the rest of the response.
+        :param base_url: OpenAI-compatible endpoint, e.g. the stub server of benchmarks/replay_server.py.
+        """
         
         self.model = model
+        self.stream = stream
         self.fallback_models = ["openai/gpt-4.1-mini", "openai/gpt-4.1-nano"]
         open_router_api_key = os.environ.get(api_key_name)
-        self.client = OpenAI(base_url="https://openrouter.ai/api/v1",
-                             api_key=open_router_api_key)
+        self.client = OpenAI(base_url=base_url,
+                             api_key=open_router_api_key, max_retries=0)
+        self.async_client = AsyncOpenAI(base_url=base_url,
+                                        api_key=open_router_api_key, max_retries=0)
         self.tools = tools
 
 
-    def complete(self, user_messages: List):
-        """
-        Sends a conversation to the OpenAI API and processes responses,
-        including tool calls when required.
-        """
+    def _build_request(self, user_messages: List) -> Dict:
                                          # user_messages: the history including the screenshots
         messages = self.SYSTEM_MESSAGE + user_messages + self.INSTRUCTION_MESSAGE
-        response = self.client.chat.completions.create(
+        return dict(
             model=self.model,
             # extra_body={
             #             "models": self.fallback_models
@@ -195,17 +426,62 @@ class OpenRouterGameplayModel(OpenAIModel):
             tool_choice="auto"
         )
 
-        print(response)
+    def complete(self, user_messages: List, cancel_token: Optional[CancellationToken] = None,
+                 retry_budget: Optional[RetryBudget] = None):
+        """
+        Sends a conversation to the OpenAI API and processes responses,
+        including tool calls when required.
+        When streaming, the call returns as soon as the first tool call is complete,
+        and a cancel_token aborts it once its result is no longer needed.
+
+        Returns:
+            tuple: (content, response, tool_calls). When streaming, response is a
+            StreamedResponse.
+        """
+        request = self._build_request(user_messages)
+
+        if self.stream or cancel_token is not None:
+            watcher = ToolCallWatcher(request["tools"])
+            content, tool_calls, response = self._stream_completion(cancel_token, stop_early=watcher.stop_early,
+                                                                      retry_budget=retry_budget, **request)
+            return content, response, watcher.tool_calls(tool_calls)
+
+        response = self._create_completion(retry_budget, **request)
+
         response_message = response.choices[0].message
         tool_calls = None
         if response_message.tool_calls:
             tool_calls = response_message.tool_calls  
         
         return response_message.content, response, tool_calls
+
+    async def acomplete(self, user_messages: List, retry_budget: Optional[RetryBudget] = None):
+        """
+        Async version of complete(). Cancelling the awaiting task closes the HTTP request.
+        The tool calls are returned, not executed - same as complete().
+        """
+        request = self._build_request(user_messages)
+
+        if self.stream:
+            watcher = ToolCallWatcher(request["tools"])
+            content, tool_calls, response = await self._astream_completion(stop_early=watcher.stop_early,
+                                                                             retry_budget=retry_budget, **request)
+            return content, response, watcher.tool_calls(tool_calls)
+
+        response = await self._acreate_completion(retry_budget, **request)
+
+        response_message = response.choices[0].message
+        tool_calls = None
+        if response_message.tool_calls:
+            tool_calls = response_message.tool_calls
+
+        return response_message.content, response, tool_calls
         
         
 
 class AimingModel(BaseOpenRouterModel):
+    trace_name = "aiming_model"
+
     # Only the Qwen2.5 VL models support grounding
     # https://openrouter.ai/qwen/
     ALLOWED_MODELS = [
@@ -246,7 +522,15 @@ class AimingModel(BaseOpenRouterModel):
                  model: str = "qwen/qwen2.5-vl-32b-instruct",
                  system_message: Dict = DEFAULT_SYSTEM_MESSAGE,
                  temperature: Optional[float | None] = None,
-                 api_key_name: str = "OPENROUTER_API_KEY"):
+                 api_key_name: str = "OPENROUTER_API_KEY",
+                 provider_order: List[str] = ["Parasail", "Novita"],
+                 stream: bool = True,
+                 base_url: str = OPENROUTER_BASE_URL):
+        """
+        :param stream: stream the response and return as soon as the point (or "None")
+            can be parsed, see PointStreamParser.
+        :param base_url: OpenAI-compatible endpoint, e.g. the stub server of benchmarks/replay_server.py.
+        """
 
         if model not in self.ALLOWED_MODELS:
             raise ValueError(f"Model '{model}' can't be used for aiming. Allowed models are: {self.ALLOWED_MODELS}")
@@ -254,41 +538,75 @@ class AimingModel(BaseOpenRouterModel):
         self.fallback_models = [m for m in self.MODELS_ORDERED if m != model]
 
         super().__init__(model=model,
-                         api_key_name=api_key_name)
+                         api_key_name=api_key_name,
+                         base_url=base_url)
         self.system_message = system_message
         self.temperature = temperature
+        self.provider_order = provider_order
+        self.stream = stream
 
 
-    def complete(self, user_messages: List, debug: bool = False):
+    def _build_request(self, user_messages: List) -> Dict:
         # Don't include the system message as a parameter
         # Image should be provided to locate the enemy.
         messages = [self.system_message] + user_messages
-        response = self.client.chat.completions.create(
+        return dict(
             model= self.model,
             extra_body={
                         "models": self.fallback_models,
                         "provider": {
-                             "order": ["Parasail", "Novita"],
+                             "order": self.provider_order,
                              "ignore": ["Together", "Nebius"] # Together is expensive. Nebius can't aim
                             },
+                        "usage": {"include": True}, # report the cost of each call
                         },
             temperature=self.temperature,
             messages=messages,
         )
 
+    def _handle_response(self, content, response, debug: bool = False):
         if debug: 
             print(response)
             
-        print("Model:", response.model)
-        print("Provider:", response.provider)
+        log(f"Model: {getattr(response, 'model', None)}")
+        log(f"Provider: {getattr(response, 'provider', None)}")
 
-        if not response.id:
-            print(f"Response blocked: {response}")
+        if response is None or not response.id:
+            self._log_blocked(response)
             return None, response
 
-        response_message = response.choices[0].message
-
-        return response_message.content, response
+        return content, response
+
+    def complete(self, user_messages: List, debug: bool = False,
+                 cancel_token: Optional[CancellationToken] = None,
+                 retry_budget: Optional[RetryBudget] = None):
+        request = self._build_request(user_messages)
+
+        if self.stream or cancel_token is not None:
+            parser = PointStreamParser()
+            content, _, response = self._stream_completion(cancel_token, stop_early=parser.stop_early,
+                                                           retry_budget=retry_budget, **request)
+            content = parser.answer(content)
+        else:
+            response = self._create_completion(retry_budget, **request)
+            content = response.choices[0].message.content if response.choices else None
+
+        return self._handle_response(content, response, debug=debug)
+
+    async def acomplete(self, user_messages: List, debug: bool = False,
+                        retry_budget: Optional[RetryBudget] = None):
+        request = self._build_request(user_messages)
+
+        if self.stream:
+            parser = PointStreamParser()
+            content, _, response = await self._astream_completion(stop_early=parser.stop_early,
+                                                                  retry_budget=retry_budget, **request)
+            content = parser.answer(content)
+        else:
+            response = await self._acreate_completion(retry_budget, **request)
+            content = response.choices[0].message.content if response.choices else None
+
+        return self._handle_response(content, response, debug=debug)
     
     def parse_point_json(self, model_response: str):
         """
@@ -343,21 +661,32 @@ class GeminiAimingModel(AimingModel):
 
     # TODO: Gemini coordinates need to be descaled.
     # see: https://ai.google.dev/gemini-api/docs/image-understanding#bbox
-    def complete(self, user_messages: List):
+    def _build_request(self, user_messages: List) -> Dict:
         # Don't include the system message here.
         # Image should be provided to locate the enemy.
-
-        response = self.client.chat.completions.create(
+        return dict(
             model=self.model,
             messages=user_messages,
         )
 
-        print(response)
+    def complete(self, user_messages: List, cancel_token: Optional[CancellationToken] = None,
+                 retry_budget: Optional[RetryBudget] = None):
+        if cancel_token is not None:
+            content, _, response = self._stream_completion(cancel_token, retry_budget=retry_budget,
+                                                           **self._build_request(user_messages))
+            return content, response
+
+        response = self._create_completion(retry_budget, **self._build_request(user_messages))
 
         response_message = response.choices[0].message
 
         return response_message.content, response
 
+    async def acomplete(self, user_messages: List, retry_budget: Optional[RetryBudget] = None):
+        response = await self._acreate_completion(retry_budget, **self._build_request(user_messages))
+
+        return response.choices[0].message.content, response
+
 
 class MemoryManager:
     def __init__(self):
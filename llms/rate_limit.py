@@ -0,0 +1,317 @@
+"""
+Client-side rate limiting and retries of the model calls.
+
+All models of a provider share one RateLimiter per process (see get_rate_limiter()), so
+several agents in one process stay under the provider quota together:
+
+- a token bucket caps the request rate (requests_per_second, burst)
+- a concurrency limit caps the requests in flight
+- 429s and transient errors (5xx, timeouts, dropped connections) are retried with
+  full-jitter exponential backoff, honouring Retry-After. A 429 also pauses every
+  caller of the limiter until the provider's quota has had time to recover.
+
+The retries are paid from a RetryBudget, which the agent creates once per iteration.
+It is shared by all calls of the iteration and never sleeps past the iteration's deadline,
+so a throttled provider costs a (late) iteration instead of the whole run.
+
+    configure_rate_limiter("openrouter", requests_per_second=5, burst=10, max_concurrency=8)
+"""
+
+import asyncio
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import openai
+
+from llms.cancellation import CancellationToken
+from tracing import log
+
+
+RETRYABLE_STATUS_CODES = (408, 409, 429)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Rate limits, server errors, timeouts and dropped connections. Not: auth, bad requests, cancellation."""
+    if isinstance(error, openai.APIConnectionError):  # includes APITimeoutError
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+def retry_after_of(error: BaseException) -> Optional[float]:
+    """Seconds from the Retry-After header of an API error, if it has a usable one."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return max(0.0, float(headers.get("retry-after")))
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryBudget:
+    """
+    Retries the model calls of one agent iteration may spend, together.
+
+    :param max_retries: retries over all calls of the iteration.
+    :param timeout: seconds from now after which no retry is started any more
+        (the iteration's deadline). None: no deadline.
+    """
+    def __init__(self, max_retries: int = 2, timeout: Optional[float] = None):
+        self.max_retries = max_retries
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def remaining_time(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def allow(self, delay: float) -> bool:
+        """Takes one retry from the budget if there is one left and the retry can start before the deadline."""
+        with self._lock:
+            if self.used >= self.max_retries:
+                return False
+            if self.deadline is not None and time.monotonic() + delay >= self.deadline:
+                return False
+            self.used += 1
+            return True
+
+
+class CombinedRetryBudget:
+    """
+    The RetryBudgets of several callers which share one request, e.g. a batched aiming call.
+    A retry has to fit every budget: it takes one retry from each and must start before the
+    earliest deadline.
+    """
+    def __init__(self, budgets: List[Optional[RetryBudget]]):
+        self.budgets = [budget for budget in budgets if budget is not None]
+
+    def remaining_time(self) -> Optional[float]:
+        remaining = [budget.remaining_time() for budget in self.budgets if budget.deadline is not None]
+        return min(remaining) if remaining else None
+
+    def allow(self, delay: float) -> bool:
+        # all locks at once (in a fixed order), so the retry is taken from every budget or none
+        budgets = sorted(set(self.budgets), key=id)
+        for budget in budgets:
+            budget._lock.acquire()
+        try:
+            now = time.monotonic()
+            if any(budget.used >= budget.max_retries or
+                   (budget.deadline is not None and now + delay >= budget.deadline) for budget in budgets):
+                return False
+            for budget in budgets:
+                budget.used += 1
+            return True
+        finally:
+            for budget in budgets:
+                budget._lock.release()
+
+
+class RateLimiter:
+    def __init__(self,
+                 requests_per_second: Optional[float] = None,
+                 burst: Optional[int] = None,
+                 max_concurrency: Optional[int] = None,
+                 max_retries: int = 2,
+                 base_delay: float = 0.5,
+                 max_delay: float = 8.0):
+        """
+        :param requests_per_second: sustained request rate. None: unlimited.
+        :param burst: requests which may be sent at once after an idle period. Defaults to
+            requests_per_second (at least 1).
+        :param max_concurrency: requests in flight at the same time. None: unlimited.
+        :param max_retries: retries per call when the caller brings no RetryBudget.
+        :param base_delay: backoff of the first retry; it doubles with every further retry
+            up to max_delay and is fully jittered.
+        """
+        if requests_per_second is not None and requests_per_second <= 0:
+            raise ValueError("requests_per_second has to be positive.")
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError("max_concurrency has to be at least 1.")
+
+        self.requests_per_second = requests_per_second
+        self.burst = burst or max(1, int(requests_per_second or 1))
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._condition = threading.Condition()
+        self._random = random.Random()
+
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0        # 429 responses
+        self.transient_errors = 0 # other retryable errors
+        self.gave_up = 0          # retryable errors raised because the budget or deadline was exhausted
+        self.wait_time = 0.0      # seconds callers waited for the bucket, a slot or a 429 pause
+        self.backoff_time = 0.0   # seconds slept between retries
+
+    def _try_acquire(self) -> float:
+        """Takes a token and a slot and returns 0, or returns how long to wait before trying again."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.max_concurrency is not None and self._in_flight >= self.max_concurrency:
+            return 0.05  # woken up early by release() in the threaded case
+        if self.requests_per_second is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.requests_per_second)
+            self._refilled_at = now
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.requests_per_second
+            self._tokens -= 1
+        self._in_flight += 1
+        self.requests += 1
+        return 0.0
+
+    def acquire(self, cancel_token: Optional[CancellationToken] = None):
+        start = time.monotonic()
+        with self._condition:
+            while True:
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                wait = self._try_acquire()
+                if wait == 0:
+                    break
+                self._condition.wait(timeout=min(wait, 0.05) if cancel_token is not None else wait)
+            self.wait_time += time.monotonic() - start
+
+    async def aacquire(self):
+        start = time.monotonic()
+        while True:
+            with self._condition:
+                wait = self._try_acquire()
+            if wait == 0:
+                break
+            await asyncio.sleep(min(wait, 0.05))
+        with self._condition:
+            self.wait_time += time.monotonic() - start
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+    def backoff(self, attempt: int, error: BaseException) -> float:
+        """Full-jitter exponential backoff, or the provider's Retry-After when it sent one."""
+        retry_after = retry_after_of(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _on_error(self, error: BaseException, attempt: int, retry_budget: RetryBudget) -> Optional[float]:
+        """Records a failed attempt. Returns the delay before the retry, or None to give up."""
+        if not is_retryable(error):
+            return None
+
+        delay = self.backoff(attempt, error)
+        with self._condition:
+            if getattr(error, "status_code", None) == 429:
+                self.throttled += 1
+                # the quota is shared, so every caller holds back, not only this one
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            else:
+                self.transient_errors += 1
+
+        if not retry_budget.allow(delay):
+            with self._condition:
+                self.gave_up += 1
+            return None
+
+        with self._condition:
+            self.retries += 1
+            self.backoff_time += delay
+        return delay
+
+    def call(self, fn: Callable, cancel_token: Optional[CancellationToken] = None,
+             retry_budget: Optional[RetryBudget] = None):
+        """Runs fn() within the limits and retries it on retryable errors while the budget allows."""
+        retry_budget = retry_budget or RetryBudget(self.max_retries)
+        attempt = 0
+        while True:
+            self.acquire(cancel_token)
+            try:
+                return fn()
+            except Exception as e:
+                error = e
+                delay = self._on_error(e, attempt, retry_budget)
+                if delay is None:
+                    raise
+            finally:
+                self.release()
+
+            log(f"  [Retry] {type(error).__name__}, retrying in {delay:.2f}s.")
+            if cancel_token is not None and cancel_token.wait(delay):
+                cancel_token.raise_if_cancelled()
+            elif cancel_token is None:
+                time.sleep(delay)
+            attempt += 1
+
+    async def acall(self, coroutine_fn: Callable, retry_budget: Optional[RetryBudget] = None):
+        """Async version of call(). coroutine_fn() creates a new coroutine per attempt."""
+        retry_budget = retry_budget or RetryBudget(self.max_retries)
+        attempt = 0
+        while True:
+            await self.aacquire()
+            try:
+                return await coroutine_fn()
+            except Exception as e:
+                error = e
+                delay = self._on_error(e, attempt, retry_budget)
+                if delay is None:
+                    raise
+            finally:
+                self.release()
+
+            log(f"  [Retry] {type(error).__name__}, retrying in {delay:.2f}s.")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def report(self) -> Dict:
+        with self._condition:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "transient_errors": self.transient_errors,
+                "gave_up": self.gave_up,
+                "in_flight": self._in_flight,
+                "wait_s": round(self.wait_time, 3),
+                "backoff_s": round(self.backoff_time, 3),
+            }
+
+
+_rate_limiters: Dict[str, RateLimiter] = {}
+_registry_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str) -> RateLimiter:
+    """The process-wide limiter of a provider. Created without limits (retries only) on first use."""
+    with _registry_lock:
+        if name not in _rate_limiters:
+            _rate_limiters[name] = RateLimiter()
+        return _rate_limiters[name]
+
+
+def configure_rate_limiter(name: str, **settings) -> RateLimiter:
+    """Replaces the process-wide limiter of a provider. Call it before the agents start."""
+    with _registry_lock:
+        _rate_limiters[name] = RateLimiter(**settings)
+        return _rate_limiters[name]
+
+
+def rate_limiter_report() -> Dict[str, Dict]:
+    with _registry_lock:
+        limiters = dict(_rate_limiters)
+    return {name: limiter.report() for name, limiter in limiters.items()}
@@ -0,0 +1,296 @@
+"""
+Helpers for streamed chat completions.
+
+The models only need a small prefix of their answer to act: the aiming point is known
+once its JSON object is closed, "None" after its first letter, and the movement once
+the key_sequence string of move_tool is closed. The parsers here are fed the stream
+chunk by chunk and tell the model when it can stop reading.
+
+The token usage comes in a chunk of its own after the last content chunk. A stream that
+was stopped early is therefore read to its end in the background (drain_for_usage()),
+without acting on the rest, and its StreamedResponse learns the usage then.
+"""
+
+import asyncio
+import json
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from openai.types.chat.chat_completion_message_tool_call import ChatCompletionMessageToolCall, Function
+
+
+class StreamedResponse:
+    """
+    What a streamed completion returns in place of a response: the id, model and provider of
+    the stream and its token usage. The usage may only be known after the answer was handed
+    out, when_usage() passes it on once it is; None means it stayed unknown, e.g. because the
+    stream was cancelled or the provider did not report it.
+    """
+
+    def __init__(self):
+        self.id: Optional[str] = None
+        self.model: Optional[str] = None
+        self.provider: Optional[str] = None
+        self.usage = None
+        self.resolved = False
+        self._callbacks: List[Callable] = []
+        self._lock = threading.Lock()
+
+    def add(self, chunk):
+        self.id = self.id or getattr(chunk, "id", None)
+        self.model = self.model or getattr(chunk, "model", None)
+        self.provider = self.provider or getattr(chunk, "provider", None)
+        if getattr(chunk, "usage", None) is not None:
+            self.usage = chunk.usage
+
+    def resolve(self):
+        """No more chunks will be read, the usage is what it is."""
+        with self._lock:
+            if self.resolved:
+                return
+            self.resolved = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self.usage)
+
+    def when_usage(self, callback: Callable):
+        """Calls callback(usage) once the stream is resolved, right away if it already is."""
+        with self._lock:
+            if not self.resolved:
+                self._callbacks.append(callback)
+                return
+        callback(self.usage)
+
+    def __repr__(self):
+        return f"StreamedResponse(id={self.id!r}, model={self.model!r}, provider={self.provider!r}, usage={self.usage!r})"
+
+
+def drain_for_usage(stream, response: StreamedResponse, timeout: float = 30.0):
+    """Reads the rest of a stream that was stopped early, without acting on it, until the usage chunk."""
+    deadline = time.perf_counter() + timeout
+    try:
+        for chunk in stream:
+            response.add(chunk)
+            if response.usage is not None or time.perf_counter() > deadline:
+                break
+    except Exception:
+        pass  # the answer was handed out already, only the usage is lost
+    finally:
+        stream.close()
+        response.resolve()
+
+
+async def adrain_for_usage(stream, response: StreamedResponse, timeout: float = 30.0):
+    """Async version of drain_for_usage()."""
+    deadline = time.perf_counter() + timeout
+    try:
+        async for chunk in stream:
+            response.add(chunk)
+            if response.usage is not None or time.perf_counter() > deadline:
+                break
+    except Exception:
+        pass
+    finally:
+        try:
+            await stream.close()
+        finally:
+            response.resolve()
+
+
+_drains = set()  # keeps the background drain tasks alive
+
+
+def start_drain(stream, response: StreamedResponse, timeout: float = 30.0):
+    threading.Thread(target=drain_for_usage, args=(stream, response, timeout), name="stream-drain",
+                     daemon=True).start()
+
+
+def start_adrain(stream, response: StreamedResponse, timeout: float = 30.0):
+    task = asyncio.get_running_loop().create_task(adrain_for_usage(stream, response, timeout))
+    _drains.add(task)
+    task.add_done_callback(_drains.discard)
+
+
+class StreamAccumulator:
+    """Assembles streamed chunks into the content and tool calls a non-streamed response would have."""
+
+    def __init__(self):
+        self.content_parts: List[str] = []
+        self.tool_call_parts: Dict[int, Dict] = {}
+        self.response = StreamedResponse()
+
+    def add(self, chunk) -> Optional[str]:
+        """Adds a chunk and returns its content delta."""
+        self.response.add(chunk)
+        if not chunk.choices:
+            return None
+
+        delta = chunk.choices[0].delta
+        if delta.content:
+            self.content_parts.append(delta.content)
+        for tool_call_delta in delta.tool_calls or []:
+            parts = self.tool_call_parts.setdefault(tool_call_delta.index,
+                                                    {"id": None, "name": "", "arguments": ""})
+            if tool_call_delta.id:
+                parts["id"] = tool_call_delta.id
+            if tool_call_delta.function:
+                parts["name"] += tool_call_delta.function.name or ""
+                parts["arguments"] += tool_call_delta.function.arguments or ""
+        return delta.content
+
+    @property
+    def content(self) -> Optional[str]:
+        return "".join(self.content_parts) if self.content_parts else None
+
+    def tool_calls(self) -> Optional[List[ChatCompletionMessageToolCall]]:
+        tool_calls = [
+            ChatCompletionMessageToolCall(id=parts["id"] or f"call_{index}",
+                                          type="function",
+                                          function=Function(name=parts["name"], arguments=parts["arguments"]))
+            for index, parts in sorted(self.tool_call_parts.items())
+        ]
+        return tool_calls or None
+
+
+class PointStreamParser:
+    """
+    Incremental parser of the aiming answer.
+
+    Decides as early as possible:
+    - 'None' / 'null' / 'No ...': no target, after the first letter
+    - {"point": {"x": .., "y": ..}}: the point, as soon as the point object is closed
+    - any other JSON object: no target, once the object is closed
+    Anything else is left to parse_point_json() once the stream ended.
+    """
+    _POINT = re.compile(r'"point"\s*:\s*(\{[^{}]*\})')
+
+    def __init__(self):
+        self.buffer = ""
+        self.decided = False
+        self.point: Optional[Dict[str, int]] = None
+
+    def _decide(self, point: Optional[Dict[str, int]]) -> bool:
+        self.decided = True
+        self.point = point
+        return True
+
+    def feed(self, text: Optional[str]) -> bool:
+        """Adds streamed content. Returns True once the answer is decided."""
+        if self.decided:
+            return True
+        if not text:
+            return False
+        self.buffer += text
+
+        stripped = self.buffer.lstrip().lstrip("`").lstrip()
+        if stripped[:4].lower() == "json":
+            stripped = stripped[4:].lstrip()
+        if not stripped or "json".startswith(stripped.lower()):
+            return False
+        if stripped[0] in "nN":
+            return self._decide(None)
+        if stripped[0] != "{":
+            return False
+
+        match = self._POINT.search(stripped)
+        if match:
+            try:
+                point = json.loads(match.group(1))
+                return self._decide({"x": int(point["x"]), "y": int(point["y"])})
+            except (ValueError, KeyError, TypeError):
+                return self._decide(None)
+
+        if _object_closed(stripped):
+            return self._decide(None)
+        return False
+
+    def answer(self, content: Optional[str]) -> Optional[str]:
+        """The answer to hand to parse_point_json(): canonical JSON once decided, else the raw content."""
+        if not self.decided:
+            return content
+        if self.point is None:
+            return "None"
+        return json.dumps({"point": self.point})
+
+    def stop_early(self, content_delta: Optional[str], tool_call_parts: Dict) -> bool:
+        return self.feed(content_delta)
+
+
+def _object_closed(text: str) -> bool:
+    """Whether the JSON object text starts with is closed, ignoring braces inside strings."""
+    depth = 0
+    in_string = False
+    escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return True
+    return False
+
+
+def complete_arguments(arguments: str, required: List[str]) -> Optional[Dict]:
+    """
+    The arguments of a streamed tool call once all `required` ones are complete, else None.
+    String arguments count as complete as soon as their closing quote arrived.
+    """
+    try:
+        parsed = json.loads(arguments)
+        if isinstance(parsed, dict) and all(name in parsed for name in required):
+            return parsed
+    except json.JSONDecodeError:
+        pass
+
+    parsed = {}
+    for name in required:
+        match = re.search(r'"%s"\s*:\s*"((?:[^"\\]|\\.)*)"' % re.escape(name), arguments)
+        if match is None:
+            return None
+        parsed[name] = json.loads(f'"{match.group(1)}"')
+    return parsed
+
+
+class ToolCallWatcher:
+    """
+    Watches the first streamed tool call and stops the stream once its required arguments are complete,
+    so the movement can be executed without waiting for the rest of the response.
+    """
+    def __init__(self, function_schemas: List[Dict]):
+        self.required = {
+            schema["function"]["name"]: schema["function"].get("parameters", {}).get("required", [])
+            for schema in function_schemas
+        }
+        self.tool_call: Optional[ChatCompletionMessageToolCall] = None
+
+    def stop_early(self, content_delta: Optional[str], tool_call_parts: Dict) -> bool:
+        if self.tool_call is not None:
+            return True
+        parts = tool_call_parts.get(0)
+        if parts is None or parts["name"] not in self.required or not self.required[parts["name"]]:
+            return False
+
+        arguments = complete_arguments(parts["arguments"], self.required[parts["name"]])
+        if arguments is None:
+            return False
+        self.tool_call = ChatCompletionMessageToolCall(id=parts["id"] or "call_0",
+                                                       type="function",
+                                                       function=Function(name=parts["name"],
+                                                                         arguments=json.dumps(arguments)))
+        return True
+
+    def tool_calls(self, streamed_tool_calls):
+        """The early tool call if there was one, else what the stream delivered."""
+        return [self.tool_call] if self.tool_call is not None else streamed_tool_calls
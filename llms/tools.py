@@ -1,6 +1,9 @@
 from abc import ABC, abstractmethod
+from typing import Optional
 from e2b_desktop import Sandbox
 
+from counter_strike.input_script import InputScript
+
 class BaseTool(ABC):
     @property
     @abstractmethod
@@ -40,27 +43,41 @@ class MoveTool(BaseTool):
         }
     }
 
-    def __init__(self, desktop: "Sandbox"):
+    def __init__(self, desktop: "Sandbox", camera_motion=None):
+        """
+        :param camera_motion: counter_strike.compensation.CameraMotion which logs the turns.
+        """
         self.desktop = desktop
+        self.camera_motion = camera_motion
 
-    def execute_turning(self, direction: str):
+    def execute_turning(self, direction: str, script: Optional[InputScript] = None):
+        script = script if script is not None else InputScript()
         if direction == "r":     
-            self.desktop.move_mouse(1380, 540) # keep y constant
+            script.move_mouse(1380, 540) # keep y constant
         if direction == "l":                  # 960 would be the middle for x. We are moving 320 pixels
-            self.desktop.move_mouse(540, 540) 
-    
-    def execute(self, key_sequence: str):
+            script.move_mouse(540, 540) 
+        return script
+
+    def compile(self, key_sequence: str) -> InputScript:
+        """The whole movement as one input script, see counter_strike.input_script."""
+        script = InputScript()
         sequence_to_write = ""
         for action in key_sequence:
             if (action == "r") or (action == "l"):
                 if sequence_to_write != "": 
-                    self.desktop.write(sequence_to_write) # execute the actions before turning
+                    script.write(sequence_to_write) # execute the actions before turning
                     sequence_to_write = ""
 
-                self.execute_turning(action)
+                self.execute_turning(action, script)
             else:
                 sequence_to_write += action * 10
 
+        script.write(sequence_to_write)
+        return script
+    
+    def execute(self, key_sequence: str):
         # print(f"moving with key sequence: {key_sequence}")
-        # print(sequence_to_write)
-        self.desktop.write(sequence_to_write)
+        script = self.compile(key_sequence)
+        script.run(self.desktop)
+        if self.camera_motion is not None:
+            self.camera_motion.record_script(script)
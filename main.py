@@ -1,60 +1,153 @@
+import argparse
 import os
-from e2b_desktop import Sandbox, CommandExitException
+from typing import Optional
 from dotenv import load_dotenv
-from dataclasses import dataclass
-load_dotenv()
 
 
-from counter_strike.install_cs import install_cs_1_6, connect_to_server, choose_team
+from counter_strike.install_cs import install_cs_1_6, install_ffmpeg, connect_to_server, choose_team
+from counter_strike.capture import SandboxEncodeBackend
+from counter_strike.frame_source import FrameGrabber
+from counter_strike.tracking import TargetTracker
+from counter_strike.compensation import CameraMotion, LatencyCompensator
+from counter_strike.calibration import AimCalibration, calibrate_aim
+from counter_strike.image_handling import set_aim_calibration
+from tracing import Tracer, set_tracer
 from counter_strike.agent import run_agent, AgentSettings
+from counter_strike.detection import AimingGate, EnemyCandidateDetector
+from counter_strike.fleet import Fleet, FleetAgent, create_sandbox
 
 from llms.models import AimingModel, OpenRouterGameplayModel
+from llms.rate_limit import configure_rate_limiter
 from llms.tools import MoveTool
 
 
-E2B_API_KEY = os.environ.get("E2B_API_KEY")
-CS_SERVER_IP = os.environ.get("CS_SERVER_IP")
+def run_single_agent(server_ip: str, side: str = "CT", iterations: int = 70, sandbox_capture: bool = False,
+                     grab_frames: bool = False, track: bool = False, compensate: bool = False,
+                     calibrate_aim_to: Optional[str] = None):
+    desktop = create_sandbox()
 
-desktop = Sandbox(
-    display=":0",  
-    resolution=(1920, 1080),  # keep this resolution
-    timeout = 3600) 
-desktop.stream.start()
+    agent_setting = AgentSettings(
+        side = side,
+        memory=4, # remember three images from the past
+        open_router_api_key_name="OPENROUTER_API_KEY"
+    )
 
-# Get stream URL
-url = desktop.stream.get_url()
-print(url)
-url_view = desktop.stream.get_url(view_only=True) # only viewing 
-print(url_view)
-        
-agent_setting = AgentSettings(
-    side = "CT",
-    memory=4, # remember three images from the past
-    open_router_api_key_name="OPENROUTER_API_KEY"
-)
+    aiming_model = AimingModel(model="qwen/qwen2.5-vl-72b-instruct",
+                               system_message=agent_setting.aiming_system_prompt,
+                               api_key_name=agent_setting.open_router_key_name)
 
-aiming_model = AimingModel(model="qwen/qwen2.5-vl-72b-instruct",
-                           system_message=agent_setting.aiming_system_prompt,
-                           api_key_name=agent_setting.open_router_key_name)
+    # Skips the aiming call on frames without any enemy-coloured region
+    aiming_gate = AimingGate(EnemyCandidateDetector(side=agent_setting.side, threshold=0.3))
 
-move_tool = MoveTool(desktop=desktop)
-tools = {move_tool.name: move_tool}
+    # logs our own turns, so stale aiming points can be moved into the current view
+    camera_motion = CameraMotion() if compensate else None
+    move_tool = MoveTool(desktop=desktop, camera_motion=camera_motion)
+    tools = {move_tool.name: move_tool}
 
-gameplay_model = OpenRouterGameplayModel(tools=tools, 
-                                         model="google/gemini-2.5-flash-preview",
-                                         #model="anthropic/claude-3.5-haiku:beta",
-                                         api_key_name=agent_setting.open_router_key_name)
+    gameplay_model = OpenRouterGameplayModel(tools=tools,
+                                             model="google/gemini-2.5-flash-preview",
+                                             #model="anthropic/claude-3.5-haiku:beta",
+                                             api_key_name=agent_setting.open_router_key_name)
 
-
-if __name__=="__main__":
     install_cs_1_6(desktop=desktop)
-    connect_to_server(desktop=desktop, ip_address=CS_SERVER_IP)
+    connect_to_server(desktop=desktop, ip_address=server_ip)
     choose_team(desktop=desktop,
                 team_option=agent_setting.team_choice,
                 skin=agent_setting.skin_choice)
-    
-    run_agent(aiming_model=aiming_model,
-              gameplay_model=gameplay_model,
-              desktop=desktop,
-              memory_capacity=agent_setting.memory,
-              iterations=70) # For demonstration 
+
+    if calibrate_aim_to:
+        calibration = calibrate_aim(desktop)
+        calibration.save(calibrate_aim_to)
+        set_aim_calibration(calibration)
+
+    capture_backend = None
+    if sandbox_capture:
+        install_ffmpeg(desktop=desktop)
+        capture_backend = SandboxEncodeBackend(format="jpeg", quality=80)
+
+    frame_source = FrameGrabber(desktop, backend=capture_backend) if grab_frames else None
+    try:
+        run_agent(aiming_model=aiming_model,
+                  gameplay_model=gameplay_model,
+                  desktop=desktop,
+                  memory_capacity=agent_setting.memory,
+                  aiming_gate=aiming_gate,
+                  capture_backend=capture_backend,
+                  frame_source=frame_source,
+                  tracker=TargetTracker() if track else None,
+                  compensator=LatencyCompensator(camera_motion) if compensate else None,
+                  iterations=iterations) # For demonstration
+    finally:
+        if frame_source is not None:
+            frame_source.close()
+
+
+def run_match(server_ip: str, ct: int, t: int, iterations: int = 70, max_concurrency: int = 8,
+              batch_aiming: bool = False):
+    agents = [FleetAgent(f"ct{i + 1}", AgentSettings(side="CT", memory=4), iterations=iterations) for i in range(ct)] + \
+             [FleetAgent(f"t{i + 1}", AgentSettings(side="T", memory=4), iterations=iterations) for i in range(t)]
+
+    with Fleet(agents, server_ip=server_ip, max_concurrency=max_concurrency, batch_aiming=batch_aiming) as fleet:
+        fleet.provision()
+        results = fleet.run()
+
+    for result in results:
+        print(f"{result['name']:>5} {result['side']:>2}: {result['elapsed']:.1f}s, "
+              f"error={result['error']}, scheduler={result['scheduler']}")
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Runs one agent, or a match of several agents with --ct/--t.")
+    parser.add_argument("--side", choices=["CT", "T"], default="CT", help="side of the single agent")
+    parser.add_argument("--ct", type=int, default=0, help="number of CT agents in a match")
+    parser.add_argument("--t", type=int, default=0, help="number of T agents in a match")
+    parser.add_argument("--iterations", type=int, default=70)
+    parser.add_argument("--max-concurrency", type=int, default=8,
+                        help="model calls in flight at the same time, over all agents of a match")
+    parser.add_argument("--batch-aiming", action="store_true",
+                        help="tile the aiming requests of the agents of one side into shared requests")
+    parser.add_argument("--sandbox-capture", action="store_true",
+                        help="capture and encode the screenshots inside the sandbox with ffmpeg (single agent)")
+    parser.add_argument("--grab-frames", action="store_true",
+                        help="capture frames continuously in the background and act on the freshest one (single agent)")
+    parser.add_argument("--track", action="store_true",
+                        help="follow a detected target locally and shoot again without model calls (single agent)")
+    parser.add_argument("--compensate", action="store_true",
+                        help="correct stale aiming points for our own turns and lead moving targets (single agent)")
+    parser.add_argument("--aim-calibration", help="aim with the calibration table saved at this path")
+    parser.add_argument("--calibrate-aim", metavar="PATH",
+                        help="calibrate the aim once in game, save the table to PATH and use it (single agent)")
+    parser.add_argument("--requests-per-second", type=float, default=None,
+                        help="OpenRouter request rate shared by all agents of this process")
+    parser.add_argument("--trace-dir",
+                        help="append the stage spans to DIR/trace.jsonl and keep Prometheus metrics in DIR/agent.prom")
+    parser.add_argument("--verbose", action="store_true", help="print the progress of every iteration")
+    args = parser.parse_args()
+
+    tracer = Tracer(jsonl_path=os.path.join(args.trace_dir, "trace.jsonl") if args.trace_dir else None,
+                    prometheus_path=os.path.join(args.trace_dir, "agent.prom") if args.trace_dir else None,
+                    verbose=args.verbose)
+    set_tracer(tracer)
+
+    if args.aim_calibration:
+        set_aim_calibration(AimCalibration.load(args.aim_calibration))
+    if args.requests_per_second is not None:
+        configure_rate_limiter("openrouter", requests_per_second=args.requests_per_second)
+
+    server_ip = os.environ.get("CS_SERVER_IP")
+    try:
+        if args.ct or args.t:
+            run_match(server_ip, ct=args.ct, t=args.t, iterations=args.iterations,
+                      max_concurrency=args.max_concurrency, batch_aiming=args.batch_aiming)
+        else:
+            run_single_agent(server_ip, side=args.side, iterations=args.iterations,
+                             sandbox_capture=args.sandbox_capture, grab_frames=args.grab_frames, track=args.track,
+                             compensate=args.compensate, calibrate_aim_to=args.calibrate_aim)
+    finally:
+        tracer.close()
+
+
+if __name__=="__main__":
+    main()
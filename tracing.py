@@ -0,0 +1,290 @@
+"""
+Per-stage tracing and metrics.
+
+The agent loop, the frame encodes and the model calls report their durations as spans
+to the process-wide Tracer (see get_tracer()): capture, encode, every model call
+(tagged with the model, the provider and the token usage), actuation, memory update
+and the capture-to-action decision latency. The tracer keeps a rolling histogram per
+stage for the p50 / p99 of the recent calls, and an exporter thread writes
+
+- every span as one JSON line (jsonl_path), to aggregate over many sessions offline
+- a Prometheus text file (prometheus_path) with cumulative histograms and counters,
+  for the node_exporter textfile collector
+
+The hot path only appends to memory, the files are written every `export_interval`
+seconds. Progress messages go through log(), which prints only when the tracer is verbose.
+
+    tracer = Tracer(jsonl_path="traces/ct_1.jsonl", prometheus_path="metrics/ct_1.prom",
+                    labels={"agent": "ct_1"})
+    set_tracer(tracer)
+    run_agent(...)
+    tracer.close()
+"""
+
+import bisect
+import collections
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+
+# seconds; from the cached encodes up to throttled model calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0)
+
+# span tags which split the histograms. All other tags only go to the JSONL trace.
+# Failed and cancelled spans (tagged with the error) get histograms of their own.
+HISTOGRAM_TAGS = ("model", "provider", "variant", "action", "error")
+
+
+class RollingHistogram:
+    """
+    Percentiles over the last `window` values, plus cumulative bucket counts, count and sum
+    over all of them (what Prometheus histograms expect).
+    """
+
+    def __init__(self, window: int = 2048, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._window: Deque[float] = collections.deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self._window.append(value)
+
+    def percentile(self, q: float) -> float:
+        """Nearest-rank percentile (0-100) of the rolling window."""
+        if not self._window:
+            return 0.0
+        ordered = sorted(self._window)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+    def report(self) -> Dict:
+        return {
+            "count": self.count,
+            "p50_ms": round(1000 * self.percentile(50), 1),
+            "p90_ms": round(1000 * self.percentile(90), 1),
+            "p99_ms": round(1000 * self.percentile(99), 1),
+            "max_ms": round(1000 * max(self._window), 1) if self._window else 0.0,
+        }
+
+
+class Span:
+    """A timed stage. Tags can be added while it runs, e.g. the token usage of a model response."""
+    __slots__ = ("name", "tags", "start", "duration", "deferred")
+
+    def __init__(self, name: str, tags: Dict):
+        self.name = name
+        self.tags = tags
+        self.start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.deferred = False
+
+    def tag(self, **tags):
+        self.tags.update(tags)
+
+    def defer(self):
+        """Keeps span() from recording the span on exit, for tags that only arrive later, e.g. the
+        usage of a stream. Its duration still ends at the exit, finish() records it."""
+        self.deferred = True
+
+
+def _metric_key(name: str, tags: Dict) -> Tuple:
+    return (name,) + tuple((tag, str(tags[tag])) for tag in HISTOGRAM_TAGS if tags.get(tag) is not None)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Tracer:
+    def __init__(self,
+                 jsonl_path: Optional[str] = None,
+                 prometheus_path: Optional[str] = None,
+                 labels: Optional[Dict[str, str]] = None,
+                 window: int = 2048,
+                 buckets: Sequence[float] = DEFAULT_BUCKETS,
+                 export_interval: float = 5.0,
+                 max_pending: int = 100_000,
+                 metric_prefix: str = "cs_agent",
+                 verbose: bool = False):
+        """
+        :param jsonl_path: file the spans are appended to, one JSON object per line.
+        :param prometheus_path: Prometheus text file, rewritten (atomically) on every export.
+        :param labels: constant labels of every metric and span, e.g. the agent's name.
+        :param window: values per rolling histogram the percentiles are computed from.
+        :param export_interval: seconds between two writes of the files.
+        :param max_pending: spans kept for the JSONL file between two exports, more are dropped.
+        :param verbose: print the log() messages.
+        """
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.labels = dict(labels or {})
+        self.window = window
+        self.buckets = tuple(buckets)
+        self.export_interval = export_interval
+        self.max_pending = max_pending
+        self.metric_prefix = metric_prefix
+        self.verbose = verbose
+        self.session = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+        self._histograms: Dict[Tuple, RollingHistogram] = {}
+        self._counters: Dict[Tuple, float] = {}
+        self._pending: List[Dict] = []
+        self.spans = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+
+        self._stop = threading.Event()
+        self._thread = None
+        if jsonl_path or prometheus_path:
+            for path in (jsonl_path, prometheus_path):
+                if path and os.path.dirname(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._thread = threading.Thread(target=self._export_loop, name="tracer-export", daemon=True)
+            self._thread.start()
+
+    @contextmanager
+    def span(self, name: str, **tags):
+        """Times the block as a span of stage `name`. Failed blocks are tagged with the error."""
+        span = Span(name, tags)
+        try:
+            yield span
+        except BaseException as e:
+            span.tags["error"] = type(e).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - span.start
+            if not span.deferred:
+                self.finish(span)
+
+    def finish(self, span: Span):
+        """Records a span started with Span() or deferred; span() does this on exit."""
+        if span.duration is None:
+            span.duration = time.perf_counter() - span.start
+        self.record(span.name, span.duration, start=span.start, **span.tags)
+
+    def record(self, name: str, seconds: float, start: Optional[float] = None, **tags):
+        """Records a duration measured elsewhere, e.g. the capture-to-action time of a frame."""
+        key = _metric_key(name, tags)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = RollingHistogram(self.window, self.buckets)
+            histogram.observe(seconds)
+            self.spans += 1
+            if self.jsonl_path:
+                if len(self._pending) < self.max_pending:
+                    self._pending.append({"name": name, "duration_ms": round(1000 * seconds, 3),
+                                          "start": start, "wall_time": time.time(), **tags})
+                else:
+                    self.dropped += 1
+
+    def add(self, name: str, value: float = 1, **labels):
+        """Adds to the counter `name`, e.g. the tokens of a model, split by `labels`."""
+        key = (name,) + tuple(sorted((label, str(label_value)) for label, label_value in labels.items()))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def log(self, message: str):
+        if self.verbose:
+            print(message)
+
+    def percentile(self, name: str, q: float, **tags) -> float:
+        """Percentile (0-100) in seconds of the recent spans of a stage."""
+        with self._lock:
+            histogram = self._histograms.get(_metric_key(name, tags))
+            return histogram.percentile(q) if histogram is not None else 0.0
+
+    def report(self) -> Dict[str, Dict]:
+        """Rolling p50 / p90 / p99 per stage (and model, provider, ... where tagged)."""
+        with self._lock:
+            return {"/".join([key[0]] + [value for _, value in key[1:]]): histogram.report()
+                    for key, histogram in sorted(self._histograms.items())}
+
+    def prometheus_text(self) -> str:
+        with self._lock:
+            histograms = [(key, list(h.bucket_counts), h.count, h.sum) for key, h in sorted(self._histograms.items())]
+            counters = sorted(self._counters.items())
+
+        def label_text(pairs) -> str:
+            pairs = list(self.labels.items()) + list(pairs)
+            return "{" + ",".join(f'{label}="{_escape(str(value))}"' for label, value in pairs) + "}" if pairs else ""
+
+        metric = f"{self.metric_prefix}_stage_seconds"
+        lines = [f"# HELP {metric} Duration of the agent's stages and model calls.", f"# TYPE {metric} histogram"]
+        for key, bucket_counts, count, total in histograms:
+            pairs = [("stage", key[0])] + list(key[1:])
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{metric}_bucket{label_text(pairs + [('le', le)])} {cumulative}")
+            lines.append(f"{metric}_sum{label_text(pairs)} {total}")
+            lines.append(f"{metric}_count{label_text(pairs)} {count}")
+
+        declared = set()
+        for key, value in counters:
+            name = f"{self.metric_prefix}_{key[0]}_total"
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{label_text(key[1:])} {value}")
+        return "\n".join(lines) + "\n"
+
+    def export(self):
+        """Writes the pending spans and the Prometheus file now."""
+        with self._export_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if self.jsonl_path and pending:
+                common = {"session": self.session, **self.labels}
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.writelines(json.dumps({**common, **span}, default=str) + "\n" for span in pending)
+            if self.prometheus_path:
+                temporary = f"{self.prometheus_path}.{os.getpid()}.tmp"
+                with open(temporary, "w", encoding="utf-8") as f:
+                    f.write(self.prometheus_text())
+                os.replace(temporary, self.prometheus_path)  # the collector never reads half a file
+
+    def _export_loop(self):
+        while not self._stop.wait(self.export_interval):
+            try:
+                self.export()
+            except OSError as e:
+                print(f"  [Tracing] Export failed: {e}")
+
+    def close(self):
+        """Stops the exporter thread after a last export."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            self.export()
+
+
+_tracer = Tracer()
+
+
+def set_tracer(tracer: Tracer):
+    """Makes `tracer` the process-wide tracer the agent, the frames and the models report to."""
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def log(message: str):
+    """Progress messages of the hot path, printed only by a verbose tracer."""
+    _tracer.log(message)